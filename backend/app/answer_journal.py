@@ -0,0 +1,333 @@
+"""
+答题写后日志（write-behind）
+拼写检查的调度结果同步计算并立即返回，进度写入先进入内存日志，
+由后台线程每隔几毫秒或每累积 N 条合并为一个事务写入 progress 表
+"""
+import logging
+import os
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import crud, daily_stats, review_log
+from .cache import cache, deck_tag, PROGRESS_TAG
+from .database import SessionLocal
+from .scheduler import GRADE_GOOD, ProgressSnapshot
+
+logger = logging.getLogger(__name__)
+
+# 是否启用写后模式（默认关闭，每次答题同步提交）
+WRITE_BEHIND_ENABLED = os.getenv("SPELL_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+# 最长合并等待时间（毫秒）
+WRITE_BEHIND_INTERVAL_MS = int(os.getenv("SPELL_WRITE_BEHIND_INTERVAL_MS", "50"))
+# 累积多少条答题后立即写入
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("SPELL_WRITE_BEHIND_BATCH_SIZE", "200"))
+# 单个单词最多写入失败几次，之后移入死信列表（记录日志后不再重试）
+WRITE_BEHIND_MAX_ATTEMPTS = int(os.getenv("SPELL_WRITE_BEHIND_MAX_ATTEMPTS", "5"))
+
+# 连续写入失败时后台线程等待时间的上限（秒）
+_MAX_BACKOFF = 5.0
+# 保留的死信条数
+_DEAD_LETTER_SIZE = 1000
+
+# SQLite 单条语句的参数数量有限，IN 查询按块执行
+_IN_CHUNK_SIZE = 500
+
+class AnswerJournal:
+    """答题写后日志
+
+    同一单词在两次写入之间的多次答题会合并为一个最终状态，
+    计算新状态时优先读取日志中尚未落库的快照，保证结果与同步模式一致；
+    其它 worker 先写入了同一单词时，写入前基于最新进度重新计算，不会覆盖对方的答题。
+    整批写入失败时逐个单词重试，反复失败的单词移入死信列表，不会阻塞其它答题。
+    """
+
+    def __init__(self, session_factory: Callable[[], Session],
+                 flush_interval: float = 0.05, batch_size: int = 200,
+                 max_attempts: int = WRITE_BEHIND_MAX_ATTEMPTS):
+        """
+        Args:
+            session_factory: 后台写入使用的数据库会话工厂
+            flush_interval: 最长合并等待时间（秒）
+            batch_size: 累积多少条答题后立即写入
+            max_attempts: 单个单词最多写入失败几次
+        """
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+
+        self._pending: Dict[int, ProgressSnapshot] = {}  # 等待写入
+        self._inflight: Dict[int, ProgressSnapshot] = {}  # 正在写入
+        self._log: List[dict] = []  # 等待写入的答题日志（每次答题一条）
+        self._stats: List[Tuple[int, dict]] = []  # 等待写入的每日统计增量 (word_id, 增量)
+        self._entries = 0  # 自上次写入以来的答题条数
+        self._attempts: Dict[int, int] = {}  # 各单词连续写入失败的次数
+        self._dead_letters: "deque[dict]" = deque(maxlen=_DEAD_LETTER_SIZE)
+        self._failures = 0  # 连续写入失败的次数（后台线程据此退避）
+        self._epoch = 0  # 每次进度写入提交后递增，record 据此判断读取的进度是否已过期
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+
+    def _ensure_started(self):
+        """懒启动后台写入线程（调用方需持有 _cond）"""
+        if self._thread is None or not self._thread.is_alive():
+            self._closed = False
+            self._thread = threading.Thread(
+                target=self._run, name="answer-journal", daemon=True
+            )
+            self._thread.start()
+
+    def record(self, db: Session, word_id: int, is_correct: bool) -> ProgressSnapshot:
+        """记录一次答题，同步返回调度后的进度状态
+
+        数据库读取不持有锁；读取期间有进度写入提交（且日志中没有该单词）时重新读取。
+
+        Args:
+            db: 当前请求的数据库会话（仅用于读取尚未缓存的进度）
+            word_id: 单词ID
+            is_correct: 是否答对
+        """
+        while True:
+            with self._cond:
+                epoch = self._epoch
+            rows = crud.get_scheduling_rows(db, [word_id])
+            word, progress, params = rows.get(word_id, (None, None, None))
+            deck_id = word.deck_id if word else None
+
+            with self._cond:
+                current = self._pending.get(word_id) or self._inflight.get(word_id)
+                if current is None:
+                    if epoch != self._epoch:
+                        db.expire_all()
+                        continue
+                    current = progress
+
+                snapshot = ProgressSnapshot.from_progress(word_id, current)
+                previous_review = snapshot.next_review
+                self._log.append(review_log.make_entry(word_id, is_correct, snapshot))
+                self._stats.append((word_id, daily_stats.answer_row(deck_id, current, is_correct)))
+                crud.apply_answer(snapshot, is_correct, params=params)
+
+                self._pending[word_id] = snapshot
+                self._entries += 1
+                self._ensure_started()
+                if self._entries == 1 or self._entries >= self.batch_size:
+                    self._cond.notify()
+                break
+
+        # 内存索引按答题时的结果更新，不等待落库
+        crud.notify_progress_writes([(word_id, deck_id, previous_review, snapshot.next_review,
+                                      snapshot.mastery_level, snapshot.error_count)])
+        return snapshot
+
+    def _write(self, batch: Dict[int, ProgressSnapshot], log_entries: List[dict],
+               stats_rows: List[Tuple[int, dict]]):
+        """在一个事务中写入进度快照、答题日志和每日统计
+
+        进度以与 crud.update_progress 相同的带条件 UPSERT 写入，条件为快照所基于的 review_count：
+        单词在读取后被其它 worker 修改时，按顺序基于最新进度重新计算该单词的答题后再写入。
+        """
+        answers = Counter(entry["word_id"] for entry in log_entries)
+        states = {word_id: (snapshot, snapshot.review_count - answers[word_id]) for word_id, snapshot in batch.items()}
+        recomputed: Dict[int, Tuple[ProgressSnapshot, int]] = {}
+        db = self.session_factory()
+        try:
+            for _ in range(crud.UPDATE_PROGRESS_ATTEMPTS):
+                conflicts = crud.write_progress_states(db, states.values())
+                if not conflicts:
+                    break
+                db.rollback()
+                conflicted = set(conflicts)
+                replay = [entry for entry in log_entries if entry["word_id"] in conflicted]
+                log_entries = [entry for entry in log_entries if entry["word_id"] not in conflicted]
+                stats_rows = [row for row in stats_rows if row[0] not in conflicted]
+                for word_id in conflicted:
+                    del states[word_id]
+                for word_id, (snapshot, prior_review_count, deck_id, entries, rows) in self._recompute(db, replay).items():
+                    states[word_id] = (snapshot, prior_review_count)
+                    recomputed[word_id] = (snapshot, deck_id)
+                    log_entries += entries
+                    stats_rows += rows
+            else:
+                raise RuntimeError(f"单词 {sorted(conflicts)} 的学习进度并发修改冲突")
+
+            review_log.append(db, log_entries)
+            daily_stats.upsert(db, [row for _, row in stats_rows])
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        cache.invalidate_tags(PROGRESS_TAG, *{deck_tag(row["deck_id"]) for _, row in stats_rows})
+        # 内存索引此前按日志中的快照更新，改为重新计算后的结果
+        crud.notify_progress_writes(
+            (word_id, deck_id, batch[word_id].next_review, snapshot.next_review,
+             snapshot.mastery_level, snapshot.error_count)
+            for word_id, (snapshot, deck_id) in recomputed.items()
+        )
+
+    def _recompute(self, db: Session, entries: List[dict]) -> Dict[int, tuple]:
+        """基于数据库中的最新进度按顺序重新计算答题（保留原答题时间），已删除的单词忽略
+
+        Returns:
+            {word_id: (新状态, 读取时的 review_count, 所属词库, 答题日志, 每日统计增量)}
+        """
+        rows = crud.get_scheduling_rows(db, list(dict.fromkeys(entry["word_id"] for entry in entries)))
+        results: Dict[int, tuple] = {}
+        for entry in entries:
+            word_id = entry["word_id"]
+            if word_id not in rows:
+                continue
+            word, progress, params = rows[word_id]
+            if word_id in results:
+                snapshot, _, _, log, stats = results[word_id]
+                prior = snapshot
+            else:
+                snapshot = ProgressSnapshot.from_progress(word_id, progress)
+                log, stats = [], []
+                results[word_id] = (snapshot, snapshot.review_count, word.deck_id, log, stats)
+                prior = progress
+            is_correct = entry["grade"] == GRADE_GOOD
+            log.append(review_log.make_entry(word_id, is_correct, snapshot, now=entry["reviewed_at"]))
+            stats.append((word_id, daily_stats.answer_row(word.deck_id, prior, is_correct)))
+            crud.apply_answer(snapshot, is_correct, params=params)
+        return results
+
+    def _write_each(self, batch: Dict[int, ProgressSnapshot], log_entries: List[dict],
+                    stats_rows: List[Tuple[int, dict]]) -> Dict[int, str]:
+        """逐个单词写入（整批失败时使用），返回写入失败的单词及错误"""
+        failed = {}
+        for word_id, snapshot in batch.items():
+            try:
+                self._write(
+                    {word_id: snapshot},
+                    [entry for entry in log_entries if entry["word_id"] == word_id],
+                    [row for row in stats_rows if row[0] == word_id]
+                )
+            except Exception as e:
+                failed[word_id] = str(e)
+        return failed
+
+    def _flush_locked(self) -> int:
+        """写入等待中的答题（调用方需持有 _flush_lock）"""
+        with self._cond:
+            if not self._pending:
+                return 0
+            batch = self._pending
+            self._pending = {}
+            log_entries = self._log
+            self._log = []
+            stats_rows = self._stats
+            self._stats = []
+            self._inflight = batch
+            self._entries = 0
+
+        failed: Dict[int, str] = {}
+        try:
+            self._write(batch, log_entries, stats_rows)
+        except Exception as e:
+            logger.warning(f"Answer journal batch flush failed, retrying word by word: {str(e)}")
+            failed = self._write_each(batch, log_entries, stats_rows)
+
+        with self._cond:
+            self._inflight = {}
+            self._epoch += 1
+            self._failures = self._failures + 1 if failed else 0
+            for word_id in batch:
+                if word_id not in failed:
+                    self._attempts.pop(word_id, None)
+            for word_id, error in failed.items():
+                attempts = self._attempts.get(word_id, 0) + 1
+                entries = [entry for entry in log_entries if entry["word_id"] == word_id]
+                if attempts >= self.max_attempts:
+                    # 放弃写入：记录死信，较新的答题（基于该快照计算）仍会继续写入
+                    self._attempts.pop(word_id, None)
+                    self._dead_letters.append({
+                        "word_id": word_id, "answers": len(entries), "attempts": attempts, "error": error
+                    })
+                    logger.error(f"Answer journal gave up on word {word_id} after {attempts} attempts: {error}")
+                    continue
+                # 放回等待队列，较新的答题（基于 inflight 计算）优先
+                self._attempts[word_id] = attempts
+                self._pending.setdefault(word_id, batch[word_id])
+                self._log[:0] = entries
+                self._stats[:0] = [row for row in stats_rows if row[0] == word_id]
+                self._entries += len(entries)
+        return len(batch) - len(failed)
+
+    def flush(self) -> int:
+        """立即把等待中的答题写入数据库（单个事务，失败时逐个单词写入），返回写入的单词数"""
+        with self._flush_lock:
+            return self._flush_locked()
+
+    @contextmanager
+    def exclusive(self):
+        """写入所有等待中的答题，并在 with 块内暂停合并新的答题
+
+        用于读取进度后同步写入进度的路径（批量拼写检查、标记已学习）：块内提交的进度
+        不会被块执行期间计算的答题快照覆盖，块结束后这些答题会基于新进度重新读取。
+        """
+        with self._flush_lock:
+            self._flush_locked()
+            with self._cond:
+                try:
+                    yield
+                finally:
+                    self._epoch += 1
+
+    def dead_letters(self) -> List[dict]:
+        """放弃写入的答题（最近的在后）"""
+        with self._cond:
+            return list(self._dead_letters)
+
+    def discard(self):
+        """丢弃所有尚未写入的答题（用于清空进度或词库）"""
+        with self._flush_lock:
+            with self._cond:
+                self._pending.clear()
+                self._log.clear()
+                self._stats.clear()
+                self._attempts.clear()
+                self._entries = 0
+
+    def pending_count(self) -> int:
+        """获取等待写入的单词数"""
+        with self._cond:
+            return len(self._pending)
+
+    def close(self):
+        """停止后台线程并写入所有剩余答题"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        self.flush()
+
+    def _run(self):
+        """后台写入循环（连续失败时按指数退避）"""
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._closed and (self._failures or self._entries < self.batch_size):
+                    self._cond.wait(min(self.flush_interval * 2 ** min(self._failures, 16), _MAX_BACKOFF))
+                closed = self._closed
+            self.flush()
+            if closed:
+                return
+
+# 全局写后日志实例
+answer_journal = AnswerJournal(
+    SessionLocal,
+    flush_interval=WRITE_BEHIND_INTERVAL_MS / 1000,
+    batch_size=WRITE_BEHIND_BATCH_SIZE
+)
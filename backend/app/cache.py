@@ -1,102 +1,646 @@
 """
 缓存工具
-提供简单的内存缓存功能
+提供有界、线程安全的内存缓存（LRU 淘汰 + TTL 过期，按键分片加锁），
+以及合并并发未命中、支持过期后后台刷新的缓存装饰器。
+缓存条目可以带标签（如 deck:3、progress、words），写入路径提交后按标签失效。
+多个 worker 进程可以通过 CACHE_BACKEND=sqlite 共享同一个 SQLite（WAL）缓存文件。
 """
+from collections import OrderedDict
 from functools import wraps
-from datetime import datetime, timedelta
-from typing import Any, Callable, Optional
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+import asyncio
 import hashlib
+import heapq
+import itertools
 import json
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+# 最多缓存的条目数（0 表示不限）
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+# 缓存值的总字节预算（0 表示不限，开启后每次写入需估算值大小）
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", "0"))
+# 分片数（每个分片一把锁）
+CACHE_SHARDS = int(os.getenv("CACHE_SHARDS", "16"))
+# 缓存后端：memory（进程内）或 sqlite（同一主机上的 worker 进程共享）
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_SQLITE_PATH = os.getenv(
+    "CACHE_SQLITE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "cache.db")
+)
+
+logger = logging.getLogger(__name__)
+
+# 缓存标签：全部学习进度、全部单词（跨词库的统计），以及单个词库的所有派生数据
+PROGRESS_TAG = "progress"
+WORDS_TAG = "words"
+DECKS_TAG = "decks"  # 词库自身的设置（名称、记忆算法等）
+
+def deck_tag(deck_id: Optional[int]) -> str:
+    """词库标签（未归属词库的单词记为 deck:0）"""
+    return f"deck:{deck_id or 0}"
+
+_MISSING = object()
+
+def _estimate_size(value: Any) -> int:
+    """估算缓存值占用的字节数"""
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    try:
+        return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return 1024
+
+class _Entry:
+    __slots__ = ("value", "expires_at", "size", "seq", "tags")
+
+    def __init__(self, value: Any, expires_at: Optional[float], size: int, seq: int,
+                 tags: Tuple[Tuple[str, int], ...] = ()):
+        self.value = value
+        self.expires_at = expires_at
+        self.size = size
+        self.seq = seq
+        self.tags = tags  # 写入时各标签的版本号
+
+class _Shard:
+    """单个分片：OrderedDict 维护 LRU 顺序，小顶堆按过期时间惰性清理"""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self.expiry: List[tuple] = []  # [(expires_at, seq, key)]
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _remove(self, key: str) -> _Entry:
+        entry = self.entries.pop(key)
+        self.bytes -= entry.size
+        return entry
+
+    def expire(self, now: float):
+        """清理已过期的条目（调用方需持有锁；每个条目最多出入堆一次，均摊 O(log n)）"""
+        while self.expiry and self.expiry[0][0] <= now:
+            _, seq, key = heapq.heappop(self.expiry)
+            entry = self.entries.get(key)
+            # 条目已被覆盖或删除时堆中记录过期，直接丢弃
+            if entry is not None and entry.seq == seq:
+                self._remove(key)
+                self.expirations += 1
+        # 堆中过期记录过多时重建
+        if len(self.expiry) > 2 * len(self.entries) + 64:
+            self.expiry = [
+                (entry.expires_at, entry.seq, key) for key, entry in self.entries.items()
+                if entry.expires_at is not None
+            ]
+            heapq.heapify(self.expiry)
+
+    def evict(self):
+        """按 LRU 淘汰直到满足条目数和字节预算（调用方需持有锁）"""
+        while self.entries and (
+            (self.max_entries and len(self.entries) > self.max_entries)
+            or (self.max_bytes and self.bytes > self.max_bytes)
+        ):
+            _, entry = self.entries.popitem(last=False)
+            self.bytes -= entry.size
+            self.evictions += 1
 
 class SimpleCache:
-    """简单的内存缓存"""
-    
-    def __init__(self):
-        self._cache = {}
-        self._expire_times = {}
-    
-    def get(self, key: str) -> Optional[Any]:
-        """获取缓存值"""
-        if key not in self._cache:
-            return None
-        
-        # 检查是否过期
-        if key in self._expire_times:
-            if datetime.now() > self._expire_times[key]:
-                self.delete(key)
-                return None
-        
-        return self._cache[key]
-    
-    def set(self, key: str, value: Any, ttl: Optional[int] = None):
+    """有界、线程安全的内存缓存
+
+    键按哈希分到多个分片，每个分片独立加锁；超过条目数或字节预算时淘汰最久未使用的条目，
+    带 TTL 的条目在读写时按过期时间堆清理，不会因为无人读取而一直占用内存。
+    标签失效只递增标签版本号（O(1)），条目在读取时发现版本号变化即视为未命中。
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES,
+                 shards: int = CACHE_SHARDS):
+        """
+        Args:
+            max_entries: 最多缓存的条目数（0 表示不限），按分片平均分配
+            max_bytes: 缓存值的总字节预算（0 表示不限），按分片平均分配
+            shards: 分片数
+        """
+        shards = max(1, shards)
+        per_shard_entries = -(-max_entries // shards) if max_entries else 0
+        per_shard_bytes = -(-max_bytes // shards) if max_bytes else 0
+        self.max_bytes = max_bytes
+        self._shards = [_Shard(per_shard_entries, per_shard_bytes) for _ in range(shards)]
+        self._seq = itertools.count()
+        self._tag_versions: Dict[str, int] = {}
+        self._tags_lock = threading.Lock()
+        self._generation = 0
+
+    def _shard(self, key: str) -> _Shard:
+        return self._shards[hash(key) % len(self._shards)]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """获取缓存值（不存在或已过期时返回 default）"""
+        shard = self._shard(key)
+        now = time.time()
+        with shard.lock:
+            shard.expire(now)
+            entry = shard.entries.get(key)
+            if entry is None:
+                shard.misses += 1
+                return default
+            if entry.tags and not self._tags_current(entry.tags):
+                shard._remove(key)
+                shard.invalidations += 1
+                shard.misses += 1
+                return default
+            shard.entries.move_to_end(key)
+            shard.hits += 1
+            return entry.value
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None,
+            tags: Optional[Iterable[str]] = None, since: Optional[Dict[str, int]] = None):
         """设置缓存值
-        
+
         Args:
             key: 缓存键
             value: 缓存值
             ttl: 过期时间（秒），None表示永不过期
+            tags: 标签，任一标签失效后该条目不再返回
+            since: 开始计算 value 之前由 tag_versions 取得的标签版本号；
+                计算期间标签被失效时写入的条目直接作废，避免缓存计算中途被修改的数据
         """
-        self._cache[key] = value
-        
-        if ttl:
-            self._expire_times[key] = datetime.now() + timedelta(seconds=ttl)
-        elif key in self._expire_times:
-            del self._expire_times[key]
-    
+        shard = self._shard(key)
+        now = time.time()
+        size = _estimate_size(value) if shard.max_bytes else 0
+        seq = next(self._seq)
+        expires_at = now + ttl if ttl else None
+        if since is None:
+            since = self.tag_versions(tags or ())
+        entry_tags = tuple(since.items())
+        with shard.lock:
+            if key in shard.entries:
+                shard._remove(key)
+            shard.entries[key] = _Entry(value, expires_at, size, seq, entry_tags)
+            shard.bytes += size
+            if expires_at is not None:
+                heapq.heappush(shard.expiry, (expires_at, seq, key))
+            shard.expire(now)
+            shard.evict()
+
     def delete(self, key: str):
         """删除缓存"""
-        if key in self._cache:
-            del self._cache[key]
-        if key in self._expire_times:
-            del self._expire_times[key]
-    
+        shard = self._shard(key)
+        with shard.lock:
+            if key in shard.entries:
+                shard._remove(key)
+
+    def tag_versions(self, tags: Iterable[str]) -> Dict[str, int]:
+        """标签当前的版本号"""
+        versions = self._tag_versions
+        return {tag: versions.get(tag, 0) for tag in tags}
+
+    def _tags_current(self, tags: Tuple[Tuple[str, int], ...]) -> bool:
+        versions = self._tag_versions
+        return all(versions.get(tag, 0) == version for tag, version in tags)
+
+    def invalidate_tags(self, *tags: str):
+        """使带有任一标签的条目全部失效（数据修改提交后调用）"""
+        with self._tags_lock:
+            for tag in tags:
+                self._tag_versions[tag] = self._tag_versions.get(tag, 0) + 1
+            self._generation += 1
+
+    def generation(self) -> int:
+        """失效代数（每次标签失效递增）"""
+        return self._generation
+
     def clear(self):
         """清空所有缓存"""
-        self._cache.clear()
-        self._expire_times.clear()
-    
+        for shard in self._shards:
+            with shard.lock:
+                shard.entries.clear()
+                shard.expiry.clear()
+                shard.bytes = 0
+
     def size(self) -> int:
         """获取缓存大小"""
-        return len(self._cache)
+        total = 0
+        for shard in self._shards:
+            with shard.lock:
+                total += len(shard.entries)
+        return total
+
+    def stats(self) -> Dict[str, int]:
+        """命中、未命中、淘汰、过期、标签失效计数及当前占用"""
+        result = dict.fromkeys(
+            ("entries", "bytes", "hits", "misses", "evictions", "expirations", "invalidations"), 0
+        )
+        for shard in self._shards:
+            with shard.lock:
+                result["entries"] += len(shard.entries)
+                result["bytes"] += shard.bytes
+                result["hits"] += shard.hits
+                result["misses"] += shard.misses
+                result["evictions"] += shard.evictions
+                result["expirations"] += shard.expirations
+                result["invalidations"] += shard.invalidations
+        lookups = result["hits"] + result["misses"]
+        result["hit_rate"] = round(result["hits"] / lookups, 4) if lookups else 0.0
+        return result
+
+class SQLiteCache:
+    """多进程共享的缓存（SQLite WAL 文件）
+
+    接口与 SimpleCache 相同。值用 pickle 序列化；标签版本号保存在共享文件中，
+    每次失效同时递增全局代数（generation）。读取条目时在同一条查询中带回代数，
+    代数未变时直接使用本进程缓存的标签版本号，变化时重新加载，
+    因此任一 worker 的失效对所有 worker 立即可见。
+    """
+
+    # 每写入多少次清理一次过期条目并检查容量
+    SWEEP_INTERVAL = 256
+    # 命中时最多每隔多少秒更新一次最近访问时间（避免每次读取都写库）
+    TOUCH_INTERVAL = 1.0
+
+    _SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS cache_entries (
+            key TEXT PRIMARY KEY,
+            value BLOB NOT NULL,
+            expires_at REAL,
+            tags TEXT,
+            accessed_at REAL NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS ix_cache_entries_expires_at ON cache_entries(expires_at)",
+        "CREATE INDEX IF NOT EXISTS ix_cache_entries_accessed_at ON cache_entries(accessed_at)",
+        "CREATE TABLE IF NOT EXISTS cache_tags (tag TEXT PRIMARY KEY, version INTEGER NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS cache_meta (id INTEGER PRIMARY KEY CHECK (id = 1), generation INTEGER NOT NULL)",
+        "INSERT OR IGNORE INTO cache_meta (id, generation) VALUES (1, 0)",
+    )
+
+    def __init__(self, path: str = CACHE_SQLITE_PATH, max_entries: int = CACHE_MAX_ENTRIES):
+        """
+        Args:
+            path: 缓存文件路径（同一主机上的 worker 使用同一路径）
+            max_entries: 最多缓存的条目数（0 表示不限），超出时按最近访问时间淘汰
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._generation = -1
+        self._tag_versions: Dict[str, int] = {}
+        self._writes = 0
+        self._counters = dict.fromkeys(("hits", "misses", "evictions", "expirations", "invalidations"), 0)
+
+        conn = self._conn()
+        with conn:
+            for ddl in self._SCHEMA:
+                conn.execute(ddl)
+
+    def _conn(self) -> sqlite3.Connection:
+        """每个线程一个连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name: str, n: int = 1):
+        with self._lock:
+            self._counters[name] += n
+
+    def _sync_tags(self, generation: int):
+        """共享代数变化时重新加载标签版本号"""
+        if generation == self._generation:
+            return
+        rows = self._conn().execute("SELECT tag, version FROM cache_tags").fetchall()
+        with self._lock:
+            self._tag_versions = dict(rows)
+            self._generation = generation
+
+    def _current_generation(self) -> int:
+        return self._conn().execute("SELECT generation FROM cache_meta WHERE id = 1").fetchone()[0]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """获取缓存值（不存在、已过期或标签已失效时返回 default）"""
+        conn = self._conn()
+        now = time.time()
+        row = conn.execute(
+            "SELECT value, expires_at, tags, accessed_at, (SELECT generation FROM cache_meta WHERE id = 1) "
+            "FROM cache_entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self._count("misses")
+            return default
+        value, expires_at, tags, accessed_at, generation = row
+        if expires_at is not None and expires_at <= now:
+            self._count("expirations")
+            self._count("misses")
+            self.delete(key)
+            return default
+        if tags:
+            self._sync_tags(generation)
+            versions = self._tag_versions
+            if any(versions.get(tag, 0) != version for tag, version in json.loads(tags).items()):
+                self._count("invalidations")
+                self._count("misses")
+                self.delete(key)
+                return default
+        if now - accessed_at > self.TOUCH_INTERVAL:
+            with conn:
+                conn.execute("UPDATE cache_entries SET accessed_at = ? WHERE key = ?", (now, key))
+        self._count("hits")
+        return pickle.loads(value)
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None,
+            tags: Optional[Iterable[str]] = None, since: Optional[Dict[str, int]] = None):
+        """设置缓存值（参数同 SimpleCache.set）"""
+        now = time.time()
+        if since is None:
+            since = self.tag_versions(tags or ())
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (key, value, expires_at, tags, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL),
+                 now + ttl if ttl else None, json.dumps(since) if since else None, now)
+            )
+        with self._lock:
+            self._writes += 1
+            sweep = self._writes % self.SWEEP_INTERVAL == 0
+        if sweep:
+            self.sweep(now)
+
+    def sweep(self, now: Optional[float] = None):
+        """删除过期条目，超出容量时按最近访问时间淘汰"""
+        now = now or time.time()
+        conn = self._conn()
+        with conn:
+            expired = conn.execute("DELETE FROM cache_entries WHERE expires_at <= ?", (now,)).rowcount
+            evicted = 0
+            if self.max_entries:
+                excess = conn.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0] - self.max_entries
+                if excess > 0:
+                    evicted = conn.execute(
+                        "DELETE FROM cache_entries WHERE key IN "
+                        "(SELECT key FROM cache_entries ORDER BY accessed_at LIMIT ?)", (excess,)
+                    ).rowcount
+        self._count("expirations", expired)
+        self._count("evictions", evicted)
+
+    def delete(self, key: str):
+        """删除缓存"""
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+
+    def clear(self):
+        """清空所有缓存"""
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM cache_entries")
+
+    def size(self) -> int:
+        """获取缓存大小"""
+        return self._conn().execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+
+    def tag_versions(self, tags: Iterable[str]) -> Dict[str, int]:
+        """标签当前的版本号"""
+        tags = list(tags)
+        if not tags:
+            return {}
+        self._sync_tags(self._current_generation())
+        versions = self._tag_versions
+        return {tag: versions.get(tag, 0) for tag in tags}
+
+    def invalidate_tags(self, *tags: str):
+        """使带有任一标签的条目全部失效（所有共享该文件的进程可见）"""
+        if not tags:
+            return
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                "INSERT INTO cache_tags (tag, version) VALUES (?, 1) "
+                "ON CONFLICT(tag) DO UPDATE SET version = version + 1",
+                [(tag,) for tag in tags]
+            )
+            conn.execute("UPDATE cache_meta SET generation = generation + 1 WHERE id = 1")
+
+    def generation(self) -> int:
+        """共享的失效代数（每次标签失效递增）"""
+        return self._current_generation()
+
+    def stats(self) -> Dict[str, Any]:
+        """本进程的命中、未命中、淘汰、过期、标签失效计数及共享文件中的条目数"""
+        with self._lock:
+            result = dict(self._counters)
+        result["entries"] = self.size()
+        result["generation"] = self._current_generation()
+        lookups = result["hits"] + result["misses"]
+        result["hit_rate"] = round(result["hits"] / lookups, 4) if lookups else 0.0
+        return result
+
+def create_cache(backend: str = CACHE_BACKEND):
+    """按配置创建缓存后端"""
+    if backend == "sqlite":
+        return SQLiteCache()
+    if backend != "memory":
+        raise ValueError(f"未知的缓存后端: {backend}")
+    return SimpleCache()
 
 # 全局缓存实例
-cache = SimpleCache()
+cache = create_cache()
+
+class _Flight:
+    """一次进行中的计算（线程版），其余调用方等待 done"""
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+# 进行中的计算：线程版按缓存键，asyncio 版按 (事件循环, 缓存键)
+_flights: Dict[str, _Flight] = {}
+_flights_lock = threading.Lock()
+_async_flights: Dict[tuple, "asyncio.Future"] = {}
+_background_tasks: Set["asyncio.Task"] = set()
+
+def _run_flight(key: str, flight: _Flight, compute: Callable[[], Any]):
+    try:
+        flight.result = compute()
+    except BaseException as e:
+        flight.error = e
+    finally:
+        with _flights_lock:
+            _flights.pop(key, None)
+        flight.done.set()
+
+def single_flight(key: str, compute: Callable[[], Any]) -> Any:
+    """同一键同时只有一个线程执行 compute，其余线程等待并共享它的结果（或异常）"""
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+    if leader:
+        _run_flight(key, flight, compute)
+    else:
+        flight.done.wait()
+    if flight.error is not None:
+        raise flight.error
+    return flight.result
+
+def _refresh_in_background(key: str, compute: Callable[[], Any]):
+    """在后台线程刷新（该键已有计算在进行时跳过）"""
+    with _flights_lock:
+        if key in _flights:
+            return
+        flight = _flights[key] = _Flight()
+
+    def run():
+        _run_flight(key, flight, compute)
+        if flight.error is not None:
+            logger.error(f"Cache refresh for {key} failed: {str(flight.error)}")
+
+    threading.Thread(target=run, daemon=True).start()
+
+async def _run_async_flight(flight_key: tuple, future: "asyncio.Future", compute: Callable[[], Awaitable]):
+    try:
+        result = await compute()
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except BaseException as e:
+        future.set_exception(e)
+        future.exception()  # 没有等待者时避免 "exception was never retrieved" 警告
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        _async_flights.pop(flight_key, None)
+
+async def single_flight_async(key: str, compute: Callable[[], Awaitable]) -> Any:
+    """single_flight 的 asyncio 版本：同一事件循环内同一键只有一个协程执行 compute"""
+    loop = asyncio.get_running_loop()
+    flight_key = (id(loop), key)
+    future = _async_flights.get(flight_key)
+    if future is not None:
+        # shield：某个等待者被取消时不影响正在进行的计算
+        return await asyncio.shield(future)
+    future = _async_flights[flight_key] = loop.create_future()
+    return await _run_async_flight(flight_key, future, compute)
 
-def cached(ttl: int = 300, key_prefix: str = ""):
+def _refresh_in_background_async(key: str, compute: Callable[[], Awaitable]):
+    """在当前事件循环中创建后台刷新任务（该键已有计算在进行时跳过）"""
+    loop = asyncio.get_running_loop()
+    flight_key = (id(loop), key)
+    if flight_key in _async_flights:
+        return
+    future = _async_flights[flight_key] = loop.create_future()
+
+    async def run():
+        try:
+            await _run_async_flight(flight_key, future, compute)
+        except Exception as e:
+            logger.error(f"Cache refresh for {key} failed: {str(e)}")
+
+    task = loop.create_task(run())
+    # 保留任务引用，避免运行中被垃圾回收
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+def cached(ttl: int = 300, key_prefix: str = "", stale_ttl: int = 0,
+           tags: Optional[Any] = None):
     """缓存装饰器
-    
+
+    同一键并发未命中时只有一个调用方执行函数，其余调用方等待并共享结果；
+    支持普通函数（线程间合并）和 async 函数（同一事件循环内合并）。
+
     Args:
         ttl: 缓存时间（秒）
         key_prefix: 缓存键前缀
+        stale_ttl: 过期后继续返回旧值的时间（秒）。期间由一个后台刷新重新计算，
+            调用方不等待；0 表示不启用。标签失效的条目不会作为旧值返回
+        tags: 标签列表，或接收被装饰函数参数、返回标签列表的函数（如 lambda deck_id: [f"deck:{deck_id}"]）
     """
     def decorator(func: Callable):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
+        def make_key(args, kwargs) -> str:
             # 生成缓存键
             key_parts = [key_prefix, func.__name__]
-            
+
             # 添加参数到键中
             if args:
                 key_parts.append(str(args))
             if kwargs:
                 key_parts.append(json.dumps(kwargs, sort_keys=True))
-            
-            cache_key = hashlib.md5(
+
+            return hashlib.md5(
                 "_".join(key_parts).encode()
             ).hexdigest()
-            
-            # 尝试从缓存获取
-            cached_value = cache.get(cache_key)
-            if cached_value is not None:
-                return cached_value
-            
-            # 执行函数
-            result = func(*args, **kwargs)
-            
-            # 存入缓存
-            cache.set(cache_key, result, ttl)
-            
+
+        def entry_tags(args, kwargs) -> List[str]:
+            if tags is None:
+                return []
+            return list(tags(*args, **kwargs) if callable(tags) else tags)
+
+        def store(cache_key: str, result: Any, since: Dict[str, int]) -> Any:
+            # 连同新鲜截止时间一起存入缓存，超过 ttl 但在 stale_ttl 内仍可返回旧值
+            cache.set(cache_key, (result, time.time() + ttl), ttl + stale_ttl, since=since)
             return result
-        
+
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                cache_key = make_key(args, kwargs)
+
+                async def compute():
+                    since = cache.tag_versions(entry_tags(args, kwargs))
+                    return store(cache_key, await func(*args, **kwargs), since)
+
+                # 尝试从缓存获取
+                cached_value = cache.get(cache_key, _MISSING)
+                if cached_value is not _MISSING:
+                    result, fresh_until = cached_value
+                    if time.time() >= fresh_until:
+                        _refresh_in_background_async(cache_key, compute)
+                    return result
+
+                return await single_flight_async(cache_key, compute)
+
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            cache_key = make_key(args, kwargs)
+
+            def compute():
+                # 计算前记下标签版本号，计算期间发生的失效不会被覆盖
+                since = cache.tag_versions(entry_tags(args, kwargs))
+                return store(cache_key, func(*args, **kwargs), since)
+
+            # 尝试从缓存获取
+            cached_value = cache.get(cache_key, _MISSING)
+            if cached_value is not _MISSING:
+                result, fresh_until = cached_value
+                if time.time() >= fresh_until:
+                    _refresh_in_background(cache_key, compute)
+                return result
+
+            # 未命中：合并并发请求，只执行一次函数
+            return single_flight(cache_key, compute)
+
         return wrapper
     return decorator
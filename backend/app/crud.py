@@ -2,106 +2,304 @@
 数据库CRUD操作
 """
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_, or_
-from . import models, schemas
+from sqlalchemy import func, and_, or_, case
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from . import models, schemas, scheduler, review_log, daily_stats
 from datetime import date, timedelta
-from typing import List, Optional
-import random
+from typing import Dict, Iterable, List, Optional, Tuple
+from .word_index import word_index
+from .due_histogram import due_histogram
+from .review_queue import review_queue
+from .tracing import traced
+from .cache import cache, deck_tag, PROGRESS_TAG, WORDS_TAG
 
-def get_words_by_difficulty(db: Session, difficulty: int, limit: int = 10) -> List[models.Word]:
-    """根据难度随机获取单词列表（优化：使用随机排序避免每次都是相同单词）"""
-    total_count = db.query(models.Word).filter(models.Word.difficulty == difficulty).count()
-    
-    if total_count == 0:
+# 多行 UPSERT 每条语句的行数（避免超过 SQLite 参数数量上限）
+UPSERT_CHUNK_SIZE = 150
+
+# 同一单词并发答题时，单次答题写入的最大尝试次数
+UPDATE_PROGRESS_ATTEMPTS = 5
+
+@traced()
+def get_words_by_difficulty(db: Session, difficulty: int, limit: int = 10,
+                            deck_id: Optional[int] = None) -> List[models.Word]:
+    """根据难度随机获取单词列表（优化：内存ID索引抽样 + 主键IN查询，避免COUNT/OFFSET扫描）"""
+    sampled_ids = word_index.sample(db, difficulty, limit, deck_id)
+    if not sampled_ids:
         return []
     
-    # 如果单词总数不多，直接随机打乱
-    if total_count <= limit * 2:
-        words = db.query(models.Word).filter(models.Word.difficulty == difficulty).all()
-        random.shuffle(words)
-        return words[:limit]
+    words = db.query(models.Word).filter(models.Word.id.in_(sampled_ids)).all()
     
-    # 随机偏移量获取不同的单词
-    offset = random.randint(0, max(0, total_count - limit))
-    return db.query(models.Word).filter(models.Word.difficulty == difficulty).offset(offset).limit(limit).all()
+    # 按抽样顺序返回（索引过期时被删除的单词会被自动忽略）
+    words_by_id = {word.id: word for word in words}
+    return [words_by_id[word_id] for word_id in sampled_ids if word_id in words_by_id]
 
+@traced()
 def get_word_by_id(db: Session, word_id: int) -> Optional[models.Word]:
     """根据ID获取单词"""
     return db.query(models.Word).filter(models.Word.id == word_id).first()
 
+@traced()
 def get_word_by_text(db: Session, word: str) -> Optional[models.Word]:
     """根据单词文本获取单词"""
     return db.query(models.Word).filter(models.Word.word == word).first()
 
+@traced()
 def create_word(db: Session, word: schemas.WordCreate) -> models.Word:
     """创建新单词"""
     db_word = models.Word(**word.dict())
     db.add(db_word)
     db.commit()
     db.refresh(db_word)
+    word_index.invalidate(db_word.deck_id)
+    cache.invalidate_tags(WORDS_TAG, deck_tag(db_word.deck_id))
     return db_word
 
+@traced()
+def get_words_with_progress(db: Session, word_ids: List[int]) -> List[Tuple[models.Word, Optional[models.Progress]]]:
+    """批量获取单词及其学习进度（单次 LEFT OUTER JOIN 查询，只读）
+    
+    返回顺序与 word_ids 一致，没有进度记录的单词对应 None
+    """
+    if not word_ids:
+        return []
+    
+    rows = db.query(models.Word, models.Progress).outerjoin(
+        models.Progress, models.Progress.word_id == models.Word.id
+    ).filter(models.Word.id.in_(word_ids)).all()
+    
+    rows_by_id = {word.id: (word, progress) for word, progress in rows}
+    return [rows_by_id[word_id] for word_id in word_ids if word_id in rows_by_id]
+
+@traced()
 def get_or_create_progress(db: Session, word_id: int) -> models.Progress:
-    """获取或创建学习进度"""
-    progress = db.query(models.Progress).filter(models.Progress.word_id == word_id).first()
+    """获取或创建学习进度（INSERT ... ON CONFLICT DO NOTHING，并发请求不会主键冲突）"""
+    progress = db.get(models.Progress, word_id)
     if not progress:
-        progress = models.Progress(word_id=word_id, mastery_level=0, next_review=date.today())
-        db.add(progress)
+        db.execute(
+            sqlite_insert(models.Progress).values(
+                word_id=word_id, mastery_level=0, next_review=date.today(),
+                error_count=0, review_count=0
+            ).on_conflict_do_nothing(index_elements=[models.Progress.word_id])
+        )
         db.commit()
-        db.refresh(progress)
+        progress = db.get(models.Progress, word_id)
     return progress
 
-def update_progress(db: Session, word_id: int, is_correct: bool) -> models.Progress:
-    """更新学习进度（基于艾宾浩斯遗忘曲线）
+@traced()
+def get_scheduling_rows(db: Session, word_ids: List[int]) -> Dict[int, Tuple[models.Word, Optional[models.Progress], scheduler.SchedulerParams]]:
+    """批量获取单词、进度和所属词库的调度参数（单次查询）
+    
+    没有进度记录的单词对应 None；词库不存在时使用 StepMaster 参数
+    """
+    if not word_ids:
+        return {}
+    
+    rows = db.query(
+        models.Word, models.Progress,
+        models.Deck.algorithm, models.Deck.fsrs_weights, models.Deck.request_retention
+    ).outerjoin(
+        models.Progress, models.Progress.word_id == models.Word.id
+    ).outerjoin(
+        models.Deck, models.Deck.id == models.Word.deck_id
+    ).filter(models.Word.id.in_(word_ids)).all()
+    
+    return {
+        word.id: (word, progress, scheduler.SchedulerParams.from_deck(algorithm, weights, retention))
+        for word, progress, algorithm, weights, retention in rows
+    }
+
+@traced()
+def apply_answer(progress, is_correct: bool, today: Optional[date] = None,
+                 params: Optional[scheduler.SchedulerParams] = None):
+    """将一次答题结果应用到进度对象上（不访问数据库）
+    
+    progress 可以是 models.Progress 或任何带有相同属性的对象；
+    params 为空时使用 StepMaster（陌生1天 → 熟悉3天 → 掌握15天，答错当天复习）。
+    """
+    scheduler.apply_answers([progress], [is_correct], [params or scheduler.SchedulerParams()], today)
+    return progress
+
+def _execute_progress_upsert(db: Session, stmt, word_id: int) -> Optional[models.Progress]:
+    """执行单行进度 UPSERT 并返回最新进度
     
-    优化的遗忘曲线间隔：
-    - 陌生(0): 立即复习 → 1小时 → 6小时
-    - 熟悉(1): 1天 → 3天 → 7天
-    - 掌握(2): 15天 → 30天
+    SQLite 3.35+ 使用 RETURNING 一条语句完成；返回的对象已从会话分离，
+    提交后读取属性不会再次查询。旧版本 SQLite 回退为提交后再读取一次。
+    带条件的 UPSERT 没有写入任何行时不提交并返回 None。
     """
-    progress = get_or_create_progress(db, word_id)
+    if db.get_bind().dialect.insert_returning:
+        progress = db.scalars(
+            stmt.returning(models.Progress),
+            execution_options={"populate_existing": True}
+        ).one_or_none()
+        if progress is None:
+            return None
+        db.expunge(progress)
+        db.commit()
+        return progress
+    
+    if db.execute(stmt).rowcount == 0:
+        return None
+    db.commit()
+    return db.get(models.Progress, word_id, populate_existing=True)
+
+@traced()
+def notify_progress_writes(changes: Iterable[Tuple[int, Optional[int], Optional[date], Optional[date], int, int]]):
+    """进度写入提交后同步更新内存索引（待复习直方图、复习队列）并使相关缓存失效
+    
+    Args:
+        changes: (word_id, deck_id, 原下次复习日期, 新下次复习日期, mastery_level, error_count)
+    """
+    changes = list(changes)
+    due_histogram.apply_moves((deck_id, old, new) for _, deck_id, old, new, _, _ in changes)
+    review_queue.apply_updates(
+        (word_id, deck_id, new, mastery, errors) for word_id, deck_id, _, new, mastery, errors in changes
+    )
+    if changes:
+        cache.invalidate_tags(PROGRESS_TAG, *{deck_tag(change[1]) for change in changes})
+
+def invalidate_progress_indexes(db: Session):
+    """批量修改进度后丢弃内存索引（下次读取时从数据库重建）并使进度相关缓存和所有词库的缓存失效"""
+    due_histogram.invalidate()
+    review_queue.invalidate()
+    deck_ids = [deck_id for deck_id, in db.query(models.Deck.id)]
+    cache.invalidate_tags(PROGRESS_TAG, deck_tag(None), *(deck_tag(deck_id) for deck_id in deck_ids))
+
+def _conditional_progress_upsert(snapshot: scheduler.ProgressSnapshot, prior_review_count: int):
+    """构建带条件的进度 UPSERT：只在 review_count 仍等于读取时的值时插入或更新"""
+    stmt = sqlite_insert(models.Progress).values(snapshot.values())
+    return stmt.on_conflict_do_update(
+        index_elements=[models.Progress.word_id],
+        set_={field: stmt.excluded[field] for field in scheduler.PROGRESS_STATE_FIELDS},
+        where=func.coalesce(models.Progress.review_count, 0) == prior_review_count
+    )
+
+@traced()
+def write_progress_states(db: Session, states: Iterable[Tuple[scheduler.ProgressSnapshot, int]]) -> List[int]:
+    """以带条件的 UPSERT 写入多个单词的新进度（不提交）
     
-    # 更新复习计数和最后复习日期
-    progress.review_count += 1
-    progress.last_reviewed = date.today()
+    Args:
+        states: (新状态, 读取时的 review_count)
     
-    if is_correct:
-        # 正确：提升掌握度并延长复习间隔
-        if progress.mastery_level < 2:
-            progress.mastery_level += 1
+    Returns:
+        读取后进度已被其它答题修改、没有写入的单词（调用方应回滚并重新读取计算）
+    """
+    conflicts = []
+    for snapshot, prior_review_count in states:
+        if db.execute(_conditional_progress_upsert(snapshot, prior_review_count)).rowcount == 0:
+            conflicts.append(snapshot.word_id)
+    return conflicts
+
+@traced()
+def update_progress(db: Session, word_id: int, is_correct: bool) -> models.Progress:
+    """更新学习进度（按所属词库的记忆算法调度）
+    
+    一次查询读取进度和调度参数，在调度内核中计算新状态，
+    追加答题日志后以单条 INSERT ... ON CONFLICT DO UPDATE 写入（同一事务）。
+    调度结果依赖读取到的旧状态，因此 UPSERT 只在 review_count 仍等于读取时的值时生效；
+    同一单词的另一次答题先提交时回滚并重新读取计算，不会丢失任何一次答题。
+    """
+    for _ in range(UPDATE_PROGRESS_ATTEMPTS):
+        rows = get_scheduling_rows(db, [word_id])
+        word, progress, params = rows.get(word_id, (None, None, scheduler.SchedulerParams()))
+        
+        snapshot = scheduler.ProgressSnapshot.from_progress(word_id, progress)
+        previous_review = snapshot.next_review
+        prior_review_count = snapshot.review_count
+        review_log.append(db, [review_log.make_entry(word_id, is_correct, progress)])
+        daily_stats.upsert(db, [daily_stats.answer_row(word.deck_id if word else None, progress, is_correct)])
+        apply_answer(snapshot, is_correct, params=params)
         
-        # 根据掌握度设置科学的复习间隔
-        intervals = {
-            0: 1,    # 陌生：1天后复习
-            1: 3,    # 熟悉：3天后复习
-            2: 15    # 掌握：15天后复习
-        }
-        days = intervals.get(progress.mastery_level, 1)
-        progress.next_review = date.today() + timedelta(days=days)
-    else:
-        # 错误：记录错误，重置复习间隔
-        progress.error_count += 1
-        # 错误后降低掌握度，但保留部分进度（不直接归零）
-        if progress.mastery_level > 0:
-            progress.mastery_level -= 1
-        # 错误单词需要立即复习
-        progress.next_review = date.today()
+        result = _execute_progress_upsert(db, _conditional_progress_upsert(snapshot, prior_review_count), word_id)
+        if result is not None:
+            notify_progress_writes([(word_id, word.deck_id if word else None, previous_review,
+                                     result.next_review, result.mastery_level, result.error_count)])
+            return result
+        # 读取后进度已被其它答题修改：撤销本次的日志和统计，重新读取
+        db.rollback()
+    
+    raise RuntimeError(f"单词 {word_id} 的学习进度并发修改冲突，请重试")
+
+def _studied_upsert(rows: List[dict]):
+    """构建"标记已学习"的 UPSERT：新单词插入初始进度，已有进度只更新下次复习日期"""
+    stmt = sqlite_insert(models.Progress).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=[models.Progress.word_id],
+        set_={"next_review": stmt.excluded.next_review}
+    )
+
+def _studied_row(word_id: int, next_review: date) -> dict:
+    return {
+        "word_id": word_id,
+        "mastery_level": 0,
+        "next_review": next_review,
+        "error_count": 0,
+        "review_count": 0
+    }
+
+def _studied_targets(db: Session, word_ids: List[int]) -> list:
+    """读取存在的单词及其所属词库、当前进度（一次查询，用于更新内存索引和每日统计）"""
+    return db.query(
+        models.Word.id, models.Word.deck_id, models.Progress.word_id.label("progress_id"),
+        models.Progress.next_review, models.Progress.mastery_level, models.Progress.error_count
+    ).outerjoin(
+        models.Progress, models.Progress.word_id == models.Word.id
+    ).filter(models.Word.id.in_(word_ids)).all()
+
+def _studied_changes(targets: list, tomorrow: date):
+    return [
+        (t.id, t.deck_id, t.next_review, tomorrow, t.mastery_level or 0, t.error_count or 0)
+        for t in targets
+    ]
+
+def _studied_stats(targets: list) -> List[dict]:
+    return [daily_stats.studied_row(t.deck_id, t.progress_id is None) for t in targets]
+
+@traced()
+def mark_word_studied(db: Session, word_id: int) -> models.Progress:
+    """标记单词为已学习：设置明天复习（单条 UPSERT）"""
+    targets = _studied_targets(db, [word_id])
+    tomorrow = date.today() + timedelta(days=1)
+    daily_stats.upsert(db, _studied_stats(targets))
+    stmt = _studied_upsert([_studied_row(word_id, tomorrow)])
+    result = _execute_progress_upsert(db, stmt, word_id)
+    notify_progress_writes(_studied_changes(targets, tomorrow))
+    return result
+
+@traced()
+def mark_words_studied(db: Session, word_ids: List[int]) -> int:
+    """批量标记单词为已学习，忽略不存在的单词，返回更新的单词数"""
+    word_ids = list(dict.fromkeys(word_ids))
+    if not word_ids:
+        return 0
+    
+    targets = _studied_targets(db, word_ids)
+    if not targets:
+        return 0
     
+    tomorrow = date.today() + timedelta(days=1)
+    for i in range(0, len(targets), UPSERT_CHUNK_SIZE):
+        chunk = targets[i:i + UPSERT_CHUNK_SIZE]
+        db.execute(_studied_upsert([_studied_row(target.id, tomorrow) for target in chunk]))
+    daily_stats.upsert(db, _studied_stats(targets))
     db.commit()
-    db.refresh(progress)
-    return progress
+    notify_progress_writes(_studied_changes(targets, tomorrow))
+    return len(targets)
 
-def get_review_words(db: Session, limit: int = 20) -> List[models.Word]:
-    """获取今日待复习单词（优化：按掌握度优先排序）"""
-    today = date.today()
-    words = db.query(models.Word).join(models.Progress).filter(
-        models.Progress.next_review <= today
-    ).order_by(
-        models.Progress.mastery_level.asc(),  # 优先复习陌生单词
-        models.Progress.error_count.desc()     # 其次是错误多的单词
-    ).limit(limit).all()
-    return words
+@traced()
+def get_review_words(db: Session, limit: int = 20, deck_id: Optional[int] = None) -> List[models.Word]:
+    """获取今日待复习单词（优先复习陌生单词，其次是错误多的单词）
+    
+    排序由内存中的待复习优先队列完成，数据库只做主键 IN 查询。
+    """
+    word_ids = review_queue.top(db, limit, deck_id)
+    if not word_ids:
+        return []
+    
+    words = db.query(models.Word).filter(models.Word.id.in_(word_ids)).all()
+    words_by_id = {word.id: word for word in words}
+    return [words_by_id[word_id] for word_id in word_ids if word_id in words_by_id]
 
+@traced()
 def get_error_words(db: Session, limit: int = 20) -> List[models.Word]:
     """获取错词本（历史错误单词）（优化：只返回最需要复习的）"""
     words = db.query(models.Word).join(models.Progress).filter(
@@ -112,50 +310,51 @@ def get_error_words(db: Session, limit: int = 20) -> List[models.Word]:
     ).limit(limit).all()
     return words
 
+@traced()
 def get_progress_stats(db: Session) -> dict:
-    """获取学习进度统计"""
-    # 1. 掌握度统计
-    mastery_counts = db.query(
-        models.Progress.mastery_level, 
-        func.count(models.Progress.word_id)
-    ).group_by(models.Progress.mastery_level).all()
+    """获取学习进度统计
     
-    mastery_map = {0: "红", 1: "黄", 2: "绿"}
-    mastery = {mastery_map.get(level, "红"): count for level, count in mastery_counts}
+    每张表只扫描一次：progress 一条条件聚合查询，words 一条按难度分组（ix_words_difficulty 覆盖索引）查询，
+    近7天数据读取 daily_stats 汇总（共3条查询）。
+    
+    recent_stats 为最近7天每天的 {"date": "MM-DD", "reviewed": 当天答题的不同单词数}（按日期升序，共7项）。
+    数据来自每日统计：同一单词在多天答题时每天各计一次。此前按 progress.last_reviewed 统计，
+    每个单词只计入最后一次复习的日期，之前的天数会随重新复习而减少；改为每日统计后历史天数不再变化。
+    """
+    # 1. 掌握度、复习、错误统计（条件聚合）
+    progress = db.query(
+        func.count(models.Progress.word_id),
+        func.sum(case((models.Progress.mastery_level == 1, 1), else_=0)),
+        func.sum(case((models.Progress.mastery_level == 2, 1), else_=0)),
+        func.sum(case((models.Progress.review_count > 0, 1), else_=0)),
+        func.sum(case((models.Progress.error_count > 0, 1), else_=0))
+    ).one()
+    total_progress, familiar, mastered, reviewed_words, error_words = (value or 0 for value in progress)
+    
+    # 其它掌握度（包括 0 和异常值）都算"红"，只返回出现过的等级
+    mastery_counts = {"红": total_progress - familiar - mastered, "黄": familiar, "绿": mastered}
+    mastery = {color: count for color, count in mastery_counts.items() if count > 0}
     
     # 2. 计算等级和积分（简单算法：掌握单词数 * 10）
-    total_mastered = mastery.get("绿", 0)
+    total_mastered = mastered
     coins = total_mastered * 10
     level = min(total_mastered // 10 + 1, 99)  # 每10个掌握单词升1级
     
-    # 3. 按难度的单词分布
+    # 3. 按难度的单词分布（总数由分组结果求和）
     difficulty_counts = db.query(
         models.Word.difficulty, 
         func.count(models.Word.id)
     ).group_by(models.Word.difficulty).all()
     difficulty_distribution = {f"level{diff}": count for diff, count in difficulty_counts}
+    total_words = sum(count for _, count in difficulty_counts)
     
-    # 4. 学习进度统计
-    total_words = db.query(models.Word).count()
-    reviewed_words = db.query(models.Progress).filter(models.Progress.review_count > 0).count()
-    error_words = db.query(models.Progress).filter(models.Progress.error_count > 0).count()
-    
-    # 5. 最近7天的学习数据
-    recent_stats = []
-    for i in range(7):
-        day = date.today() - timedelta(days=i)
-        # 统计当天复习的单词数
-        reviewed_today = db.query(models.Progress).filter(
-            func.date(models.Progress.last_reviewed) == day
-        ).count()
-        
-        recent_stats.append({
-            "date": day.strftime("%m-%d"),
-            "reviewed": reviewed_today
-        })
+    # 4. 最近7天每天答题的不同单词数（读取每日汇总，只涉及7天的行）
+    recent_stats = [
+        {"date": day["date"].strftime("%m-%d"), "reviewed": day["reviewed"]}
+        for day in daily_stats.recent(db, days=7)
+    ]
     
-    # 6. 错误率统计
-    total_progress = db.query(models.Progress).count()
+    # 5. 错误率统计
     error_rate = round((error_words / total_progress) * 100, 2) if total_progress > 0 else 0
     
     return {
@@ -167,5 +366,5 @@ def get_progress_stats(db: Session) -> dict:
         "reviewed_words": reviewed_words,
         "error_words": error_words,
         "error_rate": error_rate,
-        "recent_stats": recent_stats[::-1]  # 按日期升序排列
+        "recent_stats": recent_stats  # 按日期升序排列
     }
@@ -0,0 +1,123 @@
+"""
+每日学习统计汇总
+答题和标记已学习时按 (词库, 日期) 累加增量，同一事务内合并为一条 executemany UPSERT；
+近期学习数据和日历热力图只需读取 O(天数) 行汇总，不再扫描 progress 表。
+派生结果的缓存由写入路径按标签（deck:N、progress）失效。
+"""
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from . import models
+
+COUNTER_FIELDS = ("new_learned", "reviewed", "correct_count", "error_count")
+
+def answer_row(deck_id: Optional[int], prior, is_correct: bool, today: Optional[date] = None) -> dict:
+    """一次答题的统计增量
+
+    Args:
+        deck_id: 单词所属词库
+        prior: 答题前的进度（ORM 对象或快照），None 表示还没有进度记录（新学）
+        is_correct: 是否答对
+    """
+    today = today or date.today()
+    return {
+        "deck_id": deck_id or 0,
+        "stat_date": today,
+        "new_learned": 1 if prior is None else 0,
+        # 同一单词当天多次答题只算一次复习
+        "reviewed": 1 if prior is None or getattr(prior, "last_reviewed", None) != today else 0,
+        "correct_count": 1 if is_correct else 0,
+        "error_count": 0 if is_correct else 1,
+    }
+
+def studied_row(deck_id: Optional[int], is_new: bool, today: Optional[date] = None) -> dict:
+    """标记已学习的统计增量（只有第一次产生进度记录时计为新学）"""
+    return {
+        "deck_id": deck_id or 0,
+        "stat_date": today or date.today(),
+        "new_learned": 1 if is_new else 0,
+        "reviewed": 0,
+        "correct_count": 0,
+        "error_count": 0,
+    }
+
+def merge(rows: Iterable[dict]) -> List[dict]:
+    """按 (词库, 日期) 合并增量，去掉全为0的行"""
+    merged: Dict[Tuple[int, date], dict] = {}
+    for row in rows:
+        key = (row["deck_id"], row["stat_date"])
+        target = merged.get(key)
+        if target is None:
+            merged[key] = dict(row)
+        else:
+            for field in COUNTER_FIELDS:
+                target[field] += row[field]
+    return [row for row in merged.values() if any(row[field] for field in COUNTER_FIELDS)]
+
+def _upsert_statement():
+    table = models.DailyStats.__table__
+    stmt = sqlite_insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.deck_id, table.c.stat_date],
+        set_={field: table.c[field] + stmt.excluded[field] for field in COUNTER_FIELDS}
+    )
+
+def upsert(db: Session, rows: Iterable[dict]):
+    """累加统计增量（合并后一条 executemany UPSERT，不提交，随调用方事务一起提交）"""
+    rows = merge(rows)
+    if rows:
+        db.execute(_upsert_statement(), rows)
+
+def recent(db: Session, days: int = 7, deck_id: Optional[int] = None,
+           today: Optional[date] = None) -> List[dict]:
+    """最近 days 天每天的汇总（按日期升序，没有记录的日期补0）"""
+    today = today or date.today()
+    start = today - timedelta(days=days - 1)
+    query = db.query(
+        models.DailyStats.stat_date,
+        *(func.sum(getattr(models.DailyStats, field)) for field in COUNTER_FIELDS)
+    ).filter(
+        models.DailyStats.stat_date >= start,
+        models.DailyStats.stat_date <= today
+    )
+    if deck_id is not None:
+        query = query.filter(models.DailyStats.deck_id == deck_id)
+    by_day = {row[0]: row[1:] for row in query.group_by(models.DailyStats.stat_date).all()}
+
+    result = []
+    for i in range(days):
+        day = start + timedelta(days=i)
+        values = by_day.get(day, (0,) * len(COUNTER_FIELDS))
+        result.append(dict({"date": day}, **{
+            field: int(value or 0) for field, value in zip(COUNTER_FIELDS, values)
+        }))
+    return result
+
+def activity(db: Session, deck_id: int, days: int = 365, today: Optional[date] = None) -> dict:
+    """词库学习热力图：最近 days 天每天的答题数、正确率和新学单词数（紧凑数组）"""
+    rows = recent(db, days, deck_id, today)
+    counts = [row["correct_count"] + row["error_count"] for row in rows]
+    correct = sum(row["correct_count"] for row in rows)
+    total = sum(counts)
+    return {
+        "deck_id": deck_id,
+        "start": rows[0]["date"].isoformat(),
+        "end": rows[-1]["date"].isoformat(),
+        "counts": counts,
+        "accuracy": [
+            round(row["correct_count"] / count, 3) if count else None
+            for row, count in zip(rows, counts)
+        ],
+        "new_learned": [row["new_learned"] for row in rows],
+        "total": total,
+        "active_days": sum(1 for count in counts if count),
+        "overall_accuracy": round(correct / total, 3) if total else None
+    }
+
+def clear(db: Session):
+    """清空统计（不提交）"""
+    db.query(models.DailyStats).delete()
@@ -0,0 +1,95 @@
+"""
+数据版本号
+data_versions 表按范围保存单调递增的版本号（progress / words / decks / deck:N，与缓存标签同名），
+由 words、progress、decks 上的 SQLite 触发器在写入事务中递增。Web 进程的所有 worker、
+命令行重排和 FSRS 优化等任何写入方都会改变版本号，因此可以用来生成跨进程一致的 ETag。
+"""
+from typing import Dict, Iterable
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from . import models
+from .cache import DECKS_TAG, PROGRESS_TAG, WORDS_TAG
+from .deck_counters import COUNTER_COLUMNS
+
+def _bump(scope: str) -> str:
+    """递增一个范围的版本号（scope 为 SQL 表达式）"""
+    return f"""
+        INSERT INTO data_versions (scope, version) VALUES ({scope}, 1)
+        ON CONFLICT(scope) DO UPDATE SET version = version + 1;
+    """
+
+def _deck_scope(deck_id: str) -> str:
+    """词库范围（与 cache.deck_tag 一致，未归属词库记为 deck:0）"""
+    return f"'deck:' || COALESCE({deck_id}, 0)"
+
+def _word_deck(word_id: str) -> str:
+    return f"(SELECT deck_id FROM words WHERE id = {word_id})"
+
+# decks 上的计数器由 deck_counters 触发器随 words、progress 写入维护，那些写入已递增版本号
+_DECK_SETTING_COLUMNS = ", ".join(
+    column.name for column in models.Deck.__table__.columns
+    if column.name not in COUNTER_COLUMNS and column.name != "id"
+)
+
+VERSION_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_data_versions_word_insert AFTER INSERT ON words
+    BEGIN {_bump(f"'{WORDS_TAG}'")} {_bump(_deck_scope("NEW.deck_id"))} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_data_versions_word_delete AFTER DELETE ON words
+    BEGIN {_bump(f"'{WORDS_TAG}'")} {_bump(_deck_scope("OLD.deck_id"))} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_data_versions_word_update AFTER UPDATE ON words
+    BEGIN
+        {_bump(f"'{WORDS_TAG}'")} {_bump(_deck_scope("OLD.deck_id"))}
+        {_bump(_deck_scope("NEW.deck_id"))}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_data_versions_progress_insert AFTER INSERT ON progress
+    BEGIN {_bump(f"'{PROGRESS_TAG}'")} {_bump(_deck_scope(_word_deck("NEW.word_id")))} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_data_versions_progress_delete AFTER DELETE ON progress
+    BEGIN {_bump(f"'{PROGRESS_TAG}'")} {_bump(_deck_scope(_word_deck("OLD.word_id")))} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_data_versions_progress_update AFTER UPDATE ON progress
+    BEGIN {_bump(f"'{PROGRESS_TAG}'")} {_bump(_deck_scope(_word_deck("NEW.word_id")))} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_data_versions_deck_insert AFTER INSERT ON decks
+    BEGIN {_bump(f"'{DECKS_TAG}'")} {_bump(_deck_scope("NEW.id"))} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_data_versions_deck_delete AFTER DELETE ON decks
+    BEGIN {_bump(f"'{DECKS_TAG}'")} {_bump(_deck_scope("OLD.id"))} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_data_versions_deck_update AFTER UPDATE OF {_DECK_SETTING_COLUMNS} ON decks
+    BEGIN {_bump(f"'{DECKS_TAG}'")} {_bump(_deck_scope("NEW.id"))} END
+    """,
+]
+
+def install_triggers(connection):
+    """创建版本号触发器（已存在则跳过）"""
+    for ddl in VERSION_TRIGGERS:
+        connection.exec_driver_sql(ddl)
+
+def bump(db: Session, scopes: Iterable[str]):
+    """递增版本号（不提交，随调用方事务提交；用于触发器不覆盖的写入，如修复计数器列）"""
+    for scope in dict.fromkeys(scopes):
+        db.execute(text(_bump(":scope")), {"scope": scope})
+
+def versions(db: Session, scopes: Iterable[str]) -> Dict[str, int]:
+    """读取各范围的当前版本号（从未写入过的范围为 0，一次主键 IN 查询）"""
+    scopes = list(dict.fromkeys(scopes))
+    rows = db.query(models.DataVersion.scope, models.DataVersion.version).filter(
+        models.DataVersion.scope.in_(scopes)
+    ).all()
+    found = dict(rows)
+    return {scope: found.get(scope, 0) for scope in scopes}
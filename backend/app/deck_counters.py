@@ -0,0 +1,134 @@
+"""
+词库计数器
+decks 表上的 total_words / learned_words / levelN_words 由 SQLite 触发器随 words、progress
+的增删改在同一事务中维护（上传、清空、重新分类、答题、重置等所有写入路径都会覆盖），
+词库概览只需读取 decks 一张表。另提供全量校验与修复。
+
+用法：
+    python -m app.deck_counters [--repair]
+"""
+from typing import Dict, List
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from . import models
+from .cache import DECKS_TAG, cache, deck_tag
+
+COUNTER_COLUMNS = ("total_words", "learned_words", "level1_words", "level2_words", "level3_words")
+
+# 已掌握（learned）指 mastery_level > 0，与 add_deck_system 迁移中的定义一致
+_LEARNED = "COALESCE({alias}.mastery_level, 0) > 0"
+_WORD_LEARNED = "EXISTS (SELECT 1 FROM progress p WHERE p.word_id = {alias}.id AND COALESCE(p.mastery_level, 0) > 0)"
+
+def _word_delta(alias: str, sign: str) -> str:
+    """单个单词对所属词库计数器的增减"""
+    return f"""
+        UPDATE decks SET
+            total_words = total_words {sign} 1,
+            level1_words = level1_words {sign} ({alias}.difficulty = 1),
+            level2_words = level2_words {sign} ({alias}.difficulty = 2),
+            level3_words = level3_words {sign} ({alias}.difficulty = 3),
+            learned_words = learned_words {sign} {_WORD_LEARNED.format(alias=alias)}
+        WHERE id = {alias}.deck_id;
+    """
+
+COUNTER_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_deck_counters_word_insert AFTER INSERT ON words
+    BEGIN {_word_delta("NEW", "+")} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_deck_counters_word_delete AFTER DELETE ON words
+    BEGIN {_word_delta("OLD", "-")} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_deck_counters_word_update AFTER UPDATE OF difficulty, deck_id ON words
+    WHEN OLD.difficulty IS NOT NEW.difficulty OR OLD.deck_id IS NOT NEW.deck_id
+    BEGIN {_word_delta("OLD", "-")} {_word_delta("NEW", "+")} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_deck_counters_progress_insert AFTER INSERT ON progress
+    WHEN {_LEARNED.format(alias="NEW")}
+    BEGIN
+        UPDATE decks SET learned_words = learned_words + 1
+        WHERE id = (SELECT deck_id FROM words WHERE id = NEW.word_id);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_deck_counters_progress_delete AFTER DELETE ON progress
+    WHEN {_LEARNED.format(alias="OLD")}
+    BEGIN
+        UPDATE decks SET learned_words = learned_words - 1
+        WHERE id = (SELECT deck_id FROM words WHERE id = OLD.word_id);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_deck_counters_progress_update AFTER UPDATE OF mastery_level ON progress
+    WHEN ({_LEARNED.format(alias="OLD")}) != ({_LEARNED.format(alias="NEW")})
+    BEGIN
+        UPDATE decks SET learned_words = learned_words + (CASE WHEN {_LEARNED.format(alias="NEW")} THEN 1 ELSE -1 END)
+        WHERE id = (SELECT deck_id FROM words WHERE id = NEW.word_id);
+    END
+    """,
+]
+
+_ACTUAL_COUNTS = text("""
+    SELECT w.deck_id,
+           COUNT(*) AS total_words,
+           SUM(CASE WHEN COALESCE(p.mastery_level, 0) > 0 THEN 1 ELSE 0 END) AS learned_words,
+           SUM(CASE WHEN w.difficulty = 1 THEN 1 ELSE 0 END) AS level1_words,
+           SUM(CASE WHEN w.difficulty = 2 THEN 1 ELSE 0 END) AS level2_words,
+           SUM(CASE WHEN w.difficulty = 3 THEN 1 ELSE 0 END) AS level3_words
+    FROM words w LEFT JOIN progress p ON p.word_id = w.id
+    GROUP BY w.deck_id
+""")
+
+def install_triggers(connection):
+    """创建计数器触发器（已存在则跳过）"""
+    for ddl in COUNTER_TRIGGERS:
+        connection.exec_driver_sql(ddl)
+
+def verify(db: Session, repair: bool = False) -> List[dict]:
+    """全量统计并与 decks 表中的计数器比较，返回不一致的词库（repair=True 时修复并提交）
+
+    版本号触发器不监听计数器列，修复时在同一事务中递增 decks 和各词库的数据版本号并使缓存失效，
+    词库概览的 ETag 和缓存随之更新。
+    """
+    actual: Dict[int, dict] = {
+        row.deck_id: {column: int(getattr(row, column) or 0) for column in COUNTER_COLUMNS}
+        for row in db.execute(_ACTUAL_COUNTS)
+    }
+
+    mismatches = []
+    for deck in db.query(models.Deck).all():
+        expected = actual.get(deck.id, dict.fromkeys(COUNTER_COLUMNS, 0))
+        stored = {column: getattr(deck, column) or 0 for column in COUNTER_COLUMNS}
+        if stored != expected:
+            mismatches.append({"deck_id": deck.id, "stored": stored, "actual": expected})
+            if repair:
+                for column, value in expected.items():
+                    setattr(deck, column, value)
+    if repair and mismatches:
+        from .data_versions import bump
+        tags = [DECKS_TAG] + [deck_tag(item["deck_id"]) for item in mismatches]
+        bump(db, tags)
+        db.commit()
+        cache.invalidate_tags(*tags)
+    return mismatches
+
+if __name__ == "__main__":
+    import sys
+    from .database import SessionLocal
+
+    repair = "--repair" in sys.argv[1:]
+    session = SessionLocal()
+    try:
+        result = verify(session, repair=repair)
+        for item in result:
+            print(item)
+        action = "已修复" if repair else "发现"
+        print(f"{action} {len(result)} 个词库的计数器不一致")
+        sys.exit(0 if repair or not result else 1)
+    finally:
+        session.close()
@@ -0,0 +1,292 @@
+"""
+待复习日期直方图
+按词库统计各 next_review 日期的卡片数，保存在内存中，由进度写入路径增量维护；
+今日待复习数是直方图的前缀和（跨日时补齐一次）。数据版本号变化（包括其它 worker 的写入）
+或到达对账间隔时，在后台线程中与 SQL 全量统计对账，请求路径上只读取版本号。
+正常关闭时，若直方图自上次对账后数据没有变化，把它连同对应的数据版本号保存为快照；
+进程启动后第一次载入时只在数据版本号仍然一致时使用快照。
+"""
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from . import data_versions, models
+from .cache import PROGRESS_TAG, WORDS_TAG
+
+logger = logging.getLogger(__name__)
+
+# 与 SQL 对账的间隔（秒，0 表示不定期对账）
+RECONCILE_SECONDS = int(os.getenv("DUE_HISTOGRAM_RECONCILE_SECONDS", "300"))
+# 检查数据版本号的间隔（秒）：版本号变化时在后台重新统计，其它 worker 的写入最迟在此间隔加一次统计后可见
+REFRESH_SECONDS = float(os.getenv("DUE_HISTOGRAM_REFRESH_SECONDS", "5"))
+
+_SELECT_HISTOGRAM = text("""
+    SELECT COALESCE(w.deck_id, 0) AS deck_id, p.next_review, COUNT(*) AS count
+    FROM progress p JOIN words w ON w.id = p.word_id
+    WHERE p.next_review IS NOT NULL
+    GROUP BY COALESCE(w.deck_id, 0), p.next_review
+""")
+
+# 快照中保存数据版本号的行：deck_id 为 -1，day 为 _STAMP_SCOPES 中的下标，count 为版本号
+_STAMP_DECK = -1
+_STAMP_SCOPES = (PROGRESS_TAG, WORDS_TAG)
+
+def ordinal_day(value) -> Optional[int]:
+    """日期转序数日（兼容 SQLite 返回的字符串）"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = date.fromisoformat(value[:10])
+    return value.toordinal()
+
+class DueHistogram:
+    """按词库的待复习日期直方图
+
+    _due 记录 next_review <= _today 的卡片数，单次移动只需 O(1) 调整桶和前缀和，
+    日期变化时把新跨过的桶累加进前缀和。
+    SQL 统计不持有锁：统计期间提交的移动先记下，统计完成后在新直方图上重放。
+    """
+
+    def __init__(self, reconcile_interval: int = RECONCILE_SECONDS, refresh_interval: float = REFRESH_SECONDS):
+        self.reconcile_interval = reconcile_interval
+        self.refresh_interval = refresh_interval
+        self._buckets: Dict[int, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        self._due: Dict[int, int] = defaultdict(int)
+        self._due_total = 0
+        self._today: Optional[int] = None
+        self._loaded = False
+        self._versions: Optional[Dict[str, int]] = None  # 直方图对应的数据版本号（最近一次统计前读取）
+        self._reconciled_at = 0.0
+        self._checked_at = 0.0
+        self._rebuild_moves: Optional[List[Tuple[Optional[int], object, object]]] = None  # 统计期间的移动
+        self._refresher: Optional[threading.Thread] = None
+        self._snapshot_checked = False  # 快照只在进程启动后第一次载入时使用
+        self._bind = None  # 载入直方图的数据库，关闭时快照写回同一个库
+        self._lock = threading.RLock()
+        self._rebuild_lock = threading.Lock()  # 同一时间只有一次 SQL 统计
+
+    def _reset(self, buckets: Dict[int, Dict[int, int]], today: int):
+        """用完整直方图替换当前状态（调用方需持有锁）"""
+        self._buckets = defaultdict(lambda: defaultdict(int))
+        self._due = defaultdict(int)
+        for deck_id, days in buckets.items():
+            for day, count in days.items():
+                self._buckets[deck_id][day] += count
+                if day <= today:
+                    self._due[deck_id] += count
+        self._due_total = sum(self._due.values())
+        self._today = today
+        self._loaded = True
+
+    def _advance(self, today: int):
+        """日期变化时重新计算前缀和（每天一次）"""
+        if today == self._today:
+            return
+        if self._today is not None and today > self._today:
+            for deck_id, days in self._buckets.items():
+                crossed = sum(count for day, count in days.items() if self._today < day <= today)
+                self._due[deck_id] += crossed
+                self._due_total += crossed
+            self._today = today
+        else:
+            self._reset(self._buckets, today)
+
+    @staticmethod
+    def _query(db: Session) -> Dict[int, Dict[int, int]]:
+        """从 progress 表统计完整直方图（一次 GROUP BY）"""
+        buckets: Dict[int, Dict[int, int]] = defaultdict(dict)
+        for row in db.execute(_SELECT_HISTOGRAM):
+            day = ordinal_day(row.next_review)
+            buckets[row.deck_id][day] = buckets[row.deck_id].get(day, 0) + row.count
+        return buckets
+
+    @staticmethod
+    def _load_snapshot(db: Session, versions: Dict[str, int]) -> Optional[Dict[int, Dict[int, int]]]:
+        """读取快照；没有快照，或保存后 progress、words 有过写入（数据版本号不同）时返回 None"""
+        buckets: Dict[int, Dict[int, int]] = defaultdict(dict)
+        stamp = {}
+        for bucket in db.query(models.DueHistogramBucket).all():
+            if bucket.deck_id == _STAMP_DECK:
+                if 0 <= bucket.day < len(_STAMP_SCOPES):
+                    stamp[_STAMP_SCOPES[bucket.day]] = bucket.count
+            else:
+                buckets[bucket.deck_id][bucket.day] = bucket.count
+        if not stamp:
+            return None
+        if stamp != versions:
+            logger.info("Due histogram snapshot is out of date, rebuilding from progress")
+            return None
+        return buckets
+
+    def _rebuild(self, db: Session, today: int, use_snapshot: bool = False) -> Dict[int, int]:
+        """重新统计直方图（调用方需持有 _rebuild_lock，不持有 _lock），返回各词库的待复习数偏差（内存 - SQL，首次载入时为空）"""
+        with self._lock:
+            self._rebuild_moves = []
+        try:
+            # 版本号在统计前读取：统计期间的写入会使版本号落后，下次检查时再统计一次
+            versions = data_versions.versions(db, _STAMP_SCOPES)
+            actual = self._load_snapshot(db, versions) if use_snapshot else None
+            if actual is None:
+                actual = self._query(db)
+        except Exception:
+            with self._lock:
+                self._rebuild_moves = None
+            raise
+
+        with self._lock:
+            moves, self._rebuild_moves = self._rebuild_moves, None
+            drift = {}
+            if self._loaded:
+                self._advance(today)
+                for deck_id in set(self._due) | set(actual):
+                    expected = sum(count for day, count in actual.get(deck_id, {}).items() if day <= today)
+                    if self._due.get(deck_id, 0) != expected:
+                        drift[deck_id] = self._due.get(deck_id, 0) - expected
+            self._reset(actual, today)
+            self._apply(moves)
+            self._versions = versions
+            self._bind = db.get_bind()
+            self._reconciled_at = self._checked_at = time.time()
+        if drift:
+            logger.warning(f"Due histogram drift corrected: {drift}")
+        return drift
+
+    def reconcile(self, db: Session, today: Optional[date] = None) -> Dict[int, int]:
+        """与 SQL 全量统计对账并修正（同步），返回各词库的待复习数偏差（内存 - SQL）"""
+        with self._rebuild_lock:
+            return self._rebuild(db, (today or date.today()).toordinal())
+
+    def _refresh(self, bind, today: int):
+        """后台对账线程"""
+        try:
+            with self._rebuild_lock, Session(bind) as db:
+                self._rebuild(db, today)
+        except Exception as e:
+            logger.error(f"Due histogram refresh failed: {str(e)}")
+
+    def _refresh_if_stale(self, db: Session, today: int):
+        """数据版本号变化或到达对账间隔时启动后台对账（同一时间只有一个）"""
+        now = time.time()
+        with self._lock:
+            if self._refresher is not None and self._refresher.is_alive():
+                return
+            periodic = self.reconcile_interval and now - self._reconciled_at >= self.reconcile_interval
+            if not periodic and now - self._checked_at < self.refresh_interval:
+                return
+            self._checked_at = now
+            versions = self._versions
+        if not periodic and data_versions.versions(db, _STAMP_SCOPES) == versions:
+            return
+        with self._lock:
+            if self._refresher is not None and self._refresher.is_alive():
+                return
+            self._refresher = threading.Thread(
+                target=self._refresh, args=(db.get_bind(), today), name="due-histogram-refresh", daemon=True
+            )
+            self._refresher.start()
+
+    def count(self, db: Session, deck_id: Optional[int] = None, today: Optional[date] = None) -> int:
+        """今日待复习数（deck_id 为空时统计全部词库）
+
+        首次载入（或 invalidate 之后）同步统计；之后数据有变化时在后台对账，本次先返回增量维护的结果。
+        """
+        today_ordinal = (today or date.today()).toordinal()
+        if self._loaded:
+            self._refresh_if_stale(db, today_ordinal)
+        else:
+            with self._rebuild_lock:
+                if not self._loaded:
+                    use_snapshot = not self._snapshot_checked
+                    self._snapshot_checked = True
+                    self._rebuild(db, today_ordinal, use_snapshot=use_snapshot)
+        with self._lock:
+            self._advance(today_ordinal)
+            if deck_id is None:
+                return self._due_total
+            return self._due.get(deck_id, 0)
+
+    def move(self, deck_id: Optional[int], old, new):
+        """一张卡片的 next_review 从 old 变为 new（None 表示无进度）"""
+        self.apply_moves([(deck_id, old, new)])
+
+    def apply_moves(self, moves: Iterable[Tuple[Optional[int], object, object]]):
+        """批量应用 next_review 变化（在写入事务提交后调用）"""
+        with self._lock:
+            if self._rebuild_moves is not None:
+                moves = list(moves)
+                self._rebuild_moves.extend(moves)
+            if self._loaded:
+                self._apply(moves)
+
+    def _apply(self, moves: Iterable[Tuple[Optional[int], object, object]]):
+        """应用移动（调用方需持有锁）"""
+        for deck_id, old, new in moves:
+            deck_id = deck_id or 0
+            old_day, new_day = ordinal_day(old), ordinal_day(new)
+            if old_day == new_day:
+                continue
+            buckets = self._buckets[deck_id]
+            if old_day is not None:
+                buckets[old_day] -= 1
+                if buckets[old_day] <= 0:
+                    del buckets[old_day]
+                if old_day <= self._today:
+                    self._due[deck_id] -= 1
+                    self._due_total -= 1
+            if new_day is not None:
+                buckets[new_day] += 1
+                if new_day <= self._today:
+                    self._due[deck_id] += 1
+                    self._due_total += 1
+
+    def invalidate(self):
+        """丢弃内存直方图，下次读取时从 SQL 重建（用于清空进度、整库重排等批量修改）"""
+        with self._lock:
+            self._loaded = False
+            self._versions = None
+            self._buckets = defaultdict(lambda: defaultdict(int))
+            self._due = defaultdict(int)
+            self._due_total = 0
+            self._today = None
+
+    def close(self):
+        """应用正常关闭时保存快照
+
+        只在数据版本号与最近一次统计时相同（之后没有任何写入，内存直方图与数据库一致）时
+        保存内存中的直方图及这些版本号，不在关闭时重新统计；否则删除旧快照，下次启动时从 SQL 统计。
+        """
+        with self._lock:
+            if not self._loaded or self._bind is None:
+                return
+            bind = self._bind
+            versions = self._versions
+            rows = [
+                {"deck_id": deck_id, "day": day, "count": count}
+                for deck_id, days in self._buckets.items()
+                for day, count in days.items() if count > 0
+            ]
+        try:
+            with Session(bind) as db:
+                db.query(models.DueHistogramBucket).delete()
+                if versions is not None and data_versions.versions(db, _STAMP_SCOPES) == versions:
+                    rows.extend(
+                        {"deck_id": _STAMP_DECK, "day": index, "count": versions[scope]}
+                        for index, scope in enumerate(_STAMP_SCOPES)
+                    )
+                    db.execute(models.DueHistogramBucket.__table__.insert(), rows)
+                else:
+                    logger.info("Due histogram changed since the last reconcile, snapshot not saved")
+                db.commit()
+        except Exception as e:
+            # 保存失败只影响下次启动速度（改为从 SQL 重建）
+            logger.error(f"Due histogram snapshot failed: {str(e)}")
+
+# 全局直方图实例
+due_histogram = DueHistogram()
@@ -0,0 +1,379 @@
+"""
+FSRS 参数优化
+从 review_log 分块流式读取词库的答题历史（超过 MAX_REVIEWS 时按 word_id 哈希均匀抽取卡片），
+整理为按步对齐的紧凑数组，
+用向量化的中心差分梯度 + Adam 拟合 FSRS 权重，结果写回 decks.fsrs_weights。
+多个词库通过进程池并行优化。
+
+用法：
+    python -m app.fsrs_optimizer <deck_id> [deck_id ...] [--processes N]
+"""
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from sqlalchemy import create_engine, text
+
+from . import scheduler
+from .cache import DECKS_TAG, cache, deck_tag
+
+logger = logging.getLogger(__name__)
+
+# 每块读取的日志行数
+READ_CHUNK_SIZE = 100000
+# 最多载入的答题数（超出时按卡片均匀抽样，保证内存有界）
+MAX_REVIEWS = 2000000
+# 卡片抽样哈希：word_id 乘以 Knuth 乘法常数后取低 32 位，与阈值比较
+_SAMPLE_MULTIPLIER = 2654435761
+_SAMPLE_SPACE = 1 << 32
+# 少于该数量的有效训练样本时不优化
+MIN_TRAIN_REVIEWS = 400
+# 每个小批量的卡片数
+BLOCK_SIZE = 4096
+DEFAULT_EPOCHS = 5
+DEFAULT_LEARNING_RATE = 0.02
+# 归一化空间中的差分步长
+GRADIENT_EPSILON = 1e-3
+
+# 权重取值范围（与 FSRS-4.5 官方优化器一致）
+WEIGHT_BOUNDS = np.array([
+    (0.1, 100.0), (0.1, 100.0), (0.1, 100.0), (0.1, 100.0),
+    (1.0, 10.0), (0.1, 5.0), (0.1, 5.0), (0.0, 0.5),
+    (0.0, 3.0), (0.1, 0.8), (0.01, 2.5), (0.5, 5.0),
+    (0.01, 0.2), (0.01, 0.9), (0.01, 2.0), (0.0, 1.0), (1.0, 4.0),
+])
+
+_SELECT_REVIEWS = text("""
+    SELECT r.id, r.word_id, r.reviewed_at, r.elapsed_days, r.grade
+    FROM review_log r JOIN words w ON w.id = r.word_id
+    WHERE w.deck_id = :deck_id
+      AND (r.word_id, r.reviewed_at, r.id) > (:word_id, :reviewed_at, :id)
+      AND (r.word_id * :multiplier) % :space < :threshold
+    ORDER BY r.word_id, r.reviewed_at, r.id
+    LIMIT :limit
+""")
+
+_COUNT_REVIEWS = text("""
+    SELECT COUNT(*) FROM review_log r JOIN words w ON w.id = r.word_id
+    WHERE w.deck_id = :deck_id
+""")
+
+class ReviewHistory:
+    """一个词库的答题历史（紧凑数组，按卡片连续存放）"""
+
+    def __init__(self, elapsed: np.ndarray, grades: np.ndarray, card_starts: np.ndarray,
+                 total_reviews: Optional[int] = None):
+        self.elapsed = elapsed  # int32，距上次复习天数
+        self.grades = grades  # int8，评分
+        self.card_starts = card_starts  # 每张卡片第一条记录的下标
+        self.card_lengths = np.diff(np.append(card_starts, len(grades)))
+        # 词库的全部答题数（抽样载入时大于 review_count）
+        self.total_reviews = len(grades) if total_reviews is None else total_reviews
+
+    @property
+    def sampled(self) -> bool:
+        return self.review_count < self.total_reviews
+
+    @property
+    def review_count(self) -> int:
+        return len(self.grades)
+
+    @property
+    def card_count(self) -> int:
+        return len(self.card_starts)
+
+    @property
+    def train_count(self) -> int:
+        """参与损失计算的答题数（每张卡片第一次之后、且间隔大于0天）"""
+        first = np.zeros(len(self.grades), dtype=bool)
+        first[self.card_starts] = True
+        return int(np.count_nonzero(~first & (self.elapsed > 0)))
+
+def load_history(conn, deck_id: int, max_reviews: int = MAX_REVIEWS,
+                 chunk_size: int = READ_CHUNK_SIZE) -> ReviewHistory:
+    """按 (word_id, reviewed_at) 顺序分块读取答题历史
+
+    答题总数超过 max_reviews 时按 word_id 的乘法哈希抽取约 max_reviews 条答题的卡片
+    （在 word_id 范围内均匀分布，每张卡片的历史完整）；抽样结果仍超出时在卡片边界处截断，
+    内存占用与 max_reviews 成正比。
+    """
+    total = conn.execute(_COUNT_REVIEWS, {"deck_id": deck_id}).scalar() or 0
+    threshold = _SAMPLE_SPACE if total <= max_reviews else int(_SAMPLE_SPACE * max_reviews / total)
+    sample = {"multiplier": _SAMPLE_MULTIPLIER, "space": _SAMPLE_SPACE, "threshold": threshold}
+
+    elapsed_parts, grade_parts, word_parts = [], [], []
+    loaded = 0
+    cursor = {"word_id": -1, "reviewed_at": -1, "id": -1}
+    while loaded < max_reviews:
+        rows = conn.execute(_SELECT_REVIEWS, dict(cursor, **sample, deck_id=deck_id, limit=chunk_size)).fetchall()
+        if not rows:
+            break
+        last = rows[-1]
+        cursor = {"word_id": last.word_id, "reviewed_at": last.reviewed_at, "id": last.id}
+
+        columns = np.array([(row.word_id, row.elapsed_days or 0, row.grade) for row in rows], dtype=np.int64)
+        word_parts.append(columns[:, 0])
+        elapsed_parts.append(columns[:, 1].astype(np.int32))
+        grade_parts.append(columns[:, 2].astype(np.int8))
+        loaded += len(rows)
+
+    if not word_parts:
+        empty = np.zeros(0, dtype=np.int64)
+        return ReviewHistory(empty.astype(np.int32), empty.astype(np.int8), empty, total)
+
+    word_ids = np.concatenate(word_parts)
+    elapsed = np.concatenate(elapsed_parts)
+    grades = np.concatenate(grade_parts)
+    card_starts = np.flatnonzero(np.r_[True, word_ids[1:] != word_ids[:-1]])
+
+    # 超出预算时丢弃最后一张（可能不完整的）卡片
+    if loaded >= max_reviews and len(card_starts) > 1:
+        cut = card_starts[-1]
+        elapsed, grades, card_starts = elapsed[:cut], grades[:cut], card_starts[:-1]
+
+    return ReviewHistory(elapsed, grades, card_starts, total)
+
+class _Block:
+    """一个小批量：按步对齐（第 k 步包含所有长度大于 k 的卡片，按长度降序排列）"""
+
+    def __init__(self, history: ReviewHistory, cards: np.ndarray):
+        lengths = history.card_lengths[cards]
+        order = np.argsort(-lengths, kind="stable")
+        cards, lengths = cards[order], lengths[order]
+        starts = history.card_starts[cards]
+
+        self.size = len(cards)
+        self.step_counts = [int(np.count_nonzero(lengths > k)) for k in range(int(lengths.max()))]
+        index = np.concatenate([starts[:n] + k for k, n in enumerate(self.step_counts)])
+        self.elapsed = history.elapsed[index].astype(np.float64)
+        self.grades = history.grades[index].astype(np.int64)
+
+def _make_blocks(history: ReviewHistory, block_size: int, rng: np.random.Generator) -> List[_Block]:
+    cards = rng.permutation(history.card_count)
+    return [_Block(history, cards[i:i + block_size]) for i in range(0, len(cards), block_size)]
+
+def _block_loss(block: _Block, weights: np.ndarray, request_retention: float):
+    """对一个小批量重放历史，返回每组权重的对数损失之和与样本数
+
+    Args:
+        weights: 形状 (17,) 或 (17, P, 1)
+    """
+    batched = weights.ndim == 3
+    shape = (weights.shape[1], block.size) if batched else (block.size,)
+    stability = np.zeros(shape)
+    difficulty = np.zeros(shape)
+    total = np.zeros(weights.shape[1] if batched else 1)
+    count = 0
+
+    offset = 0
+    for k, n in enumerate(block.step_counts):
+        t = block.elapsed[offset:offset + n]
+        g = block.grades[offset:offset + n]
+        offset += n
+
+        s_next, d_next, r, _ = scheduler.fsrs_kernel(
+            stability[..., :n], difficulty[..., :n], t, g, weights, request_retention
+        )
+        if k > 0:
+            mask = t > 0
+            if mask.any():
+                p = np.clip(r[..., mask], 1e-4, 1 - 1e-4)
+                y = g[mask] > 1
+                total += -(np.where(y, np.log(p), np.log(1 - p))).sum(axis=-1)
+                count += int(np.count_nonzero(mask))
+        stability[..., :n] = s_next
+        difficulty[..., :n] = d_next
+    return total, count
+
+def evaluate(history: ReviewHistory, weights: Sequence[float],
+             request_retention: float = scheduler.DEFAULT_REQUEST_RETENTION,
+             block_size: int = BLOCK_SIZE) -> float:
+    """计算给定权重在全部历史上的平均对数损失"""
+    w = np.asarray(weights, dtype=np.float64)
+    total, count = 0.0, 0
+    for block in _make_blocks(history, block_size, np.random.default_rng(0)):
+        block_total, block_count = _block_loss(block, w, request_retention)
+        total += float(block_total[0])
+        count += block_count
+    return total / count if count else 0.0
+
+def fit(history: ReviewHistory, initial: Sequence[float] = scheduler.DEFAULT_FSRS_WEIGHTS,
+        request_retention: float = scheduler.DEFAULT_REQUEST_RETENTION,
+        epochs: int = DEFAULT_EPOCHS, learning_rate: float = DEFAULT_LEARNING_RATE,
+        block_size: int = BLOCK_SIZE, seed: int = 0) -> np.ndarray:
+    """小批量梯度下降拟合 FSRS 权重
+
+    权重先按 WEIGHT_BOUNDS 归一化到 [0, 1]，每个小批量把基准权重和
+    34 组中心差分扰动堆叠成 (17, 34, 1) 一次向量化重放，得到梯度后用 Adam 更新。
+    """
+    lower, upper = WEIGHT_BOUNDS[:, 0], WEIGHT_BOUNDS[:, 1]
+    span = upper - lower
+    theta = np.clip((np.asarray(initial, dtype=np.float64) - lower) / span, 0.0, 1.0)
+    dims = len(theta)
+
+    # 扰动矩阵：第 2i / 2i+1 组分别为第 i 维 +eps / -eps
+    perturb = np.zeros((2 * dims, dims))
+    perturb[0::2][np.arange(dims), np.arange(dims)] = GRADIENT_EPSILON
+    perturb[1::2][np.arange(dims), np.arange(dims)] = -GRADIENT_EPSILON
+
+    m = np.zeros(dims)
+    v = np.zeros(dims)
+    beta1, beta2, step = 0.9, 0.999, 0
+    rng = np.random.default_rng(seed)
+
+    for _ in range(epochs):
+        for block in _make_blocks(history, block_size, rng):
+            candidates = np.clip(theta + perturb, 0.0, 1.0)
+            weights = (lower + candidates * span).T[:, :, None]
+            total, count = _block_loss(block, weights, request_retention)
+            if count == 0:
+                continue
+            loss = total / count
+            delta = (candidates[0::2] - candidates[1::2]).diagonal()
+            grad = np.where(delta > 0, (loss[0::2] - loss[1::2]) / np.maximum(delta, 1e-12), 0.0)
+
+            step += 1
+            m = beta1 * m + (1 - beta1) * grad
+            v = beta2 * v + (1 - beta2) * grad ** 2
+            m_hat = m / (1 - beta1 ** step)
+            v_hat = v / (1 - beta2 ** step)
+            theta = np.clip(theta - learning_rate * m_hat / (np.sqrt(v_hat) + 1e-8), 0.0, 1.0)
+
+    return lower + theta * span
+
+def optimize_deck(database_url: str, deck_id: int, epochs: int = DEFAULT_EPOCHS,
+                  max_reviews: int = MAX_REVIEWS) -> dict:
+    """优化单个词库（可在子进程中运行），返回结果字典（不写数据库）"""
+    started = time.time()
+    engine = create_engine(database_url)
+    try:
+        with engine.connect() as conn:
+            deck = conn.execute(
+                text("SELECT algorithm, fsrs_weights, request_retention FROM decks WHERE id = :id"),
+                {"id": deck_id}
+            ).first()
+            if deck is None:
+                return {"deck_id": deck_id, "status": "failed", "error": "词库不存在"}
+            params = scheduler.SchedulerParams.from_deck(scheduler.FSRS, deck.fsrs_weights, deck.request_retention)
+            history = load_history(conn, deck_id, max_reviews)
+    finally:
+        engine.dispose()
+
+    result = {
+        "deck_id": deck_id,
+        "reviews": history.review_count,
+        # 答题数超过 max_reviews 时只用均匀抽取的部分卡片拟合
+        "total_reviews": history.total_reviews,
+        "max_reviews": max_reviews,
+        "sampled": history.sampled,
+        "cards": history.card_count,
+        "train_reviews": history.train_count,
+    }
+    if history.train_count < MIN_TRAIN_REVIEWS:
+        result.update(status="skipped", error=f"有效答题数不足 {MIN_TRAIN_REVIEWS}",
+                      elapsed=round(time.time() - started, 3))
+        return result
+
+    loss_before = evaluate(history, params.weights, params.request_retention)
+    fit_started = time.time()
+    weights = fit(history, params.weights, params.request_retention, epochs=epochs)
+    fit_elapsed = time.time() - fit_started
+    loss_after = evaluate(history, weights, params.request_retention)
+
+    # 拟合结果没有改善时保留原权重
+    improved = loss_after < loss_before
+    result.update(
+        status="done" if improved else "unchanged",
+        weights=[round(float(w), 4) for w in (weights if improved else params.weights)],
+        loss_before=round(loss_before, 5),
+        loss_after=round(min(loss_after, loss_before), 5),
+        elapsed=round(time.time() - started, 3),
+        reviews_per_second=round(history.review_count * epochs / fit_elapsed) if fit_elapsed > 0 else None
+    )
+    return result
+
+def save_weights(engine, results: List[dict]):
+    """把优化得到的权重写回 decks 表，提交后使词库设置和对应词库的缓存失效"""
+    updates = [
+        {"id": r["deck_id"], "weights": json.dumps(r["weights"])}
+        for r in results if r.get("status") == "done"
+    ]
+    if not updates:
+        return
+    with engine.connect() as conn:
+        conn.execute(text("UPDATE decks SET fsrs_weights = :weights WHERE id = :id"), updates)
+        conn.commit()
+    cache.invalidate_tags(DECKS_TAG, *(deck_tag(update["id"]) for update in updates))
+
+def optimize_decks(database_url: str, deck_ids: List[int], processes: int = 1,
+                   epochs: int = DEFAULT_EPOCHS, save: bool = True) -> List[dict]:
+    """优化多个词库：processes > 1 时使用进程池并行，结果按输入顺序返回"""
+    if processes > 1 and len(deck_ids) > 1:
+        with ProcessPoolExecutor(max_workers=min(processes, len(deck_ids))) as pool:
+            results = list(pool.map(
+                optimize_deck, [database_url] * len(deck_ids), deck_ids, [epochs] * len(deck_ids)
+            ))
+    else:
+        results = [optimize_deck(database_url, deck_id, epochs) for deck_id in deck_ids]
+
+    if save:
+        engine = create_engine(database_url)
+        try:
+            save_weights(engine, results)
+        finally:
+            engine.dispose()
+    return results
+
+class OptimizerRuns:
+    """后台优化任务状态（按词库记录最近一次结果）"""
+
+    def __init__(self):
+        self._results: Dict[int, dict] = {}
+        self._lock = threading.Lock()
+
+    def start(self, database_url: str, deck_id: int, epochs: int = DEFAULT_EPOCHS) -> dict:
+        """在后台线程中优化词库；同一词库正在运行时直接返回当前状态"""
+        with self._lock:
+            current = self._results.get(deck_id)
+            if current and current.get("status") == "running":
+                return current
+            state = {"deck_id": deck_id, "status": "running"}
+            self._results[deck_id] = state
+
+        def run():
+            try:
+                result = optimize_decks(database_url, [deck_id], epochs=epochs)[0]
+            except Exception as e:
+                logger.error(f"FSRS optimization for deck {deck_id} failed: {str(e)}")
+                result = {"deck_id": deck_id, "status": "failed", "error": str(e)}
+            with self._lock:
+                self._results[deck_id] = result
+
+        threading.Thread(target=run, name=f"fsrs-optimize-{deck_id}", daemon=True).start()
+        return state
+
+    def get(self, deck_id: int) -> Optional[dict]:
+        with self._lock:
+            return self._results.get(deck_id)
+
+# 全局优化任务状态
+optimizer_runs = OptimizerRuns()
+
+if __name__ == "__main__":
+    import argparse
+    from .database import SQLALCHEMY_DATABASE_URL
+
+    parser = argparse.ArgumentParser(description="FSRS 参数优化")
+    parser.add_argument("deck_ids", type=int, nargs="+", help="词库ID")
+    parser.add_argument("--processes", type=int, default=1, help="并行进程数")
+    parser.add_argument("--epochs", type=int, default=DEFAULT_EPOCHS, help="训练轮数")
+    parser.add_argument("--dry-run", action="store_true", help="只输出结果，不写回数据库")
+    args = parser.parse_args()
+
+    for item in optimize_decks(SQLALCHEMY_DATABASE_URL, args.deck_ids, args.processes,
+                               args.epochs, save=not args.dry_run):
+        print(json.dumps(item, ensure_ascii=False))
@@ -10,28 +10,55 @@ if sys.platform == 'win32':
     sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
     sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
 
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
+from datetime import date
+from contextlib import asynccontextmanager, nullcontext
+import hashlib
 import io
+import json
 
-from . import models, schemas, crud
+from . import models, schemas, crud, scheduler, review_log, daily_stats, data_versions
 from .database import engine, get_db
+from .word_index import word_index
+from .answer_journal import answer_journal, WRITE_BEHIND_ENABLED
+from .reschedule import reschedule_manager
+from .fsrs_optimizer import optimizer_runs
+from .due_histogram import due_histogram
+from .performance import perf_stats
+from .metrics import METRICS_ENABLED, MetricsMiddleware, cache_metrics, request_metrics
+from .query_stats import QUERY_STATS_ENABLED, QueryStatsMiddleware
+from .profiling import PROFILING_ENABLED, ProfilingMiddleware, ProfilingRoute, profile_store
+from .tracing import TRACING_ENABLED, TracingMiddleware, install_sql_hooks, trace_buffer
+from .cache import cache, cached, deck_tag, DECKS_TAG, PROGRESS_TAG, WORDS_TAG
 
 # 创建数据库表（自动初始化）
 try:
     models.Base.metadata.create_all(bind=engine)
+    # 已有数据库也需要数据版本号触发器（ETag 依赖它们，已存在则跳过）
+    with engine.begin() as connection:
+        data_versions.install_triggers(connection)
     print("✓ 数据库表初始化成功")
 except Exception as e:
     print(f"⚠ 数据库初始化警告: {e}")
     # 继续启动，因为表可能已存在
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：关闭时写入所有尚未落库的答题，保存待复习直方图快照，并写完待导出的追踪"""
+    yield
+    answer_journal.close()
+    due_histogram.close()
+    trace_buffer.close()
+
 # 创建FastAPI应用
 app = FastAPI(
     title="WordEasy API",
     description="拼写攻防战 - 英语单词学习API",
-    version="1.4.0"
+    version="1.4.0",
+    lifespan=lifespan
 )
 
 # CORS配置（允许前端访问）
@@ -43,25 +70,73 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 请求指标（延迟直方图、状态码、进行中请求数）
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware, stats=perf_stats)
+
+# 每个请求执行的 SQL 语句数和耗时（X-DB-Queries / X-DB-Time 响应头）
+if QUERY_STATS_ENABLED:
+    app.add_middleware(QueryStatsMiddleware)
+
+# 请求追踪（路由、crud 调用和 SQL 的耗时片段，X-Trace-Id 响应头）
+# 未开启时不注册 SQL 事件钩子，调试接口也不注册（见 install_trace_routes）
+if TRACING_ENABLED:
+    install_sql_hooks()
+    app.add_middleware(TracingMiddleware)
+
+# 按请求性能分析（X-Profile: 1 或 ?profile=1），未开启时不安装任何钩子
+if PROFILING_ENABLED:
+    app.router.route_class = ProfilingRoute
+    app.add_middleware(ProfilingMiddleware)
+
 @app.get("/")
 def read_root():
     """根路径"""
     return {"message": "Welcome to WordEasy API", "version": "1.4.0"}
 
-def _build_word_response(word: models.Word, db: Session) -> schemas.WordResponse:
-    """构建单词响应对象（内部辅助函数）"""
-    progress = crud.get_or_create_progress(db, word.id)
-    return schemas.WordResponse(
-        id=word.id,
-        word=word.word,
-        zh_definition=word.zh_definition,
-        difficulty=word.difficulty,
-        category=word.category,
-        audio_url=word.audio_url,
-        mastery_level=progress.mastery_level,
-        next_review=progress.next_review,
-        error_count=progress.error_count
-    )
+def _data_etag(db: Session, scopes: List[str], *extra) -> str:
+    """由数据库中的数据版本号（触发器在写入事务中递增）生成 ETag
+
+    版本号保存在数据库里，多个 worker 以及命令行等进程外的写入都会改变 ETag；只需一次主键查询。
+    """
+    raw = json.dumps([data_versions.versions(db, scopes), *extra], sort_keys=True, default=str)
+    return '"' + hashlib.md5(raw.encode()).hexdigest()[:20] + '"'
+
+def _not_modified(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """If-None-Match 与当前 ETag 相同时返回 304，否则在响应中带上 ETag"""
+    header = request.headers.get("if-none-match")
+    if header:
+        candidates = {tag.strip()[2:] if tag.strip().startswith("W/") else tag.strip()
+                      for tag in header.split(",")}
+        if etag in candidates or "*" in candidates:
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    response.headers["ETag"] = etag
+    # 允许浏览器缓存，但每次使用前都要带 If-None-Match 重新验证
+    response.headers["Cache-Control"] = "no-cache"
+    return None
+
+def _build_word_responses(words: List[models.Word], db: Session) -> List[schemas.WordResponse]:
+    """批量构建单词响应对象（内部辅助函数）
+    
+    通过一次 LEFT OUTER JOIN 读取所有单词的进度，没有进度记录的单词
+    使用默认值，不写入数据库。
+    """
+    rows = crud.get_words_with_progress(db, [word.id for word in words])
+    today = date.today()
+    return [
+        schemas.WordResponse(
+            id=word.id,
+            word=word.word,
+            zh_definition=word.zh_definition,
+            difficulty=word.difficulty,
+            category=word.category,
+            audio_url=word.audio_url,
+            mastery_level=progress.mastery_level if progress else 0,
+            next_review=progress.next_review if progress else today,
+            error_count=progress.error_count if progress else 0
+        )
+        for word, progress in rows
+    ]
 
 @app.get("/api/words", response_model=List[schemas.WordResponse])
 def get_words(difficulty: int = 1, limit: int = 10, db: Session = Depends(get_db)):
@@ -74,19 +149,37 @@ def get_words(difficulty: int = 1, limit: int = 10, db: Session = Depends(get_db
         raise HTTPException(status_code=400, detail="难度必须是1、2或3")
     
     words = crud.get_words_by_difficulty(db, difficulty, limit)
-    return [_build_word_response(word, db) for word in words]
+    return _build_word_responses(words, db)
 
 @app.get("/api/words/review", response_model=List[schemas.WordResponse])
-def get_review_words(limit: int = 20, db: Session = Depends(get_db)):
-    """获取今日待复习单词"""
-    words = crud.get_review_words(db, limit)
-    return [_build_word_response(word, db) for word in words]
+def get_review_words(request: Request, response: Response, limit: int = 20, deck_id: Optional[int] = None,
+                     db: Session = Depends(get_db)):
+    """获取今日待复习单词（deck_id 为空时包含全部词库）"""
+    etag = _data_etag(db, [PROGRESS_TAG, WORDS_TAG], date.today(), limit, deck_id)
+    not_modified = _not_modified(request, response, etag)
+    if not_modified:
+        return not_modified
+    
+    words = crud.get_review_words(db, limit, deck_id)
+    return _build_word_responses(words, db)
 
 @app.get("/api/words/errors", response_model=List[schemas.WordResponse])
-def get_error_words(limit: int = 20, db: Session = Depends(get_db)):
+def get_error_words(request: Request, response: Response, limit: int = 20, db: Session = Depends(get_db)):
     """获取错词本"""
+    etag = _data_etag(db, [PROGRESS_TAG, WORDS_TAG], date.today(), limit)
+    not_modified = _not_modified(request, response, etag)
+    if not_modified:
+        return not_modified
+    
     words = crud.get_error_words(db, limit)
-    return [_build_word_response(word, db) for word in words]
+    return _build_word_responses(words, db)
+
+# 批量拼写检查的最大条数
+MAX_SPELL_BATCH_SIZE = 200
+
+def _is_spelling_correct(user_input: str, word: models.Word) -> bool:
+    """判断拼写是否正确（标准化输入：去除空白、转小写）"""
+    return user_input.strip().lower() == word.word.lower()
 
 @app.post("/api/spell/check", response_model=schemas.SpellCheckResponse)
 def check_spelling(request: schemas.SpellCheckRequest, db: Session = Depends(get_db)):
@@ -95,15 +188,14 @@ def check_spelling(request: schemas.SpellCheckRequest, db: Session = Depends(get
     if not word:
         raise HTTPException(status_code=404, detail="单词不存在")
     
-    # 标准化输入：去除空白、转小写
-    user_input = request.input.strip().lower()
-    correct_word = word.word.lower()
-    
     # 判断是否正确
-    is_correct = user_input == correct_word
+    is_correct = _is_spelling_correct(request.input, word)
     
-    # 更新进度
-    progress = crud.update_progress(db, request.word_id, is_correct)
+    # 更新进度（写后模式下进入日志，由后台线程批量写入）
+    if WRITE_BEHIND_ENABLED:
+        progress = answer_journal.record(db, request.word_id, is_correct)
+    else:
+        progress = crud.update_progress(db, request.word_id, is_correct)
     
     return schemas.SpellCheckResponse(
         correct=is_correct,
@@ -112,15 +204,143 @@ def check_spelling(request: schemas.SpellCheckRequest, db: Session = Depends(get
         mastery_level=progress.mastery_level
     )
 
+@app.post("/api/spell/check-batch", response_model=List[schemas.SpellCheckResponse])
+def check_spelling_batch(request: schemas.SpellCheckBatchRequest, db: Session = Depends(get_db)):
+    """
+    批量检查拼写（挑战模式一轮结束后一次提交）
+    - 一次查询读取所有单词及进度，统一调度后只提交一次
+    - 返回结果与提交顺序一致，同一单词多次作答按顺序依次生效
+    """
+    if len(request.items) > MAX_SPELL_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"单次最多提交{MAX_SPELL_BATCH_SIZE}个答案")
+    
+    with _journal_exclusive():
+        return _check_spelling_batch(request, db)
+
+def _journal_exclusive():
+    """同步写入进度的路径使用：写后模式开启时先写入日志中尚未落库的答题，并在写入期间暂停合并新的答题，
+    避免基于旧进度的快照覆盖本次结果（见 AnswerJournal.exclusive）；关闭时日志为空，不加锁
+    """
+    return answer_journal.exclusive() if WRITE_BEHIND_ENABLED else nullcontext()
+
+def _check_spelling_batch(request: schemas.SpellCheckBatchRequest, db: Session) -> List[schemas.SpellCheckResponse]:
+    """读取、调度并一次提交批量答题（调用方需处于 _journal_exclusive() 中）
+    
+    进度以带条件的 UPSERT 写入：读取后有单词被其它答题修改时回滚，整批重新读取计算。
+    """
+    word_ids = list(dict.fromkeys(item.word_id for item in request.items))
+    for _ in range(crud.UPDATE_PROGRESS_ATTEMPTS):
+        rows = crud.get_scheduling_rows(db, word_ids)
+        
+        missing = [word_id for word_id in word_ids if word_id not in rows]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"单词不存在: {missing}")
+        
+        try:
+            responses = _apply_spelling_batch(request, db, word_ids, rows)
+        except Exception as e:
+            db.rollback()
+            raise HTTPException(status_code=500, detail=f"批量检查失败: {str(e)}")
+        if responses is not None:
+            return responses
+        db.rollback()
+    
+    raise HTTPException(status_code=409, detail="单词的学习进度被并发修改，请重试")
+
+def _apply_spelling_batch(request: schemas.SpellCheckBatchRequest, db: Session, word_ids: List[int],
+                          rows: dict) -> Optional[List[schemas.SpellCheckResponse]]:
+    """调度并写入一批答题；有单词在读取后被修改时不提交并返回 None"""
+    # 每个单词一个快照，同一单词多次作答按顺序依次生效
+    cards = {word_id: scheduler.ProgressSnapshot.from_progress(word_id, rows[word_id][1]) for word_id in word_ids}
+    prior_review_counts = {word_id: card.review_count for word_id, card in cards.items()}
+    
+    # 按各词库算法统一向量化调度
+    results = [_is_spelling_correct(item.input, rows[item.word_id][0]) for item in request.items]
+    priors = {word_id: scheduler.ProgressSnapshot.from_progress(word_id, card) for word_id, card in cards.items()}
+    previous_reviews = {word_id: priors[word_id].next_review for word_id in word_ids}
+    previous_snapshots = dict(priors)
+    states = scheduler.apply_answers(
+        [cards[item.word_id] for item in request.items],
+        results,
+        [rows[item.word_id][2] for item in request.items]
+    )
+    
+    # 答题日志和每日统计：每条记录答题前的状态，各一次批量写入
+    log_entries, stats_rows = [], []
+    for item, is_correct, state in zip(request.items, results, states):
+        prior = priors[item.word_id]
+        log_entries.append(review_log.make_entry(item.word_id, is_correct, prior))
+        # 本批次之前没有进度记录的单词，第一次作答计为新学
+        is_new = rows[item.word_id][1] is None and prior is previous_snapshots[item.word_id]
+        stats_rows.append(daily_stats.answer_row(
+            rows[item.word_id][0].deck_id, None if is_new else prior, is_correct
+        ))
+        priors[item.word_id] = state
+    
+    if crud.write_progress_states(db, ((cards[word_id], prior_review_counts[word_id]) for word_id in word_ids)):
+        return None
+    review_log.append(db, log_entries)
+    daily_stats.upsert(db, stats_rows)
+    
+    responses = [
+        schemas.SpellCheckResponse(
+            correct=is_correct,
+            correct_word=rows[item.word_id][0].word,
+            next_review=state.next_review,
+            mastery_level=state.mastery_level
+        )
+        for item, is_correct, state in zip(request.items, results, states)
+    ]
+    
+    db.commit()
+    # priors 此时已是各单词的最终状态
+    crud.notify_progress_writes(
+        (word_id, rows[word_id][0].deck_id, previous_reviews[word_id], state.next_review,
+         state.mastery_level, state.error_count)
+        for word_id, state in priors.items()
+    )
+    return responses
+
+# 学习进度统计的缓存时间和过期后继续返回旧值的时间（秒）
+PROGRESS_CACHE_TTL = int(os.getenv("PROGRESS_CACHE_TTL", "300"))
+PROGRESS_STALE_TTL = int(os.getenv("PROGRESS_STALE_TTL", "30"))
+
+@cached(ttl=PROGRESS_CACHE_TTL, key_prefix="progress", stale_ttl=PROGRESS_STALE_TTL,
+        tags=[PROGRESS_TAG, WORDS_TAG])
+def _progress_stats(bind, etag: str) -> dict:
+    """按数据库和数据版本缓存的学习进度统计（使用独立会话，可在后台线程中刷新）
+    
+    etag 只参与缓存键：其它 worker 或进程写入后数据版本变化，不会把旧统计配上新的 ETag 返回。
+    """
+    db = Session(bind=bind)
+    try:
+        return crud.get_progress_stats(db)
+    finally:
+        db.close()
+
 @app.get("/api/progress", response_model=schemas.ProgressResponse)
-def get_progress(db: Session = Depends(get_db)):
-    """获取学习进度统计"""
-    stats = crud.get_progress_stats(db)
+def get_progress(request: Request, response: Response, db: Session = Depends(get_db)):
+    """
+    获取学习进度统计
+    - 答题、上传、清空等写入提交后按标签失效，并发请求在缓存失效时只执行一次聚合查询
+    - 缓存过期后短时间内先返回旧值，由后台刷新
+    - 数据版本未变时按 If-None-Match 返回 304
+    """
+    etag = _data_etag(db, [PROGRESS_TAG, WORDS_TAG], date.today())
+    not_modified = _not_modified(request, response, etag)
+    if not_modified:
+        return not_modified
+    
+    stats = _progress_stats(db.get_bind(), etag)
     return schemas.ProgressResponse(**stats)
 
 @app.get("/api/words/stats")
-def get_word_stats(db: Session = Depends(get_db)):
-    """获取词库统计信息"""
+def get_word_stats(request: Request, response: Response, db: Session = Depends(get_db)):
+    """获取词库统计信息（单词未变化时按 If-None-Match 返回 304）"""
+    not_modified = _not_modified(request, response, _data_etag(db, [WORDS_TAG]))
+    if not_modified:
+        return not_modified
+    
     level1_count = db.query(models.Word).filter(models.Word.difficulty == 1).count()
     level2_count = db.query(models.Word).filter(models.Word.difficulty == 2).count()
     level3_count = db.query(models.Word).filter(models.Word.difficulty == 3).count()
@@ -165,6 +385,8 @@ def reclassify_words(db: Session = Depends(get_db)):
         
         if updated_count > 0:
             db.commit()
+            word_index.invalidate()
+            cache.invalidate_tags(WORDS_TAG)
         
         # 获取最新统计
         stats = {
@@ -187,6 +409,7 @@ def reclassify_words(db: Session = Depends(get_db)):
 def format_words(db: Session = Depends(get_db)):
     """清空词库：删除所有单词数据"""
     try:
+        answer_journal.discard()
         word_count = db.query(models.Word).count()
         
         if word_count == 0:
@@ -196,9 +419,14 @@ def format_words(db: Session = Depends(get_db)):
                 "deleted_count": 0
             }
         
-        # 删除所有单词
+        # 删除所有单词（答题日志和每日统计随之失效）
+        review_log.clear(db)
+        daily_stats.clear(db)
         db.query(models.Word).delete()
         db.commit()
+        word_index.invalidate()
+        crud.invalidate_progress_indexes(db)
+        cache.invalidate_tags(WORDS_TAG)
         
         return {
             "status": "success",
@@ -213,6 +441,7 @@ def format_words(db: Session = Depends(get_db)):
 def clear_progress(db: Session = Depends(get_db)):
     """清理学习进度：重置所有单词的学习记录和错误计数"""
     try:
+        answer_journal.discard()
         progress_count = db.query(models.Progress).count()
         
         if progress_count == 0:
@@ -222,9 +451,11 @@ def clear_progress(db: Session = Depends(get_db)):
                 "cleared_count": 0
             }
         
-        # 删除所有学习进度记录
+        # 删除所有学习进度记录和每日统计
         db.query(models.Progress).delete()
+        daily_stats.clear(db)
         db.commit()
+        crud.invalidate_progress_indexes(db)
         
         return {
             "status": "success",
@@ -242,14 +473,9 @@ def mark_word_studied(request: schemas.MarkStudiedRequest, db: Session = Depends
     if not word:
         raise HTTPException(status_code=404, detail="单词不存在")
     
-    # 创建或更新进度，标记为已学习（不算答对，只是看过了）
-    progress = crud.get_or_create_progress(db, request.word_id)
-    
-    # 设置下次复习时间为明天
-    from datetime import date, timedelta
-    progress.next_review = date.today() + timedelta(days=1)
-    db.commit()
-    db.refresh(progress)
+    # 创建或更新进度，标记为已学习（不算答对，只是看过了），设置明天复习
+    with _journal_exclusive():
+        progress = crud.mark_word_studied(db, request.word_id)
     
     return {
         "status": "success",
@@ -261,20 +487,9 @@ def mark_word_studied(request: schemas.MarkStudiedRequest, db: Session = Depends
 def batch_update_progress(request: schemas.BatchUpdateRequest, db: Session = Depends(get_db)):
     """批量更新学习进度（用于学习模式结束时）"""
     try:
-        updated_count = 0
-        from datetime import date, timedelta
-        
-        for word_id in request.word_ids:
-            word = crud.get_word_by_id(db, word_id)
-            if not word:
-                continue
-            
-            progress = crud.get_or_create_progress(db, word_id)
-            # 标记为已学习，设置明天复习
-            progress.next_review = date.today() + timedelta(days=1)
-            updated_count += 1
-        
-        db.commit()
+        # 标记为已学习，设置明天复习（跳过不存在的单词）
+        with _journal_exclusive():
+            updated_count = crud.mark_words_studied(db, request.word_ids)
         
         return {
             "status": "success",
@@ -286,18 +501,241 @@ def batch_update_progress(request: schemas.BatchUpdateRequest, db: Session = Dep
         raise HTTPException(status_code=500, detail=f"批量更新失败: {str(e)}")
 
 @app.get("/api/progress/review-count")
-def get_review_count(db: Session = Depends(get_db)):
-    """获取今日待复习单词数量"""
+def get_review_count(deck_id: Optional[int] = None, db: Session = Depends(get_db)):
+    """获取今日待复习单词数量（读取内存直方图，deck_id 为空时统计全部词库）"""
     from datetime import date
-    count = db.query(models.Progress).filter(
-        models.Progress.next_review <= date.today()
-    ).count()
+    count = due_histogram.count(db, deck_id)
     
     return {
         "count": count,
         "date": date.today()
     }
 
+@app.get("/api/decks", response_model=List[schemas.DeckSummaryResponse])
+def list_decks(request: Request, response: Response, db: Session = Depends(get_db)):
+    """词库概览（计数器由触发器维护，只读取 decks 表；待复习数来自内存直方图）"""
+    etag = _data_etag(db, [DECKS_TAG, PROGRESS_TAG, WORDS_TAG], date.today())
+    not_modified = _not_modified(request, response, etag)
+    if not_modified:
+        return not_modified
+    
+    decks = db.query(models.Deck).order_by(models.Deck.id).all()
+    return [
+        schemas.DeckSummaryResponse(
+            id=deck.id,
+            name=deck.name,
+            algorithm=deck.algorithm,
+            total_words=deck.total_words or 0,
+            learned_words=deck.learned_words or 0,
+            level1_words=deck.level1_words or 0,
+            level2_words=deck.level2_words or 0,
+            level3_words=deck.level3_words or 0,
+            due_words=due_histogram.count(db, deck.id)
+        )
+        for deck in decks
+    ]
+
+@app.post("/api/decks/verify-counters")
+def verify_deck_counters(repair: bool = False, db: Session = Depends(get_db)):
+    """全量校验词库计数器（repair=true 时按实际数据修复）"""
+    from .deck_counters import verify
+    try:
+        mismatches = verify(db, repair=repair)
+        return {
+            "status": "success",
+            "repaired": repair,
+            "mismatch_count": len(mismatches),
+            "mismatches": mismatches
+        }
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"校验词库计数器失败: {str(e)}")
+
+@app.post("/api/decks/{deck_id}/reschedule", response_model=schemas.RescheduleJobResponse)
+def reschedule_deck(deck_id: int, request: Optional[schemas.RescheduleRequest] = None, db: Session = Depends(get_db)):
+    """
+    修改词库记忆算法/参数并在后台重排整库复习计划
+    - 请求体可选：algorithm、fsrs_weights、request_retention
+    - 立即返回任务状态，通过 /api/decks/reschedule/{job_id} 查询进度
+    - 同一词库已有重排任务在进行时返回 409
+    """
+    deck = db.query(models.Deck).filter(models.Deck.id == deck_id).first()
+    if not deck:
+        raise HTTPException(status_code=404, detail="词库不存在")
+    if reschedule_manager.active(deck_id):
+        raise HTTPException(status_code=409, detail="该词库正在重排，请等待当前任务完成")
+    
+    if request is not None:
+        if request.algorithm is not None:
+            if request.algorithm not in scheduler.ALGORITHMS:
+                raise HTTPException(status_code=400, detail=f"记忆算法必须是{'、'.join(scheduler.ALGORITHMS)}之一")
+            deck.algorithm = request.algorithm
+        if request.fsrs_weights is not None:
+            if len(request.fsrs_weights) != len(scheduler.DEFAULT_FSRS_WEIGHTS):
+                raise HTTPException(status_code=400, detail=f"FSRS权重必须是{len(scheduler.DEFAULT_FSRS_WEIGHTS)}个数字")
+            deck.fsrs_weights = json.dumps(request.fsrs_weights)
+        if request.request_retention is not None:
+            if not 0.7 <= request.request_retention <= 0.99:
+                raise HTTPException(status_code=400, detail="期望保持率必须在0.7到0.99之间")
+            deck.request_retention = request.request_retention
+        db.commit()
+        cache.invalidate_tags(DECKS_TAG, deck_tag(deck_id))
+    
+    # 写后日志中尚未落库的答题需先写入，避免被重排结果覆盖
+    answer_journal.flush()
+    
+    job = reschedule_manager.start(db.get_bind(), deck_id)
+    return job.to_dict()
+
+@app.get("/api/decks/reschedule/{job_id}", response_model=schemas.RescheduleJobResponse)
+def get_reschedule_job(job_id: int):
+    """查询整库重排任务进度"""
+    job = reschedule_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job.to_dict()
+
+@app.post("/api/decks/{deck_id}/optimize")
+def optimize_deck_weights(deck_id: int, db: Session = Depends(get_db)):
+    """
+    根据答题日志拟合词库的 FSRS 权重（后台运行）
+    - 完成后权重写入词库，需要时再调用重排接口应用到已有进度
+    - 通过 GET /api/decks/{deck_id}/optimize 查询结果
+    """
+    deck = db.query(models.Deck).filter(models.Deck.id == deck_id).first()
+    if not deck:
+        raise HTTPException(status_code=404, detail="词库不存在")
+    
+    # 写后日志中尚未落库的答题日志需先写入
+    answer_journal.flush()
+    
+    database_url = db.get_bind().url.render_as_string(hide_password=False)
+    return optimizer_runs.start(database_url, deck_id)
+
+@app.get("/api/decks/{deck_id}/optimize")
+def get_optimize_result(deck_id: int):
+    """查询词库最近一次 FSRS 参数优化的状态和结果"""
+    result = optimizer_runs.get(deck_id)
+    if not result:
+        raise HTTPException(status_code=404, detail="没有优化记录")
+    return result
+
+# 学习热力图最多查询的天数和缓存时间（秒）
+MAX_ACTIVITY_DAYS = 730
+ACTIVITY_CACHE_TTL = 3600
+
+@app.get("/api/decks/{deck_id}/activity")
+def get_deck_activity(request: Request, response: Response, deck_id: int, days: int = 365,
+                      db: Session = Depends(get_db)):
+    """
+    词库学习热力图（最近 days 天每天的答题数和正确率）
+    - 读取每日统计汇总，与词库卡片数量无关
+    - 按词库标签缓存，有新的答题提交后自动失效；数据未变时按 If-None-Match 返回 304
+    """
+    if not 1 <= days <= MAX_ACTIVITY_DAYS:
+        raise HTTPException(status_code=400, detail=f"天数必须在1到{MAX_ACTIVITY_DAYS}之间")
+    
+    today = date.today()
+    # 只跟随本词库的标签：其它词库的答题不影响本词库的热力图
+    since = cache.tag_versions([deck_tag(deck_id)])
+    etag = _data_etag(db, [deck_tag(deck_id)], today, days)
+    not_modified = _not_modified(request, response, etag)
+    if not_modified:
+        return not_modified
+    
+    # 键中带上 ETag（数据版本），其它进程写入后不会读到旧的响应体
+    cache_key = f"activity:{deck_id}:{days}:{etag}"
+    # 缓存序列化后的响应体，命中时跳过 JSON 编码
+    body = cache.get(cache_key)
+    if body is None:
+        if not db.query(models.Deck.id).filter(models.Deck.id == deck_id).first():
+            raise HTTPException(status_code=404, detail="词库不存在")
+        body = json.dumps(daily_stats.activity(db, deck_id, days, today), separators=(",", ":"))
+        cache.set(cache_key, body, ACTIVITY_CACHE_TTL, since=since)
+    # 直接返回的 Response 不会合并注入的 response 上的响应头
+    return Response(content=body, media_type="application/json",
+                    headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+@app.get("/api/metrics")
+def get_metrics():
+    """Prometheus 指标：按路由模板的延迟直方图、状态码计数、进行中请求数和缓存统计"""
+    return Response(
+        content=request_metrics.render(cache_metrics(cache.stats())),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+@app.get("/api/performance")
+def get_performance_stats():
+    """每个接口的调用数、错误率、平均耗时和分位数（累计值及最近 1/5/15 分钟）"""
+    return perf_stats.get_stats()
+
+# 追踪列表最多返回的条数
+MAX_TRACE_LIMIT = 100
+
+def list_traces(limit: int = 20, order: str = "recent", min_ms: float = 0):
+    """
+    最近或最慢的请求追踪（每个追踪包含路由、crud 调用和 SQL 的 span）
+    - order: recent（最近的在前）或 slowest（最慢的在前）
+    - min_ms: 只返回总耗时不小于该值的追踪
+    """
+    if not 1 <= limit <= MAX_TRACE_LIMIT:
+        raise HTTPException(status_code=400, detail=f"条数必须在1到{MAX_TRACE_LIMIT}之间")
+    if order not in ("recent", "slowest"):
+        raise HTTPException(status_code=400, detail="排序方式必须是recent或slowest")
+    
+    traces = trace_buffer.recent(MAX_TRACE_LIMIT) if order == "recent" else trace_buffer.slowest(MAX_TRACE_LIMIT)
+    return [trace.to_dict() for trace in traces if trace.duration_ms >= min_ms][:limit]
+
+def get_trace(trace_id: str):
+    """单个请求追踪（仍在缓冲中时）"""
+    trace = trace_buffer.get(trace_id)
+    if not trace:
+        raise HTTPException(status_code=404, detail="追踪不存在或已被淘汰")
+    return trace.to_dict()
+
+def install_trace_routes(target: FastAPI):
+    """注册追踪调试接口（包含 SQL 文本，只在开启 TRACING_ENABLED 时注册）"""
+    target.add_api_route("/api/debug/traces", list_traces, methods=["GET"])
+    target.add_api_route("/api/debug/traces/{trace_id}", get_trace, methods=["GET"])
+
+if TRACING_ENABLED:
+    install_trace_routes(app)
+
+@app.get("/api/debug/profiles")
+def list_profiles():
+    """最近的按请求性能分析结果（需开启 PROFILING_ENABLED）"""
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="性能分析未开启")
+    return profile_store.list()
+
+@app.get("/api/debug/profiles/{profile_id}")
+def get_profile(profile_id: str, limit: int = 40, sort: str = "cumulative"):
+    """性能分析结果的 pstats 文本摘要（完整 .prof 文件在 PROFILE_DIR 中）"""
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="性能分析未开启")
+    if sort not in ("cumulative", "tottime", "calls"):
+        raise HTTPException(status_code=400, detail="排序方式必须是cumulative、tottime或calls")
+    summary = profile_store.summary(profile_id, limit, sort)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="性能分析结果不存在")
+    return Response(content=summary, media_type="text/plain; charset=utf-8")
+
+@app.post("/api/review-log/prune")
+def prune_review_log(retention_days: int = review_log.RETENTION_DAYS, db: Session = Depends(get_db)):
+    """汇总并清理超过保留期的答题日志明细（retention_days=0 表示不清理）"""
+    if retention_days < 0:
+        raise HTTPException(status_code=400, detail="保留天数不能为负数")
+    try:
+        deleted = review_log.prune(db, retention_days)
+        return {
+            "status": "success",
+            "message": f"已清理 {deleted} 条答题日志",
+            "deleted_count": deleted
+        }
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"清理答题日志失败: {str(e)}")
+
 @app.post("/api/words/upload", response_model=schemas.UploadResponse)
 async def upload_words(file: UploadFile = File(...), deck_id: int = 1, db: Session = Depends(get_db)):
     """
@@ -397,6 +835,8 @@ async def upload_words(file: UploadFile = File(...), deck_id: int = 1, db: Sessi
         if new_words:
             db.bulk_save_objects(new_words)
             db.commit()
+            word_index.invalidate(deck_id)
+            cache.invalidate_tags(WORDS_TAG, deck_tag(deck_id))
             success_count = len(new_words)
         
         # 构建响应消息
@@ -0,0 +1,193 @@
+"""
+请求指标
+ASGI 中间件按路由模板记录请求延迟（对数分桶直方图，内存固定）、状态码和进行中的请求数，
+/api/metrics 以 Prometheus 文本格式输出，可用 histogram_quantile 计算 p99 等分位数。
+"""
+import math
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+# 是否记录请求指标
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+# 延迟分桶上界（秒）：0.25ms 起每档乘以 √2，最后一档约 65 秒，之外归入 +Inf
+_BUCKET_BASE = 0.00025
+_BUCKETS_PER_DOUBLING = 2
+_BUCKET_COUNT = 37
+BUCKET_BOUNDS = tuple(
+    _BUCKET_BASE * 2 ** (i / _BUCKETS_PER_DOUBLING) for i in range(_BUCKET_COUNT)
+)
+
+# 每个直方图的计数个数（最后一个为超出上界的 +Inf 桶）
+BUCKET_SLOTS = _BUCKET_COUNT + 1
+
+# 未匹配任何路由的请求（404 等）统一记为一个路由，避免标签数量随 URL 无限增长
+UNMATCHED_ROUTE = "<unmatched>"
+
+def bucket_index(seconds: float) -> int:
+    """延迟所在分桶（BUCKET_BOUNDS[i-1] < seconds <= BUCKET_BOUNDS[i]，超出上界时为 _BUCKET_COUNT）"""
+    if seconds <= _BUCKET_BASE:
+        return 0
+    index = math.ceil(math.log2(seconds / _BUCKET_BASE) * _BUCKETS_PER_DOUBLING - 1e-9)
+    return min(index, _BUCKET_COUNT)
+
+def quantile(counts: List[int], total: int, q: float) -> Optional[float]:
+    """由分桶计数估算分位数（在所在分桶内线性插值，与 Prometheus histogram_quantile 一致）"""
+    if not total:
+        return None
+    rank = q * total
+    cumulative = 0
+    for i, count in enumerate(counts):
+        if count and cumulative + count >= rank:
+            if i == _BUCKET_COUNT:
+                return BUCKET_BOUNDS[-1]
+            lower = BUCKET_BOUNDS[i - 1] if i else 0.0
+            return lower + (BUCKET_BOUNDS[i] - lower) * (rank - cumulative) / count
+        cumulative += count
+    return BUCKET_BOUNDS[-1]
+
+class LatencyHistogram:
+    """对数分桶的延迟直方图（固定 BUCKET_SLOTS 个计数）"""
+
+    __slots__ = ("counts", "total", "sum")
+
+    def __init__(self):
+        self.counts = [0] * BUCKET_SLOTS
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bucket_index(seconds)] += 1
+        self.total += 1
+        self.sum += seconds
+
+    def quantile(self, q: float) -> Optional[float]:
+        """估算分位数"""
+        return quantile(self.counts, self.total, q)
+
+class RequestMetrics:
+    """按 (方法, 路由模板) 汇总的请求指标"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latency: Dict[Tuple[str, str], LatencyHistogram] = {}
+        self._statuses: Dict[Tuple[str, str, int], int] = {}
+        self.in_flight = 0
+
+    def start(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def finish(self, method: str, route: str, status: int, seconds: float):
+        key = (method, route)
+        with self._lock:
+            self.in_flight -= 1
+            histogram = self._latency.get(key)
+            if histogram is None:
+                histogram = self._latency[key] = LatencyHistogram()
+            histogram.observe(seconds)
+            status_key = (method, route, status)
+            self._statuses[status_key] = self._statuses.get(status_key, 0) + 1
+
+    def quantile(self, method: str, route: str, q: float) -> Optional[float]:
+        """某个路由的延迟分位数（秒）"""
+        with self._lock:
+            histogram = self._latency.get((method, route))
+            return histogram.quantile(q) if histogram else None
+
+    def reset(self):
+        with self._lock:
+            self._latency.clear()
+            self._statuses.clear()
+
+    def render(self, extra: Optional[List[str]] = None) -> str:
+        """Prometheus 文本格式（0.0.4）"""
+        with self._lock:
+            latency = [(key, list(h.counts), h.total, h.sum) for key, h in self._latency.items()]
+            statuses = list(self._statuses.items())
+            in_flight = self.in_flight
+
+        lines = [
+            "# HELP wordeasy_http_request_duration_seconds HTTP request latency by route template.",
+            "# TYPE wordeasy_http_request_duration_seconds histogram",
+        ]
+        for (method, route), counts, total, seconds in sorted(latency):
+            labels = f'method="{method}",route="{_escape(route)}"'
+            cumulative = 0
+            for bound, count in zip(BUCKET_BOUNDS, counts):
+                cumulative += count
+                lines.append(f'wordeasy_http_request_duration_seconds_bucket{{{labels},le="{bound:.6g}"}} {cumulative}')
+            lines.append(f'wordeasy_http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {total}')
+            lines.append(f"wordeasy_http_request_duration_seconds_sum{{{labels}}} {seconds:.6f}")
+            lines.append(f"wordeasy_http_request_duration_seconds_count{{{labels}}} {total}")
+
+        lines.append("# HELP wordeasy_http_requests_total HTTP requests by route template and status code.")
+        lines.append("# TYPE wordeasy_http_requests_total counter")
+        for (method, route, status), count in sorted(statuses):
+            lines.append(
+                f'wordeasy_http_requests_total{{method="{method}",route="{_escape(route)}",status="{status}"}} {count}'
+            )
+
+        lines.append("# HELP wordeasy_http_requests_in_flight HTTP requests currently being served.")
+        lines.append("# TYPE wordeasy_http_requests_in_flight gauge")
+        lines.append(f"wordeasy_http_requests_in_flight {in_flight}")
+        lines.extend(extra or [])
+        return "\n".join(lines) + "\n"
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def cache_metrics(stats: dict) -> List[str]:
+    """缓存统计（cache.stats()）转为 Prometheus 文本行"""
+    lines = []
+    for name in ("hits", "misses", "evictions", "expirations", "invalidations"):
+        if name in stats:
+            lines.append(f"# TYPE wordeasy_cache_{name}_total counter")
+            lines.append(f"wordeasy_cache_{name}_total {stats[name]}")
+    lines.append("# TYPE wordeasy_cache_entries gauge")
+    lines.append(f"wordeasy_cache_entries {stats.get('entries', 0)}")
+    return lines
+
+class MetricsMiddleware:
+    """记录每个 HTTP 请求的延迟、状态码和进行中请求数（纯 ASGI 中间件，不缓冲响应体）"""
+
+    def __init__(self, app, metrics: "RequestMetrics" = None, stats=None):
+        """
+        Args:
+            metrics: 请求指标（默认为全局 request_metrics）
+            stats: 可选的 PerformanceStats，每个请求按 "方法 路由模板" 记录一次（5xx 记为错误）
+        """
+        self.app = app
+        self.metrics = metrics or request_metrics
+        self.stats = stats
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        self.metrics.start()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # 路由匹配后 scope 中带有路由对象，使用路由模板（如 /api/decks/{deck_id}/activity）作为标签
+            route = scope.get("route")
+            template = getattr(route, "path", None) or UNMATCHED_ROUTE
+            elapsed = time.perf_counter() - start
+            self.metrics.finish(scope["method"], template, status, elapsed)
+            if self.stats is not None:
+                self.stats.record_call(f"{scope['method']} {template}", elapsed, error=status >= 500)
+
+# 全局请求指标实例
+request_metrics = RequestMetrics()
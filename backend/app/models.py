@@ -1,7 +1,7 @@
 """
 SQLAlchemy数据库模型
 """
-from sqlalchemy import Column, Integer, String, Date, ForeignKey, CheckConstraint, Boolean
+from sqlalchemy import Column, Integer, String, Date, ForeignKey, CheckConstraint, Boolean, Float, Index, event
 from sqlalchemy.orm import relationship
 from .database import Base
 from datetime import date
@@ -19,11 +19,17 @@ class Deck(Base):
     voice_type = Column(String, default="默认")
     deck_type = Column(String, default="单词库")
     algorithm = Column(String, default="FSRS")
+    fsrs_weights = Column(String, nullable=True)  # FSRS权重（JSON数组），为空使用默认权重
+    request_retention = Column(Float, default=0.9)  # 期望记忆保持率
     new_priority = Column(String, default="默认")
     review_priority = Column(String, default="默认")
     duplicate_filter = Column(String, default="过滤")
+    # 计数器由 deck_counters 中的触发器维护
     total_words = Column(Integer, default=0)
     learned_words = Column(Integer, default=0)
+    level1_words = Column(Integer, default=0)
+    level2_words = Column(Integer, default=0)
+    level3_words = Column(Integer, default=0)
     is_active = Column(Boolean, default=True)
     created_at = Column(Date, default=date.today)
     
@@ -37,7 +43,7 @@ class Word(Base):
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     word = Column(String, nullable=False, index=True)
     zh_definition = Column(String, nullable=False)
-    difficulty = Column(Integer, CheckConstraint('difficulty BETWEEN 1 AND 3'), nullable=False)
+    difficulty = Column(Integer, CheckConstraint('difficulty BETWEEN 1 AND 3'), nullable=False, index=True)  # 索引用于按难度统计和抽样
     category = Column(String, nullable=True)
     audio_url = Column(String, nullable=True)
     deck_id = Column(Integer, ForeignKey("decks.id"), nullable=False, default=1, index=True)
@@ -55,8 +61,83 @@ class Progress(Base):
     mastery_level = Column(Integer, default=0)  # 0陌生/1熟悉/2掌握
     next_review = Column(Date, nullable=True, index=True)  # 添加索引以优化复习查询
     error_count = Column(Integer, default=0, index=True)  # 添加索引以优化错词查询
-    last_reviewed = Column(Date, nullable=True)  # 最后复习日期
+    last_reviewed = Column(Date, nullable=True, index=True)  # 最后复习日期（索引用于近7天统计）
     review_count = Column(Integer, default=0)  # 复习次数
     
+    # 记忆算法参数
+    ease_factor = Column(Integer, default=250)  # SM-2 难度因子（×100）
+    interval = Column(Integer, default=0)  # 当前复习间隔（天）
+    stability = Column(Float, default=0.0)  # FSRS 记忆稳定性（天）
+    fsrs_difficulty = Column(Float, default=0.0)  # FSRS 记忆难度（1-10）
+    
     # 关系
     word = relationship("Word", back_populates="progress")
+
+@event.listens_for(Progress.__table__, "after_create")
+def _create_deck_counter_triggers(target, connection, **kw):
+    """新建数据库时创建词库计数器触发器（progress 依赖 words、words 依赖 decks，此时三张表均已存在）"""
+    from .deck_counters import install_triggers
+    install_triggers(connection)
+
+@event.listens_for(Progress.__table__, "after_create")
+def _create_data_version_triggers(target, connection, **kw):
+    """新建数据库时创建数据版本号触发器"""
+    from .data_versions import install_triggers
+    install_triggers(connection)
+
+class DailyStats(Base):
+    """每日学习统计（按词库、日期增量汇总，随答题事务写入）"""
+    __tablename__ = "daily_stats"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    deck_id = Column(Integer, ForeignKey("decks.id"), nullable=False, index=True)
+    stat_date = Column(Date, default=date.today, index=True)
+    
+    new_learned = Column(Integer, default=0)  # 新学单词数
+    reviewed = Column(Integer, default=0)  # 复习单词数
+    correct_count = Column(Integer, default=0)  # 正确次数
+    error_count = Column(Integer, default=0)  # 错误次数
+    study_time = Column(Integer, default=0)  # 学习时长（分钟）
+    
+    __table_args__ = (
+        Index('ux_daily_stats_deck_date', 'deck_id', 'stat_date', unique=True),
+    )
+
+class ReviewLog(Base):
+    """答题日志表（只追加，紧凑存储）"""
+    __tablename__ = "review_log"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    reviewed_at = Column(Integer, nullable=False, index=True)  # 答题时间（Unix 秒）
+    word_id = Column(Integer, nullable=False)
+    grade = Column(Integer, nullable=False)  # 1答错(Again)/3答对(Good)
+    elapsed_days = Column(Integer, default=0)  # 距上次复习的天数
+    prior_interval = Column(Integer, default=0)  # 答题前的复习间隔（天）
+    
+    __table_args__ = (
+        Index('ix_review_log_word_time', 'word_id', 'reviewed_at'),
+    )
+
+class ReviewLogDaily(Base):
+    """答题日志按日汇总表（过期明细清理前写入）"""
+    __tablename__ = "review_log_daily"
+    
+    day = Column(Integer, primary_key=True)  # 距 1970-01-01 的天数（UTC）
+    deck_id = Column(Integer, primary_key=True)
+    reviews = Column(Integer, default=0)  # 答题次数
+    lapses = Column(Integer, default=0)  # 答错次数
+
+class DueHistogramBucket(Base):
+    """待复习日期直方图快照（正常关闭时写入，deck_id 为 -1 的行保存写入时的数据版本号，启动时版本号未变才使用）"""
+    __tablename__ = "due_histogram"
+    
+    deck_id = Column(Integer, primary_key=True)
+    day = Column(Integer, primary_key=True)  # next_review 的序数日（date.toordinal）
+    count = Column(Integer, default=0)
+
+class DataVersion(Base):
+    """数据版本号（由 data_versions 中的触发器在写入事务中递增，用于生成 ETag）"""
+    __tablename__ = "data_versions"
+    
+    scope = Column(String, primary_key=True)  # progress / words / decks / deck:N
+    version = Column(Integer, nullable=False, default=0)
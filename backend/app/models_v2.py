@@ -1,7 +1,7 @@
 """
 增强版数据库模型 - 支持词库分类管理
 """
-from sqlalchemy import Column, Integer, String, Date, ForeignKey, CheckConstraint, Boolean, Enum as SQLEnum
+from sqlalchemy import Column, Integer, String, Date, ForeignKey, CheckConstraint, Boolean, Float, Index, Enum as SQLEnum
 from sqlalchemy.orm import relationship
 from .database import Base
 from datetime import date
@@ -67,6 +67,8 @@ class Deck(Base):
     
     # 算法设置
     algorithm = Column(SQLEnum(AlgorithmType), default=AlgorithmType.FSRS)  # 记忆算法
+    fsrs_weights = Column(String, nullable=True)  # FSRS权重（JSON数组），为空使用默认权重
+    request_retention = Column(Float, default=0.9)  # 期望记忆保持率
     
     # 优先级设置
     new_priority = Column(SQLEnum(PriorityType), default=PriorityType.DEFAULT)  # 新学优先级
@@ -78,6 +80,9 @@ class Deck(Base):
     # 统计信息
     total_words = Column(Integer, default=0)  # 总单词数
     learned_words = Column(Integer, default=0)  # 已学单词数
+    level1_words = Column(Integer, default=0)  # 初级单词数
+    level2_words = Column(Integer, default=0)  # 中级单词数
+    level3_words = Column(Integer, default=0)  # 高级单词数
     
     # 状态
     is_active = Column(Boolean, default=True)  # 是否启用
@@ -115,12 +120,14 @@ class Progress(Base):
     mastery_level = Column(Integer, default=0)  # 0陌生/1熟悉/2掌握
     next_review = Column(Date, nullable=True, index=True)  # 下次复习日期
     error_count = Column(Integer, default=0, index=True)  # 错误次数
-    last_reviewed = Column(Date, nullable=True)  # 最后复习日期
+    last_reviewed = Column(Date, nullable=True, index=True)  # 最后复习日期（索引用于近7天统计）
     review_count = Column(Integer, default=0)  # 复习次数
     
     # FSRS算法参数
     ease_factor = Column(Integer, default=250)  # 难度因子
     interval = Column(Integer, default=0)  # 间隔天数
+    stability = Column(Float, default=0.0)  # FSRS 记忆稳定性（天）
+    fsrs_difficulty = Column(Float, default=0.0)  # FSRS 记忆难度（1-10）
     
     # 关系
     word = relationship("Word", back_populates="progress")
@@ -138,3 +145,7 @@ class DailyStats(Base):
     correct_count = Column(Integer, default=0)  # 正确次数
     error_count = Column(Integer, default=0)  # 错误次数
     study_time = Column(Integer, default=0)  # 学习时长（分钟）
+    
+    __table_args__ = (
+        Index('ux_daily_stats_deck_date', 'deck_id', 'stat_date', unique=True),
+    )
@@ -2,21 +2,26 @@
 性能监控工具
 用于监控和记录API性能
 """
+import threading
 import time
+import weakref
 from functools import wraps
-from typing import Callable
+from typing import Callable, Dict, List, Optional, Tuple
 import logging
 
+from .metrics import BUCKET_SLOTS, bucket_index, quantile
+
 logger = logging.getLogger(__name__)
 
 def monitor_performance(func: Callable):
-    """性能监控装饰器"""
+    """性能监控装饰器（耗时记入 perf_stats）"""
     @wraps(func)
     async def async_wrapper(*args, **kwargs):
         start_time = time.time()
         try:
             result = await func(*args, **kwargs)
             elapsed = time.time() - start_time
+            perf_stats.record_call(func.__name__, elapsed)
             
             if elapsed > 1.0:  # 慢查询警告（>1秒）
                 logger.warning(
@@ -30,6 +35,7 @@ def monitor_performance(func: Callable):
             return result
         except Exception as e:
             elapsed = time.time() - start_time
+            perf_stats.record_call(func.__name__, elapsed, error=True)
             logger.error(
                 f"API call failed: {func.__name__} after {elapsed:.3f}s - {str(e)}"
             )
@@ -41,6 +47,7 @@ def monitor_performance(func: Callable):
         try:
             result = func(*args, **kwargs)
             elapsed = time.time() - start_time
+            perf_stats.record_call(func.__name__, elapsed)
             
             if elapsed > 1.0:
                 logger.warning(
@@ -54,6 +61,7 @@ def monitor_performance(func: Callable):
             return result
         except Exception as e:
             elapsed = time.time() - start_time
+            perf_stats.record_call(func.__name__, elapsed, error=True)
             logger.error(
                 f"Operation failed: {func.__name__} after {elapsed:.3f}s - {str(e)}"
             )
@@ -66,48 +74,199 @@ def monitor_performance(func: Callable):
     else:
         return sync_wrapper
 
+# 滚动窗口的时间片长度（秒）和窗口大小（分钟）
+SLOT_SECONDS = 15
+WINDOWS = {"1m": 60, "5m": 300, "15m": 900}
+# 保留的时间片数（最长窗口 + 当前未满的时间片）
+_SLOTS = max(WINDOWS.values()) // SLOT_SECONDS + 1
+PERCENTILES = (0.5, 0.95, 0.99)
+
+class _Series:
+    """一个线程中一项操作的统计：累计值 + 按时间片轮转的计数、错误数、耗时和延迟分桶
+
+    只由所属线程写入；读取时合并各线程的数据，不加锁。
+    时间片复用时先清零再写入时间片编号，读取方不会把旧数据算进新窗口。
+    线程结束后其数据并入 PerformanceStats 的汇总分片（absorb）。
+    """
+    __slots__ = ("calls", "errors", "total_time", "epochs", "counts", "error_counts", "times", "buckets")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.epochs = [-1] * _SLOTS
+        self.counts = [0] * _SLOTS
+        self.error_counts = [0] * _SLOTS
+        self.times = [0.0] * _SLOTS
+        self.buckets: List[Optional[List[int]]] = [None] * _SLOTS
+
+    def add(self, epoch: int, elapsed: float, error: bool):
+        self.calls += 1
+        self.total_time += elapsed
+        if error:
+            self.errors += 1
+
+        slot = epoch % _SLOTS
+        buckets = self.buckets[slot]
+        if self.epochs[slot] != epoch:
+            self.counts[slot] = 0
+            self.error_counts[slot] = 0
+            self.times[slot] = 0.0
+            if buckets is None:
+                buckets = self.buckets[slot] = [0] * BUCKET_SLOTS
+            else:
+                buckets[:] = _EMPTY_BUCKETS
+            self.epochs[slot] = epoch
+        self.counts[slot] += 1
+        self.times[slot] += elapsed
+        if error:
+            self.error_counts[slot] += 1
+        buckets[bucket_index(elapsed)] += 1
+
+    def absorb(self, other: "_Series"):
+        """并入另一个序列（other 不再被写入）：同一时间片相加，较新的时间片替换较旧的"""
+        self.calls += other.calls
+        self.errors += other.errors
+        self.total_time += other.total_time
+        for slot in range(_SLOTS):
+            epoch = other.epochs[slot]
+            if epoch < 0 or epoch < self.epochs[slot]:
+                continue
+            if epoch > self.epochs[slot]:
+                self.epochs[slot] = epoch
+                self.counts[slot] = 0
+                self.error_counts[slot] = 0
+                self.times[slot] = 0.0
+                self.buckets[slot] = [0] * BUCKET_SLOTS
+            self.counts[slot] += other.counts[slot]
+            self.error_counts[slot] += other.error_counts[slot]
+            self.times[slot] += other.times[slot]
+            self.buckets[slot] = [a + b for a, b in zip(self.buckets[slot], other.buckets[slot])]
+
+_EMPTY_BUCKETS = [0] * BUCKET_SLOTS
+
 class PerformanceStats:
-    """性能统计"""
+    """性能统计
+
+    每个线程写入自己的分片（无锁，可在每个请求中调用），读取时合并所有分片。
+    分片按所属线程的弱引用登记；线程结束后（线程池回收工作线程时），下次读取或新线程登记时
+    把它的数据并入汇总分片并移除，分片数不超过存活线程数 + 1。
+    除累计值外，按 1/5/15 分钟滚动窗口统计调用数、错误率、平均耗时和分位数；
+    每项操作每个存活线程占用固定大小的内存（_SLOTS 个时间片）。
+    """
     
-    def __init__(self):
-        self.call_counts = {}
-        self.total_times = {}
-        self.error_counts = {}
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self._clock = clock
+        self._local = threading.local()
+        self._shards: List[Tuple["weakref.ref[threading.Thread]", Dict[str, _Series]]] = []
+        self._retired: Dict[str, _Series] = {}  # 已结束线程的汇总
+        self._shards_lock = threading.Lock()
+    
+    def _shard(self) -> Dict[str, _Series]:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._retire_dead_locked()
+                self._shards.append((weakref.ref(threading.current_thread()), shard))
+        return shard
+    
+    def _retire_dead_locked(self):
+        """把已结束线程的分片并入汇总分片（调用方需持有 _shards_lock）"""
+        alive = []
+        for ref, shard in self._shards:
+            thread = ref()
+            if thread is not None and thread.is_alive():
+                alive.append((ref, shard))
+                continue
+            for name, series in shard.items():
+                retired = self._retired.get(name)
+                if retired is None:
+                    retired = self._retired[name] = _Series()
+                retired.absorb(series)
+        self._shards = alive
     
     def record_call(self, name: str, elapsed: float, error: bool = False):
         """记录调用"""
-        if name not in self.call_counts:
-            self.call_counts[name] = 0
-            self.total_times[name] = 0.0
-            self.error_counts[name] = 0
-        
-        self.call_counts[name] += 1
-        self.total_times[name] += elapsed
-        
-        if error:
-            self.error_counts[name] += 1
+        shard = self._shard()
+        series = shard.get(name)
+        if series is None:
+            series = shard[name] = _Series()
+        series.add(int(self._clock() // SLOT_SECONDS), elapsed, error)
     
     def get_stats(self) -> dict:
-        """获取统计信息"""
+        """获取统计信息（累计值 + 各滚动窗口）"""
+        current = int(self._clock() // SLOT_SECONDS)
+        with self._shards_lock:
+            self._retire_dead_locked()
+            # 汇总分片只在持有锁时修改，复制一份后再合并
+            retired = {name: _Series() for name in self._retired}
+            for name, series in self._retired.items():
+                retired[name].absorb(series)
+            shards = [retired] + [shard for _, shard in self._shards]
+        
+        merged: Dict[str, dict] = {}
+        for shard in shards:
+            for name, series in list(shard.items()):
+                entry = merged.get(name)
+                if entry is None:
+                    entry = merged[name] = {
+                        "calls": 0, "errors": 0, "total_time": 0.0,
+                        "windows": {
+                            window: {"calls": 0, "errors": 0, "time": 0.0, "buckets": [0] * BUCKET_SLOTS}
+                            for window in WINDOWS
+                        }
+                    }
+                entry["calls"] += series.calls
+                entry["errors"] += series.errors
+                entry["total_time"] += series.total_time
+                for slot in range(_SLOTS):
+                    age = current - series.epochs[slot]
+                    if not 0 <= age < _SLOTS:
+                        continue
+                    buckets = list(series.buckets[slot])
+                    for window, seconds in WINDOWS.items():
+                        if age * SLOT_SECONDS < seconds:
+                            totals = entry["windows"][window]
+                            totals["calls"] += series.counts[slot]
+                            totals["errors"] += series.error_counts[slot]
+                            totals["time"] += series.times[slot]
+                            totals["buckets"] = [a + b for a, b in zip(totals["buckets"], buckets)]
+        
         stats = {}
-        for name in self.call_counts:
-            avg_time = self.total_times[name] / self.call_counts[name]
+        for name, entry in merged.items():
+            calls = entry["calls"]
             stats[name] = {
-                'calls': self.call_counts[name],
-                'total_time': round(self.total_times[name], 3),
-                'avg_time': round(avg_time, 3),
-                'errors': self.error_counts[name],
-                'error_rate': round(
-                    self.error_counts[name] / self.call_counts[name] * 100, 2
-                )
+                'calls': calls,
+                'total_time': round(entry["total_time"], 3),
+                'avg_time': round(entry["total_time"] / calls, 3) if calls else 0.0,
+                'errors': entry["errors"],
+                'error_rate': round(entry["errors"] / calls * 100, 2) if calls else 0.0,
+                'windows': {
+                    window: _window_summary(totals) for window, totals in entry["windows"].items()
+                }
             }
         return stats
     
     def reset(self):
         """重置统计"""
-        self.call_counts.clear()
-        self.total_times.clear()
-        self.error_counts.clear()
+        with self._shards_lock:
+            for _, shard in self._shards:
+                shard.clear()
+            self._retired.clear()
+
+def _window_summary(totals: dict) -> dict:
+    calls = totals["calls"]
+    summary = {
+        "calls": calls,
+        "errors": totals["errors"],
+        "error_rate": round(totals["errors"] / calls * 100, 2) if calls else 0.0,
+        "avg_time": round(totals["time"] / calls, 4) if calls else None,
+    }
+    for q in PERCENTILES:
+        value = quantile(totals["buckets"], calls, q)
+        summary[f"p{int(q * 100)}"] = round(value, 4) if value is not None else None
+    return summary
 
 # 全局性能统计实例
 perf_stats = PerformanceStats()
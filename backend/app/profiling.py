@@ -0,0 +1,189 @@
+"""
+按请求性能分析
+开启 PROFILING_ENABLED 后，带 X-Profile: 1 请求头或 ?profile=1 查询参数的单个请求在 cProfile 下执行，
+结果（pstats 文件）写入磁盘上有数量上限的环形目录，可在 /api/debug/profiles 查看。
+未开启时不安装任何钩子，普通请求没有额外开销。
+"""
+import asyncio
+import cProfile
+import io
+import itertools
+import json
+import os
+import pstats
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, List, Optional
+
+from fastapi.routing import APIRoute
+
+# 是否允许按请求性能分析
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+# 性能分析结果目录和最多保留的文件数
+PROFILE_DIR = os.getenv(
+    "PROFILE_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "profiles")
+)
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "20"))
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_QUERY = "profile"
+
+_sequence = itertools.count()
+
+class ProfileRun:
+    """一次被分析的请求"""
+
+    def __init__(self, method: str, path: str):
+        # 毫秒时间戳-进程内序号-随机后缀（多个 worker 共用目录时不冲突）
+        self.id = f"{int(time.time() * 1000)}-{next(_sequence):06d}-{uuid.uuid4().hex[:6]}"
+        self.method = method
+        self.path = path
+        self.profile = cProfile.Profile()
+        self.lock = threading.Lock()
+
+    def run(self, func: Callable, *args, **kwargs):
+        """在当前线程的 cProfile 下执行同步函数"""
+        with self.lock:
+            return self.profile.runcall(func, *args, **kwargs)
+
+_current: ContextVar[Optional[ProfileRun]] = ContextVar("profile_run", default=None)
+
+def _profiled(endpoint: Callable) -> Callable:
+    """包装端点：当前请求要求分析时在 cProfile 下执行（同步端点在线程池线程中分析）"""
+    if asyncio.iscoroutinefunction(endpoint):
+        @wraps(endpoint)
+        async def async_wrapper(*args, **kwargs):
+            run = _current.get()
+            if run is None:
+                return await endpoint(*args, **kwargs)
+            # 事件循环线程上同时执行的其它协程也会计入
+            run.profile.enable()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                run.profile.disable()
+
+        return async_wrapper
+
+    @wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        run = _current.get()
+        if run is None:
+            return endpoint(*args, **kwargs)
+        return run.run(endpoint, *args, **kwargs)
+
+    return wrapper
+
+class ProfilingRoute(APIRoute):
+    """端点可被按请求分析的路由（仅在开启性能分析时作为 app.router.route_class）"""
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        super().__init__(path, _profiled(endpoint), **kwargs)
+
+def _requested(scope) -> bool:
+    for name, value in scope.get("headers", ()):
+        if name == PROFILE_HEADER and value in (b"1", b"true"):
+            return True
+    query = scope.get("query_string", b"").decode("latin-1")
+    return any(part in (f"{PROFILE_QUERY}=1", f"{PROFILE_QUERY}=true") for part in query.split("&"))
+
+class ProfileStore:
+    """磁盘上的环形性能分析目录（每次分析一个 .prof 文件和一个元数据 .json 文件）"""
+
+    def __init__(self, directory: str = PROFILE_DIR, max_files: int = PROFILE_MAX_FILES):
+        self.directory = directory
+        self.max_files = max_files
+        self._lock = threading.Lock()
+
+    def _path(self, profile_id: str, suffix: str) -> str:
+        return os.path.join(self.directory, f"{profile_id}{suffix}")
+
+    def save(self, run: ProfileRun, status: int, elapsed: float) -> dict:
+        """写入分析结果并删除超出上限的最旧结果"""
+        meta = {
+            "id": run.id,
+            "method": run.method,
+            "path": run.path,
+            "status": status,
+            "elapsed_ms": round(elapsed * 1000, 3),
+            "created_at": time.time()
+        }
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            run.profile.dump_stats(self._path(run.id, ".prof"))
+            with open(self._path(run.id, ".json"), "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+            ids = self._ids()
+            excess = len(ids) - self.max_files if self.max_files else 0
+            for old in ids[:max(excess, 0)]:
+                for suffix in (".prof", ".json"):
+                    try:
+                        os.remove(self._path(old, suffix))
+                    except FileNotFoundError:
+                        pass
+        return meta
+
+    def _ids(self) -> List[str]:
+        """按创建时间升序的分析结果 ID（ID 以毫秒时间戳和序号开头）"""
+        if not os.path.isdir(self.directory):
+            return []
+        ids = [name[:-5] for name in os.listdir(self.directory) if name.endswith(".prof")]
+        return sorted(ids, key=lambda profile_id: (int(profile_id.split("-", 1)[0]), profile_id))
+
+    def list(self) -> List[dict]:
+        """最近的分析结果（新的在前）"""
+        result = []
+        for profile_id in reversed(self._ids()):
+            try:
+                with open(self._path(profile_id, ".json"), encoding="utf-8") as f:
+                    result.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return result
+
+    def summary(self, profile_id: str, limit: int = 40, sort: str = "cumulative") -> Optional[str]:
+        """pstats 文本摘要（结果不存在时返回 None）"""
+        if profile_id not in self._ids():
+            return None
+        output = io.StringIO()
+        stats = pstats.Stats(self._path(profile_id, ".prof"), stream=output)
+        stats.sort_stats(sort).print_stats(limit)
+        return output.getvalue()
+
+class ProfilingMiddleware:
+    """请求要求分析时创建 ProfileRun，响应头带 X-Profile-Id，请求结束后写入环形目录"""
+
+    def __init__(self, app, store: "ProfileStore" = None):
+        self.app = app
+        self.store = store or profile_store
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _requested(scope):
+            await self.app(scope, receive, send)
+            return
+
+        run = ProfileRun(scope["method"], scope["path"])
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"x-profile-id", run.id.encode()))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        token = _current.set(run)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            self.store.save(run, status, time.perf_counter() - start)
+
+# 全局性能分析结果目录
+profile_store = ProfileStore()
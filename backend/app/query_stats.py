@@ -0,0 +1,148 @@
+"""
+请求级 SQL 统计
+通过 SQLAlchemy before/after_cursor_execute 事件把每条语句及其耗时归到当前请求（contextvars），
+响应带 X-DB-Queries / X-DB-Time 头；同一请求内同一条规范化语句重复过多时记录 N+1 警告，
+慢查询记录 EXPLAIN QUERY PLAN。
+"""
+import logging
+import os
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# 是否统计每个请求的 SQL
+QUERY_STATS_ENABLED = os.getenv("DB_QUERY_STATS", "true").lower() == "true"
+# 同一请求内同一条语句执行超过多少次记录 N+1 警告（0 表示不检查）
+REPEAT_WARN_THRESHOLD = int(os.getenv("DB_REPEAT_WARN_THRESHOLD", "10"))
+# 慢查询阈值（毫秒，0 表示不记录）
+SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))
+
+_QUERY_START = "query_stats_start"
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize(statement: str) -> str:
+    """规范化语句：字面量和 IN 列表替换为占位符，合并空白"""
+    statement = _STRING_LITERAL.sub("?", statement)
+    statement = _NUMBER_LITERAL.sub("?", statement)
+    statement = _PLACEHOLDER_LIST.sub("(?)", statement)
+    return _WHITESPACE.sub(" ", statement).strip()
+
+class RequestQueries:
+    """一个请求内执行的 SQL 统计"""
+
+    __slots__ = ("label", "count", "seconds", "repeats", "warned")
+
+    def __init__(self, label: str = ""):
+        self.label = label
+        self.count = 0
+        self.seconds = 0.0
+        self.repeats: Dict[str, int] = {}
+        self.warned = False
+
+    def record(self, statement: str, seconds: float):
+        self.count += 1
+        self.seconds += seconds
+        if not REPEAT_WARN_THRESHOLD:
+            return
+        key = normalize(statement)
+        repeats = self.repeats[key] = self.repeats.get(key, 0) + 1
+        if repeats == REPEAT_WARN_THRESHOLD + 1:
+            logger.warning(
+                f"Possible N+1 in {self.label or 'request'}: statement repeated more than "
+                f"{REPEAT_WARN_THRESHOLD} times: {key[:300]}"
+            )
+            self.warned = True
+
+_current: ContextVar[Optional[RequestQueries]] = ContextVar("request_queries", default=None)
+
+def current() -> Optional[RequestQueries]:
+    """当前请求的 SQL 统计（不在请求中时为 None）"""
+    return _current.get()
+
+@contextmanager
+def track(label: str = ""):
+    """在 with 块内把执行的 SQL 归到一个新的统计对象"""
+    queries = RequestQueries(label)
+    token = _current.set(queries)
+    try:
+        yield queries
+    finally:
+        _current.reset(token)
+
+def _explain(conn, statement: str, parameters) -> str:
+    """在同一连接上取得 SQLite 查询计划（绕过 SQLAlchemy 事件，不计入统计）"""
+    if conn.dialect.name != "sqlite" or not statement.lstrip().upper().startswith(("SELECT", "WITH")):
+        return ""
+    try:
+        cursor = conn.connection.dbapi_connection.cursor()
+        try:
+            cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters or ())
+            return "; ".join(row[-1] for row in cursor.fetchall())
+        finally:
+            cursor.close()
+    except Exception as e:
+        return f"unavailable ({str(e)})"
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault(_QUERY_START, []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get(_QUERY_START)
+    if not starts:
+        return
+    seconds = time.perf_counter() - starts.pop()
+
+    queries = _current.get()
+    if queries is not None:
+        queries.record(statement, seconds)
+
+    if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+        plan = "" if executemany else _explain(conn, statement, parameters)
+        logger.warning(
+            f"Slow query ({seconds * 1000:.1f} ms) in {queries.label if queries else 'background'}: "
+            f"{_WHITESPACE.sub(' ', statement).strip()[:500]}" + (f" | plan: {plan}" if plan else "")
+        )
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(exception_context):
+    # 执行失败时不会触发 after_cursor_execute，丢弃对应的开始时间
+    conn = exception_context.connection
+    starts = conn.info.get(_QUERY_START) if conn is not None else None
+    if starts:
+        starts.pop()
+
+class QueryStatsMiddleware:
+    """为每个 HTTP 请求统计 SQL，并在响应头中返回语句数和总耗时（毫秒）"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # 同步端点和依赖在线程池中执行，会复制当前上下文，因此共享同一个统计对象
+        with track(f"{scope['method']} {scope['path']}") as queries:
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    headers = list(message.get("headers", []))
+                    headers.append((b"x-db-queries", str(queries.count).encode()))
+                    headers.append((b"x-db-time", f"{queries.seconds * 1000:.3f}".encode()))
+                    message = dict(message, headers=headers)
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,246 @@
+"""
+整库重排任务
+词库切换记忆算法或修改 FSRS 参数后，按块流式读取该词库的进度，
+向量化重新计算间隔，并用分块 executemany UPDATE 写回。
+写回时要求 review_count 与读取时一致：任务运行期间被答题修改过的卡片跳过不写
+（答题时已按词库的新参数调度）。
+"""
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from . import scheduler
+from .cache import cache, deck_tag, PROGRESS_TAG
+from .due_histogram import due_histogram
+from .review_queue import review_queue
+
+logger = logging.getLogger(__name__)
+
+# 每块读取/写回的进度行数
+DEFAULT_CHUNK_SIZE = 5000
+# 保留最近多少个任务的状态
+MAX_JOB_HISTORY = 50
+
+_SELECT_CHUNK = text("""
+    SELECT p.word_id, p.mastery_level, p.stability, p.fsrs_difficulty,
+           p.ease_factor, p.interval, p.last_reviewed, p.next_review,
+           COALESCE(p.review_count, 0) AS review_count
+    FROM progress p JOIN words w ON w.id = p.word_id
+    WHERE w.deck_id = :deck_id AND p.word_id > :after_id
+    ORDER BY p.word_id
+    LIMIT :limit
+""")
+
+_COUNT_ROWS = text("""
+    SELECT COUNT(*) FROM progress p JOIN words w ON w.id = p.word_id
+    WHERE w.deck_id = :deck_id
+""")
+
+_UPDATE_ROW = text("""
+    UPDATE progress
+    SET interval = :interval, ease_factor = :ease_factor, stability = :stability,
+        fsrs_difficulty = :fsrs_difficulty, next_review = :next_review
+    WHERE word_id = :word_id AND COALESCE(review_count, 0) = :review_count
+""")
+
+_SELECT_DECK = text("""
+    SELECT algorithm, fsrs_weights, request_retention FROM decks WHERE id = :deck_id
+""")
+
+class RescheduleJob:
+    """单个整库重排任务的状态"""
+
+    def __init__(self, job_id: int, deck_id: int):
+        self.id = job_id
+        self.deck_id = deck_id
+        self.status = "pending"  # pending / running / done / failed
+        self.algorithm: Optional[str] = None
+        self.total = 0
+        self.processed = 0
+        self.updated = 0
+        self.skipped = 0  # 读取后被答题修改、未写回的卡片
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def to_dict(self) -> dict:
+        """转换为 API 响应"""
+        elapsed = None
+        if self.started_at is not None:
+            elapsed = round((self.finished_at or time.time()) - self.started_at, 3)
+        return {
+            "job_id": self.id,
+            "deck_id": self.deck_id,
+            "status": self.status,
+            "algorithm": self.algorithm,
+            "total": self.total,
+            "processed": self.processed,
+            "updated": self.updated,
+            "skipped": self.skipped,
+            "percent": round(self.processed / self.total * 100, 1) if self.total else 100.0,
+            "elapsed": elapsed,
+            "error": self.error
+        }
+
+def _current_intervals(rows: List, interval: np.ndarray) -> np.ndarray:
+    """补齐旧数据的间隔：interval 列为0时用 next_review - last_reviewed 推算"""
+    last = np.array([row.last_reviewed or "NaT" for row in rows], dtype="datetime64[D]")
+    nxt = np.array([row.next_review or "NaT" for row in rows], dtype="datetime64[D]")
+    derived = (nxt - last).astype("timedelta64[D]").astype(np.float64)
+    derived = np.where(np.isnan(derived), 0, derived).astype(np.int64)
+    return np.where(interval > 0, interval, np.maximum(derived, 0))
+
+def reschedule_chunk(rows: List, params: scheduler.SchedulerParams) -> List[dict]:
+    """计算一块进度行的新调度结果，返回 executemany 参数列表
+
+    从未复习过的卡片（last_reviewed 为空）保持不变。
+    """
+    rows = [row for row in rows if row.last_reviewed]
+    if not rows:
+        return []
+
+    def column(name, default):
+        return np.array([default if getattr(row, name) is None else getattr(row, name) for row in rows])
+
+    interval = _current_intervals(rows, column("interval", 0).astype(np.int64))
+    result = scheduler.reschedule_arrays(
+        params,
+        mastery=column("mastery_level", 0),
+        stability=column("stability", 0.0),
+        difficulty=column("fsrs_difficulty", 0.0),
+        ease_factor=column("ease_factor", 0),
+        interval=interval,
+    )
+
+    last = np.array([row.last_reviewed for row in rows], dtype="datetime64[D]")
+    next_review = (last + result["interval"].astype("timedelta64[D]")).astype(str)
+
+    return [
+        {
+            "word_id": row.word_id,
+            "review_count": row.review_count,
+            "interval": int(result["interval"][i]),
+            "ease_factor": int(result["ease_factor"][i]),
+            "stability": float(result["stability"][i]),
+            "fsrs_difficulty": float(result["fsrs_difficulty"][i]),
+            "next_review": next_review[i]
+        }
+        for i, row in enumerate(rows)
+    ]
+
+def run_reschedule(engine: Engine, job: RescheduleJob, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """执行整库重排（同步）；每块单独提交，避免长时间占用写锁"""
+    job.status = "running"
+    job.started_at = time.time()
+    try:
+        with engine.connect() as conn:
+            deck = conn.execute(_SELECT_DECK, {"deck_id": job.deck_id}).first()
+            if deck is None:
+                raise ValueError(f"词库不存在: {job.deck_id}")
+            params = scheduler.SchedulerParams.from_deck(*deck)
+            job.algorithm = params.algorithm
+            job.total = conn.execute(_COUNT_ROWS, {"deck_id": job.deck_id}).scalar() or 0
+
+            after_id = 0
+            while True:
+                rows = conn.execute(_SELECT_CHUNK, {
+                    "deck_id": job.deck_id, "after_id": after_id, "limit": chunk_size
+                }).fetchall()
+                if not rows:
+                    break
+                after_id = rows[-1].word_id
+
+                updates = reschedule_chunk(rows, params)
+                written = conn.execute(_UPDATE_ROW, updates).rowcount if updates else 0
+                conn.commit()
+
+                job.processed += len(rows)
+                job.updated += written
+                job.skipped += len(updates) - written
+
+        job.status = "done"
+    except Exception as e:
+        logger.error(f"Reschedule job {job.id} failed: {str(e)}")
+        job.status = "failed"
+        job.error = str(e)
+    finally:
+        job.finished_at = time.time()
+        # 下次复习日期已批量改变，内存索引下次读取时重建
+        due_histogram.invalidate()
+        review_queue.invalidate()
+        cache.invalidate_tags(PROGRESS_TAG, deck_tag(job.deck_id))
+    return job
+
+class RescheduleManager:
+    """后台重排任务管理（每个任务一个后台线程）"""
+
+    def __init__(self, max_history: int = MAX_JOB_HISTORY):
+        self.max_history = max_history
+        self._jobs: "OrderedDict[int, RescheduleJob]" = OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def active(self, deck_id: int) -> Optional[RescheduleJob]:
+        """词库正在进行的重排任务（没有则为 None）"""
+        with self._lock:
+            return self._active_locked(deck_id)
+
+    def _active_locked(self, deck_id: int) -> Optional[RescheduleJob]:
+        for job in self._jobs.values():
+            if job.deck_id == deck_id and job.status in ("pending", "running"):
+                return job
+        return None
+
+    def start(self, engine: Engine, deck_id: int, chunk_size: int = DEFAULT_CHUNK_SIZE) -> RescheduleJob:
+        """提交一个重排任务并立即返回；同一词库已有任务在进行时直接返回该任务"""
+        with self._lock:
+            current = self._active_locked(deck_id)
+            if current is not None:
+                return current
+            job = RescheduleJob(next(self._ids), deck_id)
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.max_history:
+                self._jobs.popitem(last=False)
+
+        thread = threading.Thread(
+            target=run_reschedule, args=(engine, job, chunk_size),
+            name=f"reschedule-{job.id}", daemon=True
+        )
+        thread.start()
+        return job
+
+    def get(self, job_id: int) -> Optional[RescheduleJob]:
+        """获取任务状态"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[RescheduleJob]:
+        """列出最近的任务（新任务在前）"""
+        with self._lock:
+            return list(reversed(self._jobs.values()))
+
+# 全局任务管理实例
+reschedule_manager = RescheduleManager()
+
+if __name__ == "__main__":
+    import sys
+    from .database import engine as default_engine
+
+    if len(sys.argv) < 2:
+        print("用法: python -m app.reschedule <deck_id> [chunk_size]")
+        sys.exit(1)
+
+    result = run_reschedule(
+        default_engine,
+        RescheduleJob(0, int(sys.argv[1])),
+        int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_CHUNK_SIZE
+    )
+    print(result.to_dict())
+    sys.exit(0 if result.status == "done" else 1)
@@ -0,0 +1,136 @@
+"""
+答题日志
+只追加的 review_log 表：随答题事务批量写入、按时间范围流式读取、
+超过保留期的明细按日汇总到 review_log_daily 后清理
+"""
+import os
+import time
+from datetime import date
+from typing import Iterator, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from . import models, scheduler
+
+# 明细保留天数（0 表示永久保留）
+RETENTION_DAYS = int(os.getenv("REVIEW_LOG_RETENTION_DAYS", "0"))
+# 流式读取每块行数
+READ_CHUNK_SIZE = 50000
+
+SECONDS_PER_DAY = 86400
+
+_SELECT_RANGE = text("""
+    SELECT id, reviewed_at, word_id, grade, elapsed_days, prior_interval
+    FROM review_log
+    WHERE (reviewed_at > :after_ts OR (reviewed_at = :after_ts AND id > :after_id))
+      AND reviewed_at < :end_ts
+    ORDER BY reviewed_at, id
+    LIMIT :limit
+""")
+
+_NEXT_TIMESTAMP = text("""
+    SELECT MIN(reviewed_at) FROM review_log WHERE reviewed_at >= :ts
+""")
+
+_ROLLUP_RANGE = text("""
+    INSERT INTO review_log_daily (day, deck_id, reviews, lapses)
+    SELECT :day, COALESCE(w.deck_id, 0), COUNT(*), SUM(CASE WHEN r.grade = :again THEN 1 ELSE 0 END)
+    FROM review_log r LEFT JOIN words w ON w.id = r.word_id
+    WHERE r.reviewed_at >= :start_ts AND r.reviewed_at < :end_ts
+    GROUP BY COALESCE(w.deck_id, 0)
+    ON CONFLICT(day, deck_id) DO UPDATE SET
+        reviews = reviews + excluded.reviews,
+        lapses = lapses + excluded.lapses
+""")
+
+_DELETE_RANGE = text("""
+    DELETE FROM review_log WHERE reviewed_at >= :start_ts AND reviewed_at < :end_ts
+""")
+
+def make_entry(word_id: int, is_correct: bool, prior=None,
+               today: Optional[date] = None, now: Optional[float] = None) -> dict:
+    """构建一条日志记录
+
+    Args:
+        word_id: 单词ID
+        is_correct: 是否答对
+        prior: 答题前的进度（ORM 对象或快照），None 表示新单词
+        today: 答题日期，默认今天
+        now: 答题时间戳，默认当前时间
+    """
+    today = today or date.today()
+    last_reviewed = getattr(prior, "last_reviewed", None)
+    return {
+        "reviewed_at": int(time.time() if now is None else now),
+        "word_id": word_id,
+        "grade": scheduler.GRADE_GOOD if is_correct else scheduler.GRADE_AGAIN,
+        "elapsed_days": (today - last_reviewed).days if last_reviewed else 0,
+        "prior_interval": getattr(prior, "interval", None) or 0
+    }
+
+def append(db: Session, entries: List[dict]):
+    """批量追加日志（单条 executemany，不提交，随调用方事务一起提交）"""
+    if entries:
+        db.execute(models.ReviewLog.__table__.insert(), entries)
+
+def iter_range(db: Session, start_ts: int = 0, end_ts: Optional[int] = None,
+               chunk_size: int = READ_CHUNK_SIZE) -> Iterator[list]:
+    """按时间范围分块流式读取日志（走 reviewed_at 索引，内存占用与块大小成正比）
+
+    Args:
+        start_ts: 起始时间戳（含）
+        end_ts: 结束时间戳（不含），默认不限
+
+    Yields:
+        每块的行列表（id, reviewed_at, word_id, grade, elapsed_days, prior_interval）
+    """
+    after_ts, after_id = start_ts, -1
+    end_ts = end_ts if end_ts is not None else 2 ** 62
+    while True:
+        rows = db.execute(_SELECT_RANGE, {
+            "after_ts": after_ts, "after_id": after_id, "end_ts": end_ts, "limit": chunk_size
+        }).fetchall()
+        if not rows:
+            return
+        yield rows
+        after_ts, after_id = rows[-1].reviewed_at, rows[-1].id
+
+def prune(db: Session, retention_days: int = RETENTION_DAYS, now: Optional[float] = None) -> int:
+    """汇总并清理超过保留期的明细（按天分批提交），返回删除的行数
+
+    每个自然日（UTC）的明细先按词库累加到 review_log_daily，再在同一事务中删除。
+    """
+    if retention_days <= 0:
+        return 0
+
+    now = time.time() if now is None else now
+    cutoff_ts = (int(now) // SECONDS_PER_DAY - retention_days) * SECONDS_PER_DAY
+
+    deleted = 0
+    ts = db.execute(_NEXT_TIMESTAMP, {"ts": 0}).scalar()
+    while ts is not None and ts < cutoff_ts:
+        day = ts // SECONDS_PER_DAY
+        window = {"start_ts": day * SECONDS_PER_DAY, "end_ts": (day + 1) * SECONDS_PER_DAY}
+        db.execute(_ROLLUP_RANGE, dict(window, day=day, again=scheduler.GRADE_AGAIN))
+        deleted += db.execute(_DELETE_RANGE, window).rowcount
+        db.commit()
+        # 跳过没有记录的日期
+        ts = db.execute(_NEXT_TIMESTAMP, {"ts": window["end_ts"]}).scalar()
+    return deleted
+
+def clear(db: Session):
+    """清空日志明细和汇总（不提交）"""
+    db.query(models.ReviewLog).delete()
+    db.query(models.ReviewLogDaily).delete()
+
+if __name__ == "__main__":
+    import sys
+    from .database import SessionLocal
+
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else RETENTION_DAYS
+    session = SessionLocal()
+    try:
+        print(f"已清理 {prune(session, days)} 条超过 {days} 天的答题日志")
+    finally:
+        session.close()
@@ -0,0 +1,249 @@
+"""
+待复习优先队列
+按词库维护今日到期卡片的小顶堆（掌握度升序、错误次数降序），
+未到期卡片按日期放在另一个堆中，跨日时滚入到期堆；进度写入后增量更新。
+取前 k 个待复习单词为 O(k log n)，无需每次在 SQL 中排序整个到期集合。
+只保存未来 HORIZON_DAYS 天内到期的卡片；返回前按数据库校验选中的卡片，
+其它 worker 或进程已答过的卡片不会被返回，新到期的卡片在定期重建时载入。
+"""
+import heapq
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.orm import Session
+
+from .due_histogram import ordinal_day
+
+# 从 SQL 全量重建的间隔（秒，0 表示只在超出保存范围时重建）
+RECONCILE_SECONDS = int(os.getenv("REVIEW_QUEUE_RECONCILE_SECONDS", "300"))
+# 内存中保存 next_review 在今天之后多少天内的卡片
+HORIZON_DAYS = int(os.getenv("REVIEW_QUEUE_HORIZON_DAYS", "7"))
+
+_CARD_COLUMNS = """
+    SELECT p.word_id, COALESCE(w.deck_id, 0) AS deck_id, p.next_review,
+           COALESCE(p.mastery_level, 0) AS mastery_level, COALESCE(p.error_count, 0) AS error_count
+    FROM progress p JOIN words w ON w.id = p.word_id
+"""
+_SELECT_CARDS = text(_CARD_COLUMNS + "WHERE p.next_review IS NOT NULL AND p.next_review <= :until")
+_SELECT_CARD_STATES = text(_CARD_COLUMNS + "WHERE p.word_id IN :word_ids").bindparams(
+    bindparam("word_ids", expanding=True)
+)
+
+# 返回前校验候选卡片的最多轮数（每轮一次主键 IN 查询）
+_VERIFY_ROUNDS = 3
+
+# 堆中过期条目超过有效条目的倍数时重建该堆
+_COMPACT_FACTOR = 2
+_COMPACT_MIN = 1024
+
+class ReviewQueue:
+    """按词库的待复习优先队列
+
+    _cards 保存每张卡片的当前状态 (deck_id, 序数日, mastery_level, error_count)，
+    堆中条目与之不一致时视为过期，在弹出时丢弃（惰性删除）。
+    """
+
+    def __init__(self, reconcile_interval: int = RECONCILE_SECONDS, horizon_days: int = HORIZON_DAYS):
+        self.reconcile_interval = reconcile_interval
+        self.horizon_days = horizon_days
+        self._cards: Dict[int, Tuple[int, int, int, int]] = {}
+        self._due: Dict[int, list] = defaultdict(list)  # deck_id -> [(mastery, -errors, word_id)]
+        self._due_live: Dict[int, int] = defaultdict(int)  # 各词库有效的到期卡片数
+        self._future: list = []  # [(序数日, word_id)]
+        self._today: Optional[int] = None
+        self._horizon = 0  # 保存范围的最后一天（序数日）
+        self._loaded = False
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def _is_due(self, state) -> bool:
+        return state is not None and state[1] <= self._today
+
+    def _push(self, word_id: int, state: Tuple[int, int, int, int]):
+        """把卡片放入到期堆或未到期堆（调用方需持有锁）"""
+        deck_id, day, mastery, errors = state
+        if day <= self._today:
+            heap = self._due[deck_id]
+            heapq.heappush(heap, (mastery, -errors, word_id))
+            if len(heap) > _COMPACT_FACTOR * self._due_live[deck_id] + _COMPACT_MIN:
+                self._compact(deck_id)
+        else:
+            heapq.heappush(self._future, (day, word_id))
+            if len(self._future) > _COMPACT_FACTOR * len(self._cards) + _COMPACT_MIN:
+                self._future = [(s[1], w) for w, s in self._cards.items() if s[1] > self._today]
+                heapq.heapify(self._future)
+
+    def _compact(self, deck_id: int):
+        """丢弃一个词库到期堆中的过期条目"""
+        heap = [
+            (state[2], -state[3], word_id) for word_id, state in self._cards.items()
+            if state[0] == deck_id and state[1] <= self._today
+        ]
+        heapq.heapify(heap)
+        self._due[deck_id] = heap
+        self._due_live[deck_id] = len(heap)
+
+    def _load(self, db: Session, today: int):
+        """从 progress 表构建保存范围内的卡片（一次查询，堆化为 O(n)）"""
+        self._cards = {}
+        self._due = defaultdict(list)
+        self._due_live = defaultdict(int)
+        self._future = []
+        self._today = today
+        self._horizon = today + self.horizon_days
+        until = date.fromordinal(self._horizon).isoformat()
+        for row in db.execute(_SELECT_CARDS, {"until": until}):
+            day = ordinal_day(row.next_review)
+            self._cards[row.word_id] = (row.deck_id, day, row.mastery_level, row.error_count)
+            if day <= today:
+                self._due[row.deck_id].append((row.mastery_level, -row.error_count, row.word_id))
+                self._due_live[row.deck_id] += 1
+            else:
+                self._future.append((day, row.word_id))
+        for heap in self._due.values():
+            heapq.heapify(heap)
+        heapq.heapify(self._future)
+        self._loaded = True
+        self._loaded_at = time.time()
+
+    def _needs_load(self, today: int) -> bool:
+        if not self._loaded or today > self._horizon:
+            return True
+        return bool(self.reconcile_interval) and time.time() - self._loaded_at >= self.reconcile_interval
+
+    def _advance(self, today: int):
+        """跨日滚动：把已到期的未到期卡片移入到期堆"""
+        if today == self._today:
+            return
+        if today < self._today:
+            # 系统时间回拨：按新日期重新划分
+            self._today = today
+            self._future = [(s[1], w) for w, s in self._cards.items() if s[1] > today]
+            heapq.heapify(self._future)
+            for deck_id in list(self._due):
+                self._compact(deck_id)
+            return
+        self._today = today
+        while self._future and self._future[0][0] <= today:
+            day, word_id = heapq.heappop(self._future)
+            state = self._cards.get(word_id)
+            if state is not None and state[1] == day:
+                self._due_live[state[0]] += 1
+                self._push(word_id, state)
+
+    def _pick(self, limit: int, deck_id: Optional[int]) -> List[int]:
+        """从到期堆中按优先级取前 limit 个单词ID（调用方需持有锁）"""
+        decks = [deck_id] if deck_id is not None else list(self._due)
+        candidates = []
+        for deck in decks:
+            heap = self._due.get(deck)
+            if not heap:
+                continue
+            taken, seen = [], set()
+            while heap and len(taken) < limit:
+                entry = heapq.heappop(heap)
+                mastery, neg_errors, word_id = entry
+                state = self._cards.get(word_id)
+                # 过期或重复的条目直接丢弃
+                if (word_id in seen or state is None or state[0] != deck
+                        or not self._is_due(state) or (state[2], -state[3]) != (mastery, neg_errors)):
+                    continue
+                seen.add(word_id)
+                taken.append(entry)
+            # 仍然到期，放回堆中
+            for entry in taken:
+                heapq.heappush(heap, entry)
+            candidates.extend(taken)
+
+        return [word_id for _, _, word_id in heapq.nsmallest(limit, candidates)]
+
+    def _stale(self, db: Session, word_ids: List[int]) -> List[Tuple[int, Optional[int], object, int, int]]:
+        """读取卡片在数据库中的当前状态，返回与队列不一致的卡片（apply_updates 的参数格式）"""
+        current = {
+            row.word_id: (row.word_id, row.deck_id, row.next_review, row.mastery_level, row.error_count)
+            for row in db.execute(_SELECT_CARD_STATES, {"word_ids": word_ids})
+        }
+        stale = []
+        with self._lock:
+            for word_id in word_ids:
+                update = current.get(word_id, (word_id, None, None, 0, 0))
+                _, deck_id, next_review, mastery, errors = update
+                day = ordinal_day(next_review)
+                if day is None or day > self._horizon:
+                    state = None
+                else:
+                    state = (deck_id or 0, day, mastery or 0, errors or 0)
+                if state != self._cards.get(word_id):
+                    stale.append(update)
+        return stale
+
+    def top(self, db: Session, limit: int, deck_id: Optional[int] = None,
+            today: Optional[date] = None) -> List[int]:
+        """按优先级返回前 limit 个待复习单词ID（deck_id 为空时合并全部词库）
+
+        选中的卡片按数据库中的当前状态校验（不持有锁），已被其它 worker 或进程修改的
+        卡片先更新到队列中再重新选取。
+        """
+        today_ordinal = (today or date.today()).toordinal()
+        with self._lock:
+            if self._needs_load(today_ordinal):
+                self._load(db, today_ordinal)
+            self._advance(today_ordinal)
+            word_ids = self._pick(limit, deck_id)
+
+        for _ in range(_VERIFY_ROUNDS):
+            if not word_ids:
+                return word_ids
+            stale = self._stale(db, word_ids)
+            if not stale:
+                return word_ids
+            self.apply_updates(stale)
+            with self._lock:
+                word_ids = self._pick(limit, deck_id)
+
+        # 并发写入很多时多轮后仍可能不一致：只返回已与数据库一致的卡片
+        stale_ids = {update[0] for update in self._stale(db, word_ids)} if word_ids else set()
+        return [word_id for word_id in word_ids if word_id not in stale_ids]
+
+    def apply_updates(self, updates: Iterable[Tuple[int, Optional[int], object, int, int]]):
+        """应用进度写入 (word_id, deck_id, next_review, mastery_level, error_count)（提交后调用）"""
+        with self._lock:
+            if not self._loaded:
+                return
+            for word_id, deck_id, next_review, mastery, errors in updates:
+                old = self._cards.get(word_id)
+                day = ordinal_day(next_review)
+                # 超出保存范围的卡片不放入队列，重建时再载入
+                if day is None or day > self._horizon:
+                    new = None
+                else:
+                    new = (deck_id or 0, day, mastery or 0, errors or 0)
+                if new == old:
+                    continue
+                if self._is_due(old):
+                    self._due_live[old[0]] -= 1
+                if new is None:
+                    self._cards.pop(word_id, None)
+                    continue
+                self._cards[word_id] = new
+                if self._is_due(new):
+                    self._due_live[new[0]] += 1
+                self._push(word_id, new)
+
+    def invalidate(self):
+        """丢弃队列，下次读取时从 SQL 重建（用于清空进度、整库重排等批量修改）"""
+        with self._lock:
+            self._loaded = False
+            self._cards = {}
+            self._due = defaultdict(list)
+            self._due_live = defaultdict(int)
+            self._future = []
+            self._today = None
+
+# 全局复习队列实例
+review_queue = ReviewQueue()
@@ -0,0 +1,382 @@
+"""
+记忆调度引擎
+实现 FSRS、SM-2 和 StepMaster 三种算法，核心为 NumPy 批量计算内核：
+单次答题、批量提交和整库重排共用同一套向量化代码
+"""
+import json
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# 算法名称（与 Deck.algorithm 取值一致）
+FSRS = "FSRS"
+SM2 = "SM-2"
+STEP_MASTER = "StepMaster"
+ALGORITHMS = (FSRS, SM2, STEP_MASTER)
+# models_v2 中 SQLEnum 按枚举名存储
+ALGORITHM_ALIASES = {"SM2": SM2, "STEP_MASTER": STEP_MASTER}
+
+# 答题评分（拼写只有对错两种结果，对应 FSRS 的 Again / Good）
+GRADE_AGAIN = 1
+GRADE_GOOD = 3
+
+# 掌握度：0陌生/1熟悉/2掌握
+MAX_MASTERY = 2
+
+# StepMaster：掌握度对应的复习间隔（天）
+STEP_INTERVALS = {
+    0: 1,    # 陌生：1天后复习
+    1: 3,    # 熟悉：3天后复习
+    2: 15    # 掌握：15天后复习
+}
+
+# FSRS-4.5 默认权重
+DEFAULT_FSRS_WEIGHTS = (
+    0.4872, 1.4003, 3.7145, 13.8206, 5.1618, 1.2298, 0.8975, 0.031,
+    1.6474, 0.1367, 1.0461, 2.1072, 0.0793, 0.3246, 1.587, 0.2272, 2.8755
+)
+DEFAULT_REQUEST_RETENTION = 0.9
+FSRS_DECAY = -0.5
+FSRS_FACTOR = 0.9 ** (1 / FSRS_DECAY) - 1  # 19/81，使 S 天后保持率恰好为 90%
+
+# SM-2 难度因子（以 ×100 的整数存储在 Progress.ease_factor）
+SM2_DEFAULT_EASE = 2.5
+SM2_MIN_EASE = 1.3
+
+# 最长复习间隔（天）
+MAX_INTERVAL = 36500
+
+# 进度对象上参与调度的字段及其初始值
+PROGRESS_STATE_DEFAULTS = {
+    "mastery_level": 0,
+    "next_review": None,
+    "error_count": 0,
+    "last_reviewed": None,
+    "review_count": 0,
+    "ease_factor": int(SM2_DEFAULT_EASE * 100),
+    "interval": 0,
+    "stability": 0.0,
+    "fsrs_difficulty": 0.0,
+}
+PROGRESS_STATE_FIELDS = tuple(PROGRESS_STATE_DEFAULTS)
+
+class SchedulerParams:
+    """单个词库的调度参数"""
+
+    def __init__(self, algorithm: str = STEP_MASTER, weights: Optional[Sequence[float]] = None,
+                 request_retention: Optional[float] = None):
+        algorithm = ALGORITHM_ALIASES.get(algorithm, algorithm)
+        if algorithm not in ALGORITHMS:
+            algorithm = STEP_MASTER
+        self.algorithm = algorithm
+        self.weights = tuple(weights) if weights else DEFAULT_FSRS_WEIGHTS
+        self.request_retention = request_retention or DEFAULT_REQUEST_RETENTION
+
+    @classmethod
+    def from_deck(cls, algorithm: Optional[str], fsrs_weights: Optional[str] = None,
+                  request_retention: Optional[float] = None) -> "SchedulerParams":
+        """从词库字段构建参数（没有词库时使用 StepMaster，保持旧版行为）"""
+        weights = None
+        if fsrs_weights:
+            try:
+                weights = [float(w) for w in json.loads(fsrs_weights)]
+            except (ValueError, TypeError):
+                weights = None
+            if weights is not None and len(weights) != len(DEFAULT_FSRS_WEIGHTS):
+                weights = None
+        return cls(algorithm or STEP_MASTER, weights, request_retention)
+
+    @property
+    def key(self) -> Tuple:
+        """分组键：参数相同的卡片可以一起批量计算"""
+        return (self.algorithm, self.weights, self.request_retention)
+
+class ProgressSnapshot:
+    """与数据库无关的进度快照（字段与 models.Progress 一致）"""
+
+    __slots__ = ("word_id",) + PROGRESS_STATE_FIELDS
+
+    def __init__(self, word_id: int, **values):
+        self.word_id = word_id
+        for field, default in PROGRESS_STATE_DEFAULTS.items():
+            setattr(self, field, values.get(field, default))
+
+    @classmethod
+    def from_progress(cls, word_id: int, progress) -> "ProgressSnapshot":
+        """从进度对象（或另一个快照）复制，progress 为 None 时返回初始状态"""
+        snapshot = cls(word_id)
+        if progress is not None:
+            for field, default in PROGRESS_STATE_DEFAULTS.items():
+                value = getattr(progress, field, None)
+                setattr(snapshot, field, default if value is None else value)
+        return snapshot
+
+    def values(self) -> dict:
+        """转换为列值字典（用于 INSERT）"""
+        values = {field: getattr(self, field) for field in PROGRESS_STATE_FIELDS}
+        values["word_id"] = self.word_id
+        return values
+
+    def apply_to(self, progress):
+        """将快照写回 ORM 对象"""
+        for field in PROGRESS_STATE_FIELDS:
+            setattr(progress, field, getattr(self, field))
+
+# ---------------------------------------------------------------------------
+# 向量化内核
+# ---------------------------------------------------------------------------
+
+def fsrs_kernel(stability: np.ndarray, difficulty: np.ndarray, elapsed_days: np.ndarray,
+                grades: np.ndarray, weights: Sequence[float] = DEFAULT_FSRS_WEIGHTS,
+                request_retention: float = DEFAULT_REQUEST_RETENTION):
+    """FSRS 批量计算
+
+    Args:
+        stability: 当前稳定性（<=0 表示新卡片）
+        difficulty: 当前难度（1-10）
+        elapsed_days: 距上次复习的天数
+        grades: 评分（1 Again / 2 Hard / 3 Good / 4 Easy）
+        weights: 17 个权重；也可以是形状 (17, P, 1) 的多组权重，
+            此时状态数组形状为 (P, N)，用于参数优化时一次计算多组权重
+
+    Returns:
+        (新稳定性, 新难度, 复习时的可提取性, 下次间隔天数)
+    """
+    w = np.asarray(weights, dtype=np.float64)
+    s = np.asarray(stability, dtype=np.float64)
+    d = np.asarray(difficulty, dtype=np.float64)
+    t = np.maximum(np.asarray(elapsed_days, dtype=np.float64), 0.0)
+    g = np.asarray(grades, dtype=np.int64)
+
+    is_new = s <= 0
+    s_safe = np.where(is_new, 1.0, s)
+
+    # 新卡片的初始稳定性与难度
+    s_init = w[0] * (g == 1) + w[1] * (g == 2) + w[2] * (g == 3) + w[3] * (g >= 4)
+    d_init = np.clip(w[4] - (g - 3) * w[5], 1.0, 10.0)
+    d_safe = np.where(is_new, d_init, np.clip(d, 1.0, 10.0))
+
+    # 可提取性 R(t, S)
+    retrievability = np.power(1.0 + FSRS_FACTOR * t / s_safe, FSRS_DECAY)
+
+    # 难度更新（向 D0(Good) 均值回归）
+    d_next = d_safe - w[6] * (g - 3)
+    d_next = np.clip(w[7] * w[4] + (1.0 - w[7]) * d_next, 1.0, 10.0)
+
+    # 记住时的稳定性增长
+    hard_penalty = np.where(g == 2, w[15], 1.0)
+    easy_bonus = np.where(g == 4, w[16], 1.0)
+    s_recall = s_safe * (
+        1.0 + np.exp(w[8]) * (11.0 - d_safe) * np.power(s_safe, -w[9])
+        * (np.exp((1.0 - retrievability) * w[10]) - 1.0) * hard_penalty * easy_bonus
+    )
+
+    # 遗忘后的稳定性（不超过遗忘前）
+    s_forget = (
+        w[11] * np.power(d_safe, -w[12]) * (np.power(s_safe + 1.0, w[13]) - 1.0)
+        * np.exp((1.0 - retrievability) * w[14])
+    )
+    s_forget = np.minimum(s_forget, s_safe)
+
+    s_next = np.where(g > 1, s_recall, s_forget)
+    s_next = np.maximum(np.where(is_new, s_init, s_next), 0.01)
+    d_next = np.where(is_new, d_init, d_next)
+
+    interval = fsrs_interval(s_next, request_retention)
+    return s_next, d_next, retrievability, interval
+
+def fsrs_interval(stability: np.ndarray, request_retention: float = DEFAULT_REQUEST_RETENTION) -> np.ndarray:
+    """根据稳定性和期望保持率计算间隔天数"""
+    raw = np.asarray(stability, dtype=np.float64) / FSRS_FACTOR * (
+        request_retention ** (1.0 / FSRS_DECAY) - 1.0
+    )
+    return np.clip(np.round(raw), 1, MAX_INTERVAL).astype(np.int64)
+
+def sm2_kernel(ease: np.ndarray, interval: np.ndarray, correct: np.ndarray):
+    """SM-2 批量计算（答对按 q=4，答错按 q=1）
+
+    Returns:
+        (新难度因子, 下次间隔天数)
+    """
+    ef = np.asarray(ease, dtype=np.float64)
+    prev = np.asarray(interval, dtype=np.int64)
+    ok = np.asarray(correct, dtype=bool)
+
+    q = np.where(ok, 4, 1)
+    ef_next = np.maximum(SM2_MIN_EASE, ef + 0.1 - (5 - q) * (0.08 + (5 - q) * 0.02))
+
+    grown = np.where(prev <= 0, 1, np.where(prev == 1, 6, np.round(prev * ef_next)))
+    interval_next = np.where(ok, np.clip(grown, 1, MAX_INTERVAL), 0).astype(np.int64)
+    return ef_next, interval_next
+
+def step_kernel(mastery_next: np.ndarray, correct: np.ndarray) -> np.ndarray:
+    """StepMaster 批量计算：按掌握度查表，答错当天复习"""
+    table = np.array([STEP_INTERVALS[level] for level in range(MAX_MASTERY + 1)], dtype=np.int64)
+    levels = np.clip(np.asarray(mastery_next, dtype=np.int64), 0, MAX_MASTERY)
+    return np.where(np.asarray(correct, dtype=bool), table[levels], 0).astype(np.int64)
+
+def schedule_arrays(params: SchedulerParams, mastery: np.ndarray, stability: np.ndarray,
+                    difficulty: np.ndarray, ease_factor: np.ndarray, interval: np.ndarray,
+                    elapsed_days: np.ndarray, correct: np.ndarray) -> Dict[str, np.ndarray]:
+    """统一调度入口：对一组使用相同参数的卡片应用一次答题
+
+    掌握度在所有算法下都按"答对+1、答错-1"更新（用于界面展示和统计），
+    间隔由所选算法决定；答错的单词一律当天复习（间隔为0）。
+
+    Args:
+        ease_factor: SM-2 难度因子（×100 的整数）
+
+    Returns:
+        包含 mastery_level / interval / ease_factor / stability / fsrs_difficulty 的数组字典
+    """
+    ok = np.asarray(correct, dtype=bool)
+    mastery = np.asarray(mastery, dtype=np.int64)
+    mastery_next = np.where(ok, np.minimum(mastery + 1, MAX_MASTERY), np.maximum(mastery - 1, 0))
+
+    stability = np.asarray(stability, dtype=np.float64)
+    difficulty = np.asarray(difficulty, dtype=np.float64)
+    ease = np.asarray(ease_factor, dtype=np.float64) / 100.0
+    interval = np.asarray(interval, dtype=np.int64)
+
+    if params.algorithm == FSRS:
+        grades = np.where(ok, GRADE_GOOD, GRADE_AGAIN)
+        stability, difficulty, _, interval_next = fsrs_kernel(
+            stability, difficulty, elapsed_days, grades,
+            params.weights, params.request_retention
+        )
+        interval_next = np.where(ok, interval_next, 0)
+    elif params.algorithm == SM2:
+        ease, interval_next = sm2_kernel(ease, interval, ok)
+    else:
+        interval_next = step_kernel(mastery_next, ok)
+
+    return {
+        "mastery_level": mastery_next,
+        "interval": interval_next.astype(np.int64),
+        "ease_factor": np.round(ease * 100).astype(np.int64),
+        "stability": stability,
+        "fsrs_difficulty": difficulty,
+    }
+
+def reschedule_arrays(params: SchedulerParams, mastery: np.ndarray, stability: np.ndarray,
+                      difficulty: np.ndarray, ease_factor: np.ndarray,
+                      interval: np.ndarray) -> Dict[str, np.ndarray]:
+    """在不新增答题的情况下按新算法/参数重新计算间隔（用于整库重排）
+
+    间隔 <= 0 的卡片（答错后待复习）保持当天复习；其余卡片：
+    - FSRS：没有稳定性的卡片以当前间隔作为初始稳定性，再按期望保持率换算间隔
+    - SM-2：保留当前间隔，补齐难度因子
+    - StepMaster：按掌握度查表
+
+    Args:
+        interval: 当前间隔天数（调用方可用 next_review - last_reviewed 补齐）
+
+    Returns:
+        包含 interval / ease_factor / stability / fsrs_difficulty 的数组字典
+    """
+    mastery = np.clip(np.asarray(mastery, dtype=np.int64), 0, MAX_MASTERY)
+    stability = np.asarray(stability, dtype=np.float64)
+    difficulty = np.asarray(difficulty, dtype=np.float64)
+    ease = np.asarray(ease_factor, dtype=np.float64)
+    interval = np.asarray(interval, dtype=np.int64)
+    due = interval <= 0
+
+    ease = np.where(ease > 0, ease, SM2_DEFAULT_EASE * 100)
+
+    if params.algorithm == FSRS:
+        w = params.weights
+        stability = np.where(stability > 0, stability, np.maximum(interval, 0).astype(np.float64))
+        difficulty = np.where(difficulty > 0, np.clip(difficulty, 1.0, 10.0), np.clip(w[4], 1.0, 10.0))
+        interval_next = fsrs_interval(np.maximum(stability, 0.01), params.request_retention)
+    elif params.algorithm == SM2:
+        interval_next = interval
+    else:
+        table = np.array([STEP_INTERVALS[level] for level in range(MAX_MASTERY + 1)], dtype=np.int64)
+        interval_next = table[mastery]
+
+    return {
+        "interval": np.where(due, 0, interval_next).astype(np.int64),
+        "ease_factor": np.round(ease).astype(np.int64),
+        "stability": stability,
+        "fsrs_difficulty": difficulty,
+    }
+
+# ---------------------------------------------------------------------------
+# 对象级接口
+# ---------------------------------------------------------------------------
+
+def _state(card, field: str):
+    value = getattr(card, field, None)
+    return PROGRESS_STATE_DEFAULTS[field] if value is None else value
+
+def _apply_group(cards: List, correct: List[bool], params: SchedulerParams, today: date):
+    """对一组互不重复、参数相同的卡片执行一次向量化调度并写回（原地修改）"""
+    elapsed = [
+        (today - card.last_reviewed).days if getattr(card, "last_reviewed", None) else 0
+        for card in cards
+    ]
+    result = schedule_arrays(
+        params,
+        mastery=np.array([_state(c, "mastery_level") for c in cards]),
+        stability=np.array([_state(c, "stability") for c in cards]),
+        difficulty=np.array([_state(c, "fsrs_difficulty") for c in cards]),
+        ease_factor=np.array([_state(c, "ease_factor") for c in cards]),
+        interval=np.array([_state(c, "interval") for c in cards]),
+        elapsed_days=np.array(elapsed),
+        correct=np.array(correct, dtype=bool),
+    )
+
+    for i, card in enumerate(cards):
+        card.mastery_level = int(result["mastery_level"][i])
+        card.interval = int(result["interval"][i])
+        card.ease_factor = int(result["ease_factor"][i])
+        card.stability = float(result["stability"][i])
+        card.fsrs_difficulty = float(result["fsrs_difficulty"][i])
+        card.review_count = _state(card, "review_count") + 1
+        if not correct[i]:
+            card.error_count = _state(card, "error_count") + 1
+        card.last_reviewed = today
+        card.next_review = today + timedelta(days=card.interval)
+
+def apply_answers(cards: Sequence, correct: Sequence[bool],
+                  params: Sequence[SchedulerParams], today: Optional[date] = None) -> List[ProgressSnapshot]:
+    """将一批答题结果应用到进度对象上（ORM 对象或快照均可，原地修改）
+
+    同一对象多次出现时按出现顺序分轮计算，每轮内按调度参数分组向量化。
+    返回每次答题之后的状态快照，与输入顺序一致。
+
+    Args:
+        cards: 进度对象列表
+        correct: 每个对象对应的答题结果
+        params: 每个对象对应的调度参数
+        today: 复习日期，默认今天
+    """
+    today = today or date.today()
+
+    # 分轮：第 k 次出现的对象放入第 k 轮
+    rounds: List[List[int]] = []
+    seen: Dict[int, int] = {}
+    for index, card in enumerate(cards):
+        round_no = seen.get(id(card), 0)
+        seen[id(card)] = round_no + 1
+        if round_no == len(rounds):
+            rounds.append([])
+        rounds[round_no].append(index)
+
+    results: List[Optional[ProgressSnapshot]] = [None] * len(cards)
+    for indexes in rounds:
+        groups: Dict[Tuple, List[int]] = {}
+        for index in indexes:
+            groups.setdefault(params[index].key, []).append(index)
+        for group in groups.values():
+            _apply_group(
+                [cards[i] for i in group],
+                [bool(correct[i]) for i in group],
+                params[group[0]],
+                today
+            )
+        for index in indexes:
+            card = cards[index]
+            results[index] = ProgressSnapshot.from_progress(getattr(card, "word_id", None), card)
+    return results
@@ -34,6 +34,9 @@ class SpellCheckResponse(BaseModel):
     next_review: Optional[date] = None
     mastery_level: int
 
+class SpellCheckBatchRequest(BaseModel):
+    items: List[SpellCheckRequest]
+
 class ProgressResponse(BaseModel):
     level: int
     coins: int
@@ -49,3 +52,32 @@ class MarkStudiedRequest(BaseModel):
 
 class BatchUpdateRequest(BaseModel):
     word_ids: List[int]
+
+class RescheduleRequest(BaseModel):
+    algorithm: Optional[str] = None  # FSRS / SM-2 / StepMaster，为空表示不修改
+    fsrs_weights: Optional[List[float]] = None
+    request_retention: Optional[float] = None
+
+class RescheduleJobResponse(BaseModel):
+    job_id: int
+    deck_id: int
+    status: str
+    algorithm: Optional[str] = None
+    total: int
+    processed: int
+    updated: int
+    skipped: int = 0
+    percent: float
+    elapsed: Optional[float] = None
+    error: Optional[str] = None
+
+class DeckSummaryResponse(BaseModel):
+    id: int
+    name: str
+    algorithm: Optional[str] = None
+    total_words: int
+    learned_words: int
+    level1_words: int
+    level2_words: int
+    level3_words: int
+    due_words: int  # 今日待复习
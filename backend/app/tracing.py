@@ -0,0 +1,380 @@
+"""
+请求追踪
+用 contextvars 记录一次请求内的嵌套耗时片段（span）：路由、crud 调用和每条 SQL。
+最近的追踪和最慢的追踪保存在固定大小的内存缓冲中（/api/debug/traces），
+可选地以 OTLP JSON（每行一个 ExportTraceServiceRequest）由后台线程追加写入本地文件。
+默认关闭，关闭时不注册 SQL 事件钩子和调试接口；开启后可按 TRACE_SAMPLE_RATE 只追踪一部分请求。
+"""
+import heapq
+import itertools
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# 是否追踪请求，以及开启时被追踪的请求比例（0-1）
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+# 保留的最近追踪数和最慢追踪数
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "100"))
+TRACE_SLOWEST_SIZE = int(os.getenv("TRACE_SLOWEST_SIZE", "20"))
+# 单个追踪最多记录的 span 数（超出的只计数）
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "500"))
+# OTLP JSON 导出文件（为空表示不导出）
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "")
+
+# 等待导出的追踪数上限（导出线程跟不上时丢弃新的追踪，不阻塞请求）
+_EXPORT_QUEUE_SIZE = 1000
+
+_SPAN_KIND_INTERNAL = 1
+_SPAN_KIND_SERVER = 2
+_SPAN_KIND_CLIENT = 3
+
+def _new_id(bits: int) -> str:
+    """随机十六进制 ID（追踪 ID 不需要密码学强度，避免每个 span 读取 urandom）"""
+    return format(random.getrandbits(bits), f"0{bits // 4}x")
+
+class Span:
+    """一个耗时片段"""
+
+    __slots__ = ("trace", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], kind: int = _SPAN_KIND_INTERNAL,
+                 attributes: Optional[Dict[str, Any]] = None):
+        self.trace = trace
+        self.span_id = _new_id(64)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = attributes or {}
+        self.error: Optional[str] = None
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {str(error)}"
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def to_dict(self) -> dict:
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start_ns / 1e9,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "error": self.error
+        }
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 0}
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+class Trace:
+    """一次请求的所有 span（span 数量有上限）"""
+
+    def __init__(self):
+        self.trace_id = _new_id(128)
+        self.spans: List[Span] = []
+        self.dropped = 0
+        self.root: Optional[Span] = None
+
+    def start_span(self, name: str, parent_id: Optional[str], kind: int = _SPAN_KIND_INTERNAL,
+                   attributes: Optional[Dict[str, Any]] = None) -> Optional[Span]:
+        if len(self.spans) >= TRACE_MAX_SPANS:
+            self.dropped += 1
+            return None
+        span = Span(self, name, parent_id, kind, attributes)
+        self.spans.append(span)
+        return span
+
+    @property
+    def duration_ms(self) -> float:
+        return self.root.duration_ms if self.root else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.root.name if self.root else "",
+            "start": self.root.start_ns / 1e9 if self.root else None,
+            "duration_ms": round(self.duration_ms, 3),
+            "span_count": len(self.spans),
+            "dropped_spans": self.dropped,
+            "spans": [span.to_dict() for span in self.spans]
+        }
+
+    def to_otlp(self) -> dict:
+        return {"resourceSpans": [{
+            "resource": {"attributes": [_otlp_attribute("service.name", "wordeasy")]},
+            "scopeSpans": [{
+                "scope": {"name": __name__},
+                "spans": [span.to_otlp() for span in self.spans if span.end_ns is not None]
+            }]
+        }]}
+
+def _otlp_attribute(key: str, value: Any) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+_current: ContextVar[Optional[Span]] = ContextVar("trace_span", default=None)
+
+def current_span() -> Optional[Span]:
+    """当前 span（不在追踪中时为 None）"""
+    return _current.get()
+
+@contextmanager
+def span(name: str, **attributes):
+    """在当前追踪中记录一个子 span（不在追踪中时不做任何事）"""
+    parent = _current.get()
+    child = parent.trace.start_span(name, parent.span_id, attributes=attributes) if parent else None
+    if child is None:
+        yield None
+        return
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.finish(e)
+        raise
+    else:
+        child.finish()
+    finally:
+        _current.reset(token)
+
+def traced(name: Optional[str] = None):
+    """装饰器：函数调用记录为当前追踪中的一个 span"""
+    def decorator(func: Callable):
+        span_name = name or f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return func(*args, **kwargs)
+            with span(span_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+    return decorator
+
+_SQL_SPANS = "tracing_sql_spans"
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    parent = _current.get()
+    sql_span = None
+    if parent is not None:
+        sql_span = parent.trace.start_span("sql", parent.span_id, _SPAN_KIND_CLIENT, {
+            "db.system": conn.dialect.name,
+            "db.statement": " ".join(statement.split())[:500],
+            "db.executemany": executemany
+        })
+    conn.info.setdefault(_SQL_SPANS, []).append(sql_span)
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    spans = conn.info.get(_SQL_SPANS)
+    sql_span = spans.pop() if spans else None
+    if sql_span is not None:
+        sql_span.finish()
+
+def _handle_error(exception_context):
+    conn = exception_context.connection
+    spans = conn.info.get(_SQL_SPANS) if conn is not None else None
+    sql_span = spans.pop() if spans else None
+    if sql_span is not None:
+        sql_span.finish(exception_context.original_exception)
+
+_SQL_HOOKS = (
+    ("before_cursor_execute", _before_cursor_execute),
+    ("after_cursor_execute", _after_cursor_execute),
+    ("handle_error", _handle_error),
+)
+
+def install_sql_hooks():
+    """注册记录 SQL span 的全局引擎事件（只在开启追踪时调用，重复调用无副作用）"""
+    for name, listener in _SQL_HOOKS:
+        if not event.contains(Engine, name, listener):
+            event.listen(Engine, name, listener)
+
+def remove_sql_hooks():
+    """移除 SQL span 事件钩子"""
+    for name, listener in _SQL_HOOKS:
+        if event.contains(Engine, name, listener):
+            event.remove(Engine, name, listener)
+
+class TraceBuffer:
+    """最近追踪的环形缓冲 + 最慢追踪的小顶堆（内存固定），OTLP JSON 由后台线程写入文件"""
+
+    def __init__(self, size: int = TRACE_BUFFER_SIZE, slowest: int = TRACE_SLOWEST_SIZE,
+                 export_path: str = TRACE_EXPORT_PATH):
+        self._recent: "deque[Trace]" = deque(maxlen=size)
+        self._slowest: List[tuple] = []  # [(duration_ms, seq, trace)]
+        self._slowest_size = slowest
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self.export_path = export_path
+        self._exports: "queue.Queue[Optional[Trace]]" = queue.Queue(maxsize=_EXPORT_QUEUE_SIZE)
+        self._exporter: Optional[threading.Thread] = None
+        self.export_dropped = 0
+
+    def add(self, trace: Trace):
+        entry = (trace.duration_ms, next(self._seq), trace)
+        with self._lock:
+            self._recent.append(trace)
+            if len(self._slowest) < self._slowest_size:
+                heapq.heappush(self._slowest, entry)
+            elif self._slowest_size and entry[0] > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, entry)
+            if self.export_path and (self._exporter is None or not self._exporter.is_alive()):
+                self._exporter = threading.Thread(target=self._export_loop, name="trace-export", daemon=True)
+                self._exporter.start()
+        if self.export_path:
+            try:
+                self._exports.put_nowait(trace)
+            except queue.Full:
+                self.export_dropped += 1
+
+    def _export_loop(self):
+        """后台导出线程：每次取出所有等待的追踪，一次打开文件追加写入"""
+        while True:
+            batch = [self._exports.get()]
+            while True:
+                try:
+                    batch.append(self._exports.get_nowait())
+                except queue.Empty:
+                    break
+            traces = [trace for trace in batch if trace is not None]
+            if traces:
+                self._export(traces)
+            for _ in batch:
+                self._exports.task_done()
+            if len(traces) < len(batch):
+                return
+
+    def _export(self, traces: List[Trace]):
+        """追加写入 OTLP JSON（每个追踪一行）"""
+        try:
+            with open(self.export_path, "a", encoding="utf-8") as f:
+                for trace in traces:
+                    f.write(json.dumps(trace.to_otlp(), ensure_ascii=False, separators=(",", ":")) + "\n")
+        except OSError as e:
+            logger.error(f"Trace export failed: {str(e)}")
+
+    def flush(self):
+        """等待已加入的追踪全部写入文件"""
+        if self._exporter is not None and self._exporter.is_alive():
+            self._exports.join()
+
+    def close(self):
+        """写入剩余追踪并停止导出线程"""
+        with self._lock:
+            exporter = self._exporter
+            self._exporter = None
+        if exporter is not None and exporter.is_alive():
+            self._exports.put(None)
+            exporter.join()
+
+    def recent(self, limit: int = 20) -> List[Trace]:
+        with self._lock:
+            return list(self._recent)[-limit:][::-1]
+
+    def slowest(self, limit: int = 20) -> List[Trace]:
+        with self._lock:
+            entries = sorted(self._slowest, reverse=True)
+        return [trace for _, _, trace in entries[:limit]]
+
+    def get(self, trace_id: str) -> Optional[Trace]:
+        with self._lock:
+            for trace in itertools.chain(self._recent, (entry[2] for entry in self._slowest)):
+                if trace.trace_id == trace_id:
+                    return trace
+        return None
+
+    def clear(self):
+        with self._lock:
+            self._recent.clear()
+            self._slowest.clear()
+
+class TracingMiddleware:
+    """为每个 HTTP 请求创建追踪，根 span 以路由模板命名，响应头带 X-Trace-Id"""
+
+    def __init__(self, app, buffer: "TraceBuffer" = None, sample_rate: float = TRACE_SAMPLE_RATE):
+        """
+        Args:
+            buffer: 追踪缓冲（默认为全局 trace_buffer）
+            sample_rate: 被追踪的请求比例，未被抽中的请求不创建任何 span
+        """
+        self.app = app
+        self.buffer = buffer or trace_buffer
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (self.sample_rate < 1 and random.random() >= self.sample_rate):
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace()
+        root = trace.root = trace.start_span(
+            f"{scope['method']} {scope['path']}", None, _SPAN_KIND_SERVER,
+            {"http.method": scope["method"], "http.target": scope["path"]}
+        )
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                root.attributes["http.status_code"] = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"x-trace-id", trace.trace_id.encode()))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        # 同步端点和依赖在线程池中执行，会复制当前上下文，子 span 挂在根 span 下
+        token = _current.set(root)
+        error = None
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _current.reset(token)
+            route = scope.get("route")
+            if getattr(route, "path", None):
+                root.name = f"{scope['method']} {route.path}"
+                root.attributes["http.route"] = route.path
+            root.finish(error)
+            self.buffer.add(trace)
+
+# 全局追踪缓冲
+trace_buffer = TraceBuffer()
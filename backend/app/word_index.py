@@ -0,0 +1,87 @@
+"""
+单词抽样索引
+在内存中按 (deck_id, difficulty) 维护单词ID列表，用于快速随机抽词
+"""
+import random
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import data_versions, models
+from .cache import WORDS_TAG
+
+# 索引键：(词库ID, 难度)，词库ID为 None 表示不区分词库
+IndexKey = Tuple[Optional[int], int]
+
+class WordSampleIndex:
+    """单词ID抽样索引
+
+    首次访问某个 (deck_id, difficulty) 时只查询一次ID列并缓存，
+    之后的随机抽样为 O(N)，无需 COUNT/OFFSET 全表扫描。
+    写操作（上传、重新分类、清空）需调用 invalidate 使索引失效；
+    每次抽样前还会比较数据库中的 words 数据版本号，其它 worker 或进程修改单词后索引同样失效。
+    """
+
+    def __init__(self):
+        self._ids: Dict[IndexKey, List[int]] = {}
+        self._generation = 0  # 每次失效递增，防止并发加载写回过期数据
+        self._version: Optional[int] = None  # 索引对应的 words 数据版本号
+        self._lock = threading.Lock()
+
+    def _load(self, db: Session, key: IndexKey) -> List[int]:
+        """从数据库加载指定键的单词ID列表"""
+        deck_id, difficulty = key
+        query = db.query(models.Word.id).filter(models.Word.difficulty == difficulty)
+        if deck_id is not None:
+            query = query.filter(models.Word.deck_id == deck_id)
+        return [row[0] for row in query.all()]
+
+    def get_ids(self, db: Session, difficulty: int, deck_id: Optional[int] = None) -> List[int]:
+        """获取单词ID列表（不存在时懒加载）"""
+        key = (deck_id, difficulty)
+        version = data_versions.versions(db, [WORDS_TAG])[WORDS_TAG]
+        with self._lock:
+            if version != self._version:
+                self._ids.clear()
+                self._generation += 1
+                self._version = version
+            ids = self._ids.get(key)
+            generation = self._generation
+        if ids is None:
+            ids = self._load(db, key)
+            with self._lock:
+                if generation == self._generation:
+                    self._ids[key] = ids
+        return ids
+
+    def sample(self, db: Session, difficulty: int, limit: int,
+               deck_id: Optional[int] = None) -> List[int]:
+        """随机抽取不重复的单词ID"""
+        ids = self.get_ids(db, difficulty, deck_id)
+        if limit <= 0 or not ids:
+            return []
+        return random.sample(ids, min(limit, len(ids)))
+
+    def invalidate(self, deck_id: Optional[int] = None):
+        """使索引失效
+
+        Args:
+            deck_id: 指定词库ID时只失效该词库及全局索引，None 表示全部失效
+        """
+        with self._lock:
+            self._generation += 1
+            if deck_id is None:
+                self._ids.clear()
+                return
+            for key in list(self._ids):
+                if key[0] is None or key[0] == deck_id:
+                    del self._ids[key]
+
+    def size(self) -> int:
+        """获取已索引的单词ID总数"""
+        with self._lock:
+            return sum(len(ids) for ids in self._ids.values())
+
+# 全局索引实例
+word_index = WordSampleIndex()
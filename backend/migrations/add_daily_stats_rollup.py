@@ -0,0 +1,90 @@
+"""
+数据库迁移脚本：每日学习统计汇总
+为 daily_stats 添加 (deck_id, stat_date) 唯一索引（先合并重复行），
+表为空时用 progress.last_reviewed 回填历史复习数
+"""
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from app.database import engine
+from app.models import DailyStats
+from sqlalchemy import inspect, text
+
+def merge_duplicates(conn):
+    """合并同一词库同一天的重复行"""
+    duplicates = conn.execute(text("""
+        SELECT COUNT(*) FROM (
+            SELECT 1 FROM daily_stats GROUP BY deck_id, stat_date HAVING COUNT(*) > 1
+        )
+    """)).scalar()
+    if not duplicates:
+        print("ℹ️  没有重复的统计行")
+        return
+
+    print(f"合并 {duplicates} 组重复的统计行...")
+    conn.execute(text("""
+        UPDATE daily_stats SET
+            new_learned = (SELECT SUM(new_learned) FROM daily_stats d
+                           WHERE d.deck_id = daily_stats.deck_id AND d.stat_date = daily_stats.stat_date),
+            reviewed = (SELECT SUM(reviewed) FROM daily_stats d
+                        WHERE d.deck_id = daily_stats.deck_id AND d.stat_date = daily_stats.stat_date),
+            correct_count = (SELECT SUM(correct_count) FROM daily_stats d
+                             WHERE d.deck_id = daily_stats.deck_id AND d.stat_date = daily_stats.stat_date),
+            error_count = (SELECT SUM(error_count) FROM daily_stats d
+                           WHERE d.deck_id = daily_stats.deck_id AND d.stat_date = daily_stats.stat_date),
+            study_time = (SELECT SUM(study_time) FROM daily_stats d
+                          WHERE d.deck_id = daily_stats.deck_id AND d.stat_date = daily_stats.stat_date)
+        WHERE id IN (SELECT MIN(id) FROM daily_stats GROUP BY deck_id, stat_date HAVING COUNT(*) > 1)
+    """))
+    conn.execute(text("""
+        DELETE FROM daily_stats
+        WHERE id NOT IN (SELECT MIN(id) FROM daily_stats GROUP BY deck_id, stat_date)
+    """))
+    print("✅ 重复行合并完成")
+
+def add_daily_stats_rollup():
+    """创建表和唯一索引，必要时回填"""
+    print("检查 daily_stats 表...")
+
+    inspector = inspect(engine)
+    if 'progress' not in inspector.get_table_names():
+        print("警告: progress 表不存在，跳过迁移")
+        return
+
+    # 表不存在时按模型创建（包含唯一索引）
+    DailyStats.__table__.create(engine, checkfirst=True)
+
+    with engine.connect() as conn:
+        merge_duplicates(conn)
+        conn.execute(text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS ux_daily_stats_deck_date ON daily_stats(deck_id, stat_date)"
+        ))
+        print("✅ (deck_id, stat_date) 唯一索引已就绪")
+
+        if conn.execute(text("SELECT COUNT(*) FROM daily_stats")).scalar() == 0:
+            print("回填历史复习数（按最后复习日期）...")
+            result = conn.execute(text("""
+                INSERT INTO daily_stats (deck_id, stat_date, new_learned, reviewed, correct_count, error_count, study_time)
+                SELECT COALESCE(w.deck_id, 0), p.last_reviewed, 0, COUNT(*), 0, 0, 0
+                FROM progress p JOIN words w ON w.id = p.word_id
+                WHERE p.last_reviewed IS NOT NULL
+                GROUP BY COALESCE(w.deck_id, 0), p.last_reviewed
+            """))
+            print(f"✅ 已回填 {result.rowcount} 行")
+        conn.commit()
+
+if __name__ == '__main__':
+    print("=" * 50)
+    print("数据库迁移：每日学习统计汇总")
+    print("=" * 50)
+
+    try:
+        add_daily_stats_rollup()
+        print("\n✅ 迁移全部完成！")
+    except Exception as e:
+        print(f"\n❌ 迁移失败: {e}")
+        sys.exit(1)
@@ -0,0 +1,63 @@
+"""
+数据库迁移脚本：词库计数器
+为 decks 表添加按难度的单词数列，创建维护计数器的触发器，并按实际数据修复所有计数器
+"""
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from app.database import SessionLocal, engine
+from app.deck_counters import install_triggers, verify
+from sqlalchemy import inspect, text
+
+NEW_COLUMNS = [
+    ('level1_words', 'INTEGER DEFAULT 0'),
+    ('level2_words', 'INTEGER DEFAULT 0'),
+    ('level3_words', 'INTEGER DEFAULT 0'),
+]
+
+def add_deck_counters():
+    """添加列、创建触发器并修复计数器"""
+    print("检查词库计数器...")
+    
+    inspector = inspect(engine)
+    tables = inspector.get_table_names()
+    if not {'decks', 'words', 'progress'} <= set(tables):
+        print("警告: decks/words/progress 表不完整，跳过迁移")
+        return
+    
+    with engine.connect() as conn:
+        existing = [col['name'] for col in inspector.get_columns('decks')]
+        for column_name, definition in NEW_COLUMNS:
+            if column_name in existing:
+                print(f"ℹ️  decks.{column_name} 列已存在")
+                continue
+            print(f"添加 decks.{column_name} 列...")
+            conn.execute(text(f'ALTER TABLE decks ADD COLUMN "{column_name}" {definition}'))
+            print(f"✅ decks.{column_name} 列创建成功")
+        
+        install_triggers(conn)
+        conn.commit()
+        print("✅ 计数器触发器已就绪")
+    
+    db = SessionLocal()
+    try:
+        repaired = verify(db, repair=True)
+        print(f"✅ 已修复 {len(repaired)} 个词库的计数器")
+    finally:
+        db.close()
+
+if __name__ == '__main__':
+    print("=" * 50)
+    print("数据库迁移：词库计数器")
+    print("=" * 50)
+    
+    try:
+        add_deck_counters()
+        print("\n✅ 迁移全部完成！")
+    except Exception as e:
+        print(f"\n❌ 迁移失败: {e}")
+        sys.exit(1)
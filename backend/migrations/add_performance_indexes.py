@@ -1,6 +1,6 @@
 """
 数据库迁移脚本：添加性能索引
-添加 next_review 和 error_count 索引以优化查询性能
+添加 next_review、error_count、last_reviewed 和 words.difficulty 索引以优化查询性能
 """
 import sys
 import os
@@ -11,7 +11,7 @@ project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
 
 from app.database import SessionLocal, engine
-from app.models import Base, Progress
+from app.models import Base, Progress, Word
 from sqlalchemy import inspect, Index, text
 
 def check_index_exists(inspector, table_name, index_name):
@@ -48,6 +48,24 @@ def add_performance_indexes():
     else:
         print("ℹ️  error_count 索引已存在")
     
+    # 添加 last_reviewed 索引（学习统计按日期范围分组）
+    if not check_index_exists(inspector, 'progress', 'ix_progress_last_reviewed'):
+        print("添加 last_reviewed 索引...")
+        idx_last_reviewed = Index('ix_progress_last_reviewed', Progress.last_reviewed)
+        idx_last_reviewed.create(engine)
+        print("✅ last_reviewed 索引创建成功")
+    else:
+        print("ℹ️  last_reviewed 索引已存在")
+    
+    # 添加 words.difficulty 索引（学习统计按难度分组时只扫描索引）
+    if not check_index_exists(inspector, 'words', 'ix_words_difficulty'):
+        print("添加 difficulty 索引...")
+        idx_difficulty = Index('ix_words_difficulty', Word.difficulty)
+        idx_difficulty.create(engine)
+        print("✅ difficulty 索引创建成功")
+    else:
+        print("ℹ️  difficulty 索引已存在")
+    
     print("性能索引迁移完成！")
 
 def add_new_columns():
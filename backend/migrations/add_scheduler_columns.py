@@ -0,0 +1,63 @@
+"""
+数据库迁移脚本：添加记忆算法字段
+为 progress 表添加 SM-2 / FSRS 调度状态列，为 decks 表添加 FSRS 参数列
+"""
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from app.database import engine
+from sqlalchemy import inspect, text
+
+# 表名 -> [(列名, 列定义)]
+NEW_COLUMNS = {
+    'progress': [
+        ('ease_factor', 'INTEGER DEFAULT 250'),
+        ('interval', 'INTEGER DEFAULT 0'),
+        ('stability', 'FLOAT DEFAULT 0'),
+        ('fsrs_difficulty', 'FLOAT DEFAULT 0'),
+    ],
+    'decks': [
+        ('fsrs_weights', 'VARCHAR'),
+        ('request_retention', 'FLOAT DEFAULT 0.9'),
+    ],
+}
+
+def add_scheduler_columns():
+    """添加调度相关列（已存在则跳过）"""
+    print("检查调度相关列...")
+    
+    inspector = inspect(engine)
+    tables = inspector.get_table_names()
+    
+    with engine.connect() as conn:
+        for table_name, columns in NEW_COLUMNS.items():
+            if table_name not in tables:
+                print(f"警告: {table_name} 表不存在，跳过")
+                continue
+            
+            existing = [col['name'] for col in inspector.get_columns(table_name)]
+            for column_name, definition in columns:
+                if column_name in existing:
+                    print(f"ℹ️  {table_name}.{column_name} 列已存在")
+                    continue
+                
+                print(f"添加 {table_name}.{column_name} 列...")
+                conn.execute(text(f'ALTER TABLE {table_name} ADD COLUMN "{column_name}" {definition}'))
+                print(f"✅ {table_name}.{column_name} 列创建成功")
+        conn.commit()
+
+if __name__ == '__main__':
+    print("=" * 50)
+    print("数据库迁移：记忆算法字段")
+    print("=" * 50)
+    
+    try:
+        add_scheduler_columns()
+        print("\n✅ 迁移全部完成！")
+    except Exception as e:
+        print(f"\n❌ 迁移失败: {e}")
+        sys.exit(1)
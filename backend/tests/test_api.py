@@ -9,6 +9,7 @@ from sqlalchemy.orm import sessionmaker
 from app.main import app
 from app.database import Base, get_db
 from app import models
+from app.answer_journal import AnswerJournal
 
 # 使用内存数据库进行测试
 SQLALCHEMY_TEST_DATABASE_URL = "sqlite:///./test.db"
@@ -71,6 +72,25 @@ def test_get_words(test_client, test_db):
     assert isinstance(data, list)
     assert len(data) > 0
 
+def test_get_words_distinct_sample(test_client, test_db):
+    """测试随机抽词不重复且不超过数量限制"""
+    response = test_client.get("/api/words?difficulty=1&limit=10")
+    assert response.status_code == 200
+    ids = [w["id"] for w in response.json()]
+    assert len(ids) == len(set(ids))
+    assert len(ids) <= 10
+    assert all(w["difficulty"] == 1 for w in response.json())
+
+def test_get_words_no_progress_writes(test_client, test_db):
+    """测试读取单词列表不会创建学习进度记录"""
+    before = test_db.query(models.Progress).count()
+    response = test_client.get("/api/words?difficulty=2&limit=10")
+    assert response.status_code == 200
+    for w in response.json():
+        assert w["mastery_level"] == 0
+        assert w["error_count"] == 0
+    assert test_db.query(models.Progress).count() == before
+
 def test_get_words_invalid_difficulty(test_client):
     """测试无效难度"""
     response = test_client.get("/api/words?difficulty=5&limit=10")
@@ -109,6 +129,563 @@ def test_check_spelling_incorrect(test_client, test_db):
     assert data["correct"] is False
     assert data["correct_word"] == word["word"]
 
+def test_update_progress_upsert_matches_rules(test_client, test_db):
+    """测试 UPSERT 更新进度与 apply_answer 调度规则一致"""
+    from datetime import date
+    from types import SimpleNamespace
+    from app import crud
+    
+    word = test_db.query(models.Word).filter(models.Word.word == "test").first()
+    test_db.query(models.Progress).filter(models.Progress.word_id == word.id).delete()
+    test_db.commit()
+    
+    expected = SimpleNamespace(mastery_level=0, review_count=0, error_count=0,
+                               next_review=None, last_reviewed=None)
+    for is_correct in [True, True, True, False, True]:
+        progress = crud.update_progress(test_db, word.id, is_correct)
+        crud.apply_answer(expected, is_correct)
+        assert progress.mastery_level == expected.mastery_level
+        assert progress.next_review == expected.next_review
+        assert progress.error_count == expected.error_count
+        assert progress.review_count == expected.review_count
+        assert progress.last_reviewed == date.today()
+
+def test_update_progress_concurrent_answers_not_lost(test_client, test_db, monkeypatch):
+    """测试读取后另一次答题先提交时重新计算，两次答题都计入"""
+    from app import crud
+
+    word = test_db.query(models.Word).filter(models.Word.word == "hello").first()
+    test_db.query(models.Progress).filter(models.Progress.word_id == word.id).delete()
+    test_db.commit()
+    before = crud.update_progress(test_db, word.id, False)
+
+    real_rows = crud.get_scheduling_rows
+    calls = []
+
+    def racing_rows(db, word_ids):
+        rows = real_rows(db, word_ids)
+        if not calls:
+            # 模拟另一个 worker 在本次读取之后提交了同一单词的答题
+            other = TestingSessionLocal()
+            try:
+                monkeypatch.setattr(crud, "get_scheduling_rows", real_rows)
+                crud.update_progress(other, word.id, False)
+            finally:
+                monkeypatch.setattr(crud, "get_scheduling_rows", racing_rows)
+                other.close()
+        calls.append(word_ids)
+        return rows
+
+    monkeypatch.setattr(crud, "get_scheduling_rows", racing_rows)
+    progress = crud.update_progress(test_db, word.id, False)
+
+    assert len(calls) == 2
+    assert progress.review_count == before.review_count + 2
+    assert progress.error_count == before.error_count + 2
+
+def test_check_batch_recomputes_after_concurrent_answer(test_client, test_db, monkeypatch):
+    """测试批量答题读取后同一单词被单次答题插入进度时整批重新计算，不丢失也不主键冲突"""
+    from app import crud
+    
+    word = test_db.query(models.Word).filter(models.Word.word == "hello").first()
+    test_db.query(models.Progress).filter(models.Progress.word_id == word.id).delete()
+    test_db.commit()
+    
+    real_rows = crud.get_scheduling_rows
+    calls = []
+    
+    def racing_rows(db, word_ids):
+        rows = real_rows(db, word_ids)
+        calls.append(word_ids)
+        if len(calls) == 1:
+            # 模拟另一个 worker 在本批读取之后提交了同一单词的第一次答题
+            other = TestingSessionLocal()
+            try:
+                crud.update_progress(other, word.id, True)
+            finally:
+                other.close()
+        return rows
+    
+    monkeypatch.setattr(crud, "get_scheduling_rows", racing_rows)
+    response = test_client.post("/api/spell/check-batch", json={"items": [
+        {"word_id": word.id, "input": "hello"}, {"word_id": word.id, "input": "wrong"}
+    ]})
+    assert response.status_code == 200
+    # 第 2 次为另一个 worker 的读取，第 3 次为本批重新读取
+    assert len(calls) == 3
+    
+    test_db.expire_all()
+    progress = test_db.get(models.Progress, word.id)
+    assert progress.review_count == 3
+    assert progress.error_count == 1
+
+def test_update_progress_honors_deck_algorithm(test_client, test_db):
+    """测试答题按所属词库的 FSRS 算法调度"""
+    from app import crud, scheduler
+    
+    deck = models.Deck(name="FSRS测试", algorithm=scheduler.FSRS)
+    test_db.add(deck)
+    test_db.commit()
+    word = models.Word(word="fsrs", zh_definition="算法", difficulty=3, deck_id=deck.id)
+    test_db.add(word)
+    test_db.commit()
+    
+    progress = crud.update_progress(test_db, word.id, True)
+    assert progress.stability == scheduler.DEFAULT_FSRS_WEIGHTS[2]
+    assert progress.interval == round(scheduler.DEFAULT_FSRS_WEIGHTS[2])
+    assert progress.mastery_level == 1
+
+def test_reschedule_deck_switches_algorithm(test_client, test_db):
+    """测试切换词库算法后整库重排"""
+    import time
+    from datetime import date, timedelta
+    
+    deck = models.Deck(name="重排测试", algorithm="StepMaster")
+    test_db.add(deck)
+    test_db.commit()
+    word = models.Word(word="resched", zh_definition="重排", difficulty=3, deck_id=deck.id)
+    test_db.add(word)
+    test_db.commit()
+    today = date.today()
+    test_db.add(models.Progress(
+        word_id=word.id, mastery_level=2, last_reviewed=today,
+        next_review=today + timedelta(days=15), interval=15, review_count=3
+    ))
+    test_db.commit()
+    
+    response = test_client.post(
+        f"/api/decks/{deck.id}/reschedule",
+        json={"algorithm": "FSRS", "request_retention": 0.8}
+    )
+    assert response.status_code == 200
+    job_id = response.json()["job_id"]
+    
+    for _ in range(100):
+        job = test_client.get(f"/api/decks/reschedule/{job_id}").json()
+        if job["status"] in ("done", "failed"):
+            break
+        time.sleep(0.05)
+    assert job["status"] == "done"
+    assert job["updated"] == 1
+    
+    test_db.expire_all()
+    progress = test_db.get(models.Progress, word.id)
+    assert progress.stability == 15
+    assert progress.next_review > today + timedelta(days=15)
+
+def test_reschedule_skips_cards_answered_during_job(test_client, test_db, monkeypatch):
+    """测试重排读取后被答题修改的卡片不被覆盖，同一词库不能同时启动两个任务"""
+    from datetime import date, timedelta
+    from app import reschedule
+    
+    deck = models.Deck(name="重排并发", algorithm="FSRS")
+    test_db.add(deck)
+    test_db.commit()
+    words = [models.Word(word=f"race{i}", zh_definition="并发", difficulty=3, deck_id=deck.id) for i in range(2)]
+    test_db.add_all(words)
+    test_db.commit()
+    today = date.today()
+    for word in words:
+        test_db.add(models.Progress(
+            word_id=word.id, mastery_level=1, last_reviewed=today,
+            next_review=today + timedelta(days=4), interval=4, review_count=2
+        ))
+    test_db.commit()
+    
+    # 模拟计算期间第一个单词被答题
+    compute = reschedule.reschedule_chunk
+    def answered_meanwhile(rows, params):
+        updates = compute(rows, params)
+        other = TestingSessionLocal()
+        try:
+            other.query(models.Progress).filter(models.Progress.word_id == words[0].id).update(
+                {"review_count": 3, "next_review": today + timedelta(days=30)}
+            )
+            other.commit()
+        finally:
+            other.close()
+        return updates
+    monkeypatch.setattr(reschedule, "reschedule_chunk", answered_meanwhile)
+    
+    job = reschedule.run_reschedule(engine, reschedule.RescheduleJob(0, deck.id))
+    assert job.status == "done"
+    assert (job.updated, job.skipped) == (1, 1)
+    test_db.expire_all()
+    assert test_db.get(models.Progress, words[0].id).next_review == today + timedelta(days=30)
+    
+    running = reschedule.RescheduleJob(0, deck.id)
+    running.status = "running"
+    monkeypatch.setattr(reschedule.reschedule_manager, "active", lambda deck_id: running)
+    assert test_client.post(f"/api/decks/{deck.id}/reschedule").status_code == 409
+
+def test_reschedule_invalid_algorithm(test_client, test_db):
+    """测试重排时使用无效算法"""
+    deck = test_db.query(models.Deck).first()
+    response = test_client.post(f"/api/decks/{deck.id}/reschedule", json={"algorithm": "XYZ"})
+    assert response.status_code == 400
+
+def test_review_log_append_and_prune(test_client, test_db):
+    """测试答题追加日志，过期明细按日汇总后清理"""
+    import time
+    from app import crud, review_log
+    
+    word = models.Word(word="logword", zh_definition="日志", difficulty=3)
+    test_db.add(word)
+    test_db.commit()
+    before = test_db.query(models.ReviewLog).filter(models.ReviewLog.word_id == word.id).count()
+    crud.update_progress(test_db, word.id, False)
+    crud.update_progress(test_db, word.id, True)
+    logs = test_db.query(models.ReviewLog).filter(
+        models.ReviewLog.word_id == word.id
+    ).order_by(models.ReviewLog.id).all()
+    assert len(logs) == before + 2
+    assert [log.grade for log in logs[-2:]] == [1, 3]
+    
+    # 模拟 40 天前的日志
+    old_ts = int(time.time()) - 40 * 86400
+    review_log.append(test_db, [
+        {"reviewed_at": old_ts, "word_id": word.id, "grade": 1, "elapsed_days": 0, "prior_interval": 0},
+        {"reviewed_at": old_ts + 1, "word_id": word.id, "grade": 3, "elapsed_days": 0, "prior_interval": 0},
+    ])
+    test_db.commit()
+    
+    assert review_log.prune(test_db, retention_days=30) == 2
+    rollup = test_db.query(models.ReviewLogDaily).filter(
+        models.ReviewLogDaily.day == old_ts // 86400
+    ).one()
+    assert rollup.reviews == 2
+    assert rollup.lapses == 1
+    total = test_db.query(models.ReviewLog).count()
+    assert sum(len(chunk) for chunk in review_log.iter_range(test_db, chunk_size=1)) == total
+
+def test_review_count_histogram(test_client, test_db, monkeypatch):
+    """测试待复习数由直方图增量维护，并能通过对账修正偏差"""
+    from datetime import date, timedelta
+    from app.due_histogram import due_histogram
+    
+    monkeypatch.setattr(due_histogram, "refresh_interval", 3600)
+    due_histogram.invalidate()
+    before = test_client.get("/api/progress/review-count").json()["count"]
+    
+    word = models.Word(word="duecount", zh_definition="待复习", difficulty=1)
+    test_db.add(word)
+    test_db.commit()
+    
+    # 答错：今天复习
+    test_client.post("/api/spell/check", json={"word_id": word.id, "input": "wrong"})
+    assert test_client.get("/api/progress/review-count").json()["count"] == before + 1
+    
+    # 标记已学习：明天复习
+    test_client.post("/api/progress/batch-update", json={"word_ids": [word.id]})
+    assert test_client.get("/api/progress/review-count").json()["count"] == before
+    
+    # 绕过写入路径直接修改数据库，对账后修正
+    other = models.Word(word="duedrift", zh_definition="偏差", difficulty=1)
+    test_db.add(other)
+    test_db.commit()
+    test_db.add(models.Progress(word_id=other.id, next_review=date.today() - timedelta(days=1)))
+    test_db.commit()
+    assert due_histogram.reconcile(test_db) == {other.deck_id or 0: -1}
+    assert test_client.get("/api/progress/review-count").json()["count"] == before + 1
+
+def test_due_histogram_refreshes_in_background_after_other_writes(test_client, test_db):
+    """测试其它 worker 写入后数据版本号变化，直方图在后台重新统计"""
+    from datetime import date
+    from app.due_histogram import DueHistogram
+
+    histogram = DueHistogram(reconcile_interval=0, refresh_interval=0)
+    before = histogram.count(test_db)
+    assert histogram.count(test_db) == before
+    assert histogram._refresher is None
+
+    word = models.Word(word="duerefresh", zh_definition="刷新", difficulty=1)
+    test_db.add(word)
+    test_db.commit()
+    test_db.add(models.Progress(word_id=word.id, next_review=date.today()))
+    test_db.commit()
+
+    histogram.count(test_db)
+    histogram._refresher.join()
+    assert histogram.count(test_db) == before + 1
+
+def test_due_histogram_snapshot_requires_matching_versions(test_client, test_db, monkeypatch):
+    """测试直方图快照只在启动后第一次载入、且数据版本号未变时使用"""
+    from datetime import date
+    from app.due_histogram import DueHistogram
+
+    saved = DueHistogram(reconcile_interval=0)
+    expected = saved.count(test_db)
+    saved.close()
+
+    # 版本号未变：直接使用快照，不查询 progress
+    def no_query(db):
+        raise AssertionError("snapshot should have been used")
+
+    restored = DueHistogram(reconcile_interval=0)
+    monkeypatch.setattr(restored, "_query", no_query)
+    assert restored.count(test_db) == expected
+    # invalidate 之后不再使用快照
+    restored.invalidate()
+    with pytest.raises(AssertionError):
+        restored.count(test_db)
+
+    # 快照保存后有其它进程写入：放弃快照，从 progress 重建
+    word = models.Word(word="duesnapshot", zh_definition="快照", difficulty=1)
+    test_db.add(word)
+    test_db.commit()
+    test_db.add(models.Progress(word_id=word.id, next_review=date.today()))
+    test_db.commit()
+    assert DueHistogram(reconcile_interval=0).count(test_db) == expected + 1
+
+def test_review_queue_order_and_rollover(test_client, test_db):
+    """测试待复习队列与 SQL 排序一致，增量更新并在跨日时滚动"""
+    from datetime import date, timedelta
+    from app import crud
+    from app.review_queue import review_queue
+    
+    deck = models.Deck(name="复习队列")
+    test_db.add(deck)
+    test_db.commit()
+    words = [models.Word(word=f"queue{i}", zh_definition="队列", difficulty=1, deck_id=deck.id) for i in range(4)]
+    test_db.add_all(words)
+    test_db.commit()
+    today = date.today()
+    test_db.add_all([
+        models.Progress(word_id=words[0].id, mastery_level=1, error_count=0, next_review=today),
+        models.Progress(word_id=words[1].id, mastery_level=0, error_count=1, next_review=today),
+        models.Progress(word_id=words[2].id, mastery_level=0, error_count=3, next_review=today - timedelta(days=2)),
+        models.Progress(word_id=words[3].id, mastery_level=0, error_count=5, next_review=today + timedelta(days=1)),
+    ])
+    test_db.commit()
+    review_queue.invalidate()
+    
+    ids = [word.id for word in crud.get_review_words(test_db, 10, deck.id)]
+    assert ids == [words[2].id, words[1].id, words[0].id]
+    
+    # 答对后进入未来日期，移出队列；答错一次后排序随之变化
+    crud.update_progress(test_db, words[2].id, True)
+    crud.update_progress(test_db, words[1].id, False)
+    ids = [word.id for word in crud.get_review_words(test_db, 10, deck.id)]
+    assert ids == [words[1].id, words[0].id]
+    
+    # 跨日：明天到期的卡片滚入队列
+    tomorrow_ids = review_queue.top(test_db, 10, deck.id, today=today + timedelta(days=1))
+    assert tomorrow_ids[0] == words[3].id
+    assert set(tomorrow_ids) >= {words[0].id, words[1].id, words[3].id}
+
+    # 另一个 worker 答过的卡片（本进程未收到通知）按数据库校验后不再返回
+    other = TestingSessionLocal()
+    try:
+        other.query(models.Progress).filter(models.Progress.word_id == words[1].id).update(
+            {"next_review": today + timedelta(days=3)}
+        )
+        other.commit()
+    finally:
+        other.close()
+    ids = [word.id for word in crud.get_review_words(test_db, 10, deck.id)]
+    assert ids == [words[0].id]
+
+def test_optimize_deck_weights(test_client, test_db):
+    """测试根据答题日志优化词库 FSRS 权重"""
+    import json
+    import time
+    from app import review_log
+    
+    deck = models.Deck(name="优化测试", algorithm="FSRS")
+    test_db.add(deck)
+    test_db.commit()
+    words = [models.Word(word=f"opt{i}", zh_definition="优化", difficulty=3, deck_id=deck.id) for i in range(100)]
+    test_db.add_all(words)
+    test_db.commit()
+    
+    # 每个单词 6 次答题，间隔逐渐拉长，长间隔后更容易忘记
+    base_ts = int(time.time()) - 200 * 86400
+    entries = []
+    for i, word in enumerate(words):
+        ts = base_ts
+        for k, elapsed in enumerate([0, 1, 3, 8, 20, 45]):
+            ts += elapsed * 86400
+            grade = 1 if k > 0 and (i * 7 + k) % 10 < k else 3
+            entries.append({"reviewed_at": ts, "word_id": word.id, "grade": grade,
+                            "elapsed_days": elapsed, "prior_interval": 0})
+    review_log.append(test_db, entries)
+    test_db.commit()
+    
+    from app.cache import cache, deck_tag, DECKS_TAG
+    before = cache.tag_versions([DECKS_TAG, deck_tag(deck.id)])
+    
+    response = test_client.post(f"/api/decks/{deck.id}/optimize")
+    assert response.status_code == 200
+    for _ in range(200):
+        result = test_client.get(f"/api/decks/{deck.id}/optimize").json()
+        if result["status"] != "running":
+            break
+        time.sleep(0.05)
+    assert result["status"] == "done"
+    assert result["reviews"] == 600
+    assert result["loss_after"] < result["loss_before"]
+    
+    test_db.expire_all()
+    assert json.loads(test_db.get(models.Deck, deck.id).fsrs_weights) == result["weights"]
+    after = cache.tag_versions([DECKS_TAG, deck_tag(deck.id)])
+    assert all(after[tag] > before[tag] for tag in before)
+    assert (result["total_reviews"], result["sampled"]) == (600, False)
+    
+    # 超过上限时按卡片均匀抽样，而不是只取 word_id 最小的卡片
+    from app.fsrs_optimizer import load_history
+    with engine.connect() as conn:
+        history = load_history(conn, deck.id, max_reviews=300, chunk_size=64)
+    assert history.sampled and history.total_reviews == 600
+    assert 0 < history.review_count <= 300
+    assert history.review_count == history.card_count * 6
+    assert test_client.post("/api/decks/999999/optimize").status_code == 404
+
+def test_mark_words_studied(test_client, test_db):
+    """测试批量标记已学习跳过不存在的单词"""
+    word = test_db.query(models.Word).filter(models.Word.word == "hello").first()
+    response = test_client.post(
+        "/api/progress/batch-update",
+        json={"word_ids": [word.id, word.id, 999999]}
+    )
+    assert response.status_code == 200
+    assert response.json()["updated_count"] == 1
+    
+    response = test_client.post("/api/progress/mark-studied", json={"word_id": word.id})
+    assert response.status_code == 200
+    assert response.json()["next_review"] is not None
+
+def test_check_spelling_batch(test_client, test_db):
+    """测试批量拼写检查按提交顺序返回"""
+    word = test_db.query(models.Word).filter(models.Word.word == "hello").first()
+    response = test_client.post(
+        "/api/spell/check-batch",
+        json={"items": [
+            {"word_id": word.id, "input": "hello"},
+            {"word_id": word.id, "input": "helo"},
+        ]}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert [item["correct"] for item in data] == [True, False]
+    assert all(item["correct_word"] == "hello" for item in data)
+
+def test_check_spelling_batch_unknown_word(test_client, test_db):
+    """测试批量拼写检查包含不存在的单词"""
+    response = test_client.post(
+        "/api/spell/check-batch",
+        json={"items": [{"word_id": 999999, "input": "x"}]}
+    )
+    assert response.status_code == 404
+
+def test_answer_journal_write_behind(test_client, test_db):
+    """测试写后日志：同步返回调度结果，合并后一次写入"""
+    word = test_db.query(models.Word).filter(models.Word.word == "python").first()
+    journal = AnswerJournal(TestingSessionLocal, flush_interval=60, batch_size=1000)
+    try:
+        first = journal.record(test_db, word.id, True)
+        second = journal.record(test_db, word.id, False)
+        assert first.mastery_level == 1
+        assert second.mastery_level == 0
+        assert second.error_count == 1
+        assert second.review_count == 2
+        assert journal.pending_count() == 1
+        
+        assert journal.flush() == 1
+        assert journal.pending_count() == 0
+        test_db.expire_all()
+        progress = test_db.query(models.Progress).filter(models.Progress.word_id == word.id).first()
+        assert progress.review_count == 2
+        assert progress.error_count == 1
+    finally:
+        journal.close()
+
+def test_answer_journal_failed_word_does_not_block_others(test_client, test_db, monkeypatch):
+    """测试整批写入失败时逐个单词写入，反复失败的单词移入死信列表"""
+    good = test_db.query(models.Word).filter(models.Word.word == "test").first()
+    bad = test_db.query(models.Word).filter(models.Word.word == "hello").first()
+    journal = AnswerJournal(TestingSessionLocal, flush_interval=60, batch_size=1000, max_attempts=2)
+    real_write = journal._write
+
+    def failing_write(batch, log_entries, stats_rows):
+        if bad.id in batch:
+            raise RuntimeError("bad row")
+        return real_write(batch, log_entries, stats_rows)
+
+    monkeypatch.setattr(journal, "_write", failing_write)
+    try:
+        before = test_db.get(models.Progress, good.id).review_count
+        journal.record(test_db, good.id, True)
+        journal.record(test_db, bad.id, True)
+
+        assert journal.flush() == 1
+        assert journal.pending_count() == 1
+        test_db.expire_all()
+        assert test_db.get(models.Progress, good.id).review_count == before + 1
+
+        assert journal.flush() == 0
+        assert journal.pending_count() == 0
+        assert [(d["word_id"], d["attempts"]) for d in journal.dead_letters()] == [(bad.id, 2)]
+    finally:
+        journal.close()
+
+def test_answer_journal_rereads_after_exclusive_write(test_client, test_db, monkeypatch):
+    """测试答题读取进度后、合并前有同步写入提交时重新读取，不会用旧进度覆盖"""
+    from app import crud
+
+    word = test_db.query(models.Word).filter(models.Word.word == "test").first()
+    journal = AnswerJournal(TestingSessionLocal, flush_interval=60, batch_size=1000)
+    real_rows = crud.get_scheduling_rows
+    calls = []
+
+    def racing_rows(db, word_ids):
+        rows = real_rows(db, word_ids)
+        if not calls:
+            # 模拟批量拼写检查在本次读取之后提交
+            with journal.exclusive():
+                other = TestingSessionLocal()
+                try:
+                    other.get(models.Progress, word.id).review_count += 5
+                    other.commit()
+                finally:
+                    other.close()
+        calls.append(word_ids)
+        return rows
+
+    monkeypatch.setattr(crud, "get_scheduling_rows", racing_rows)
+    try:
+        before = test_db.get(models.Progress, word.id).review_count
+        snapshot = journal.record(test_db, word.id, True)
+        assert len(calls) == 2
+        assert snapshot.review_count == before + 6
+    finally:
+        journal.discard()
+        journal.close()
+
+def test_answer_journal_recomputes_after_other_worker_commit(test_client, test_db):
+    """测试另一个 worker 在日志写入前提交了同一单词的答题时，基于最新进度重新计算，两边的答题都计入"""
+    from app import crud
+
+    word = test_db.query(models.Word).filter(models.Word.word == "test").first()
+    journal = AnswerJournal(TestingSessionLocal, flush_interval=60, batch_size=1000)
+    try:
+        before = test_db.get(models.Progress, word.id)
+        review_count, error_count = before.review_count, before.error_count
+        journal.record(test_db, word.id, False)
+
+        other = TestingSessionLocal()
+        try:
+            crud.update_progress(other, word.id, False)
+        finally:
+            other.close()
+
+        assert journal.flush() == 1
+        test_db.expire_all()
+        progress = test_db.get(models.Progress, word.id)
+        assert progress.review_count == review_count + 2
+        assert progress.error_count == error_count + 2
+    finally:
+        journal.close()
+
 def test_get_word_stats(test_client, test_db):
     """测试词库统计"""
     response = test_client.get("/api/words/stats")
@@ -129,6 +706,163 @@ def test_get_progress(test_client, test_db):
     assert "mastered" in data
     assert "familiar" in data
 
+def test_progress_stats_single_pass(test_client, test_db):
+    """测试学习统计只执行3条查询，近7天数据按日期升序"""
+    from datetime import date
+    from sqlalchemy import event
+    from app import crud
+    
+    statements = []
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    
+    before = crud.get_progress_stats(test_db)
+    word = models.Word(word="statsword", zh_definition="统计", difficulty=2)
+    test_db.add(word)
+    test_db.commit()
+    crud.update_progress(test_db, word.id, False)
+    
+    event.listen(engine, "before_cursor_execute", count_statement)
+    try:
+        stats = crud.get_progress_stats(test_db)
+    finally:
+        event.remove(engine, "before_cursor_execute", count_statement)
+    
+    assert len(statements) == 3
+    assert stats["recent_stats"][-1] == {
+        "date": date.today().strftime("%m-%d"),
+        "reviewed": before["recent_stats"][-1]["reviewed"] + 1
+    }
+    assert stats["mastery"]["红"] == before["mastery"].get("红", 0) + 1
+    assert stats["error_words"] == before["error_words"] + 1
+    assert stats["total_words"] == before["total_words"] + 1
+
+def test_progress_recent_stats_counts_answered_words_per_day(test_client, test_db):
+    """测试 recent_stats 为最近7天每天答题的不同单词数（按日期升序），同一单词在多天答题时每天各计一次"""
+    from datetime import date, timedelta
+    from app import crud, daily_stats
+    
+    today = date.today()
+    yesterday = today - timedelta(days=1)
+    before = crud.get_progress_stats(test_db)["recent_stats"]
+    assert [day["date"] for day in before] == [
+        (today - timedelta(days=offset)).strftime("%m-%d") for offset in range(6, -1, -1)
+    ]
+    assert all(set(day) == {"date", "reviewed"} for day in before)
+    
+    word = models.Word(word="recentstats", zh_definition="近期", difficulty=1)
+    test_db.add(word)
+    test_db.commit()
+    # 昨天答过一次（直接写入每日统计），今天答两次
+    daily_stats.upsert(test_db, [daily_stats.answer_row(word.deck_id, None, True, today=yesterday)])
+    test_db.commit()
+    crud.update_progress(test_db, word.id, True)
+    crud.update_progress(test_db, word.id, False)
+    
+    after = crud.get_progress_stats(test_db)["recent_stats"]
+    assert [a["reviewed"] - b["reviewed"] for a, b in zip(after, before)] == [0] * 5 + [1, 1]
+
+def test_daily_stats_rollup(test_client, test_db):
+    """测试答题和标记已学习按词库、日期累加每日统计"""
+    from app import daily_stats
+    
+    deck = models.Deck(name="每日统计")
+    test_db.add(deck)
+    test_db.commit()
+    words = [models.Word(word=f"daily{i}", zh_definition="统计", difficulty=1, deck_id=deck.id) for i in range(3)]
+    test_db.add_all(words)
+    test_db.commit()
+    
+    test_client.post("/api/spell/check", json={"word_id": words[0].id, "input": "wrong"})
+    test_client.post("/api/spell/check", json={"word_id": words[0].id, "input": "daily0"})
+    test_client.post("/api/spell/check-batch", json={"items": [
+        {"word_id": words[1].id, "input": "daily1"},
+        {"word_id": words[1].id, "input": "daily1"},
+    ]})
+    test_client.post("/api/progress/batch-update", json={"word_ids": [words[1].id, words[2].id]})
+    
+    today = daily_stats.recent(test_db, days=1, deck_id=deck.id)[0]
+    assert today["new_learned"] == 3
+    assert today["reviewed"] == 2
+    assert today["correct_count"] == 3
+    assert today["error_count"] == 1
+    assert test_db.query(models.DailyStats).filter(models.DailyStats.deck_id == deck.id).count() == 1
+
+def test_deck_activity_heatmap(test_client, test_db):
+    """测试词库学习热力图读取每日统计，答题提交后缓存失效"""
+    deck = models.Deck(name="热力图")
+    test_db.add(deck)
+    test_db.commit()
+    word = models.Word(word="heatmap", zh_definition="热力图", difficulty=1, deck_id=deck.id)
+    test_db.add(word)
+    test_db.commit()
+    
+    response = test_client.get(f"/api/decks/{deck.id}/activity?days=30")
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data["counts"]) == 30
+    assert data["total"] == 0
+    
+    test_client.post("/api/spell/check", json={"word_id": word.id, "input": "heatmap"})
+    test_client.post("/api/spell/check", json={"word_id": word.id, "input": "wrong"})
+    data = test_client.get(f"/api/decks/{deck.id}/activity?days=30").json()
+    assert data["counts"][-1] == 2
+    assert data["accuracy"][-1] == 0.5
+    assert data["accuracy"][0] is None
+    
+    # 清理进度使所有词库标签失效
+    from app.cache import cache, deck_tag
+    before = cache.tag_versions([deck_tag(deck.id)])
+    test_client.post("/api/progress/clear")
+    assert cache.tag_versions([deck_tag(deck.id)]) != before
+    assert test_client.get(f"/api/decks/{deck.id}/activity?days=30").json()["total"] == 0
+    
+    assert test_client.get(f"/api/decks/{deck.id}/activity?days=0").status_code == 400
+    assert test_client.get("/api/decks/999999/activity").status_code == 404
+
+def test_deck_counters_maintained_by_triggers(test_client, test_db):
+    """测试词库计数器随单词、进度写入自动维护，并可校验修复"""
+    deck = models.Deck(name="计数器")
+    test_db.add(deck)
+    test_db.commit()
+    words = [
+        models.Word(word="counter1", zh_definition="计数", difficulty=1, deck_id=deck.id),
+        models.Word(word="counter2", zh_definition="计数", difficulty=3, deck_id=deck.id),
+    ]
+    test_db.add_all(words)
+    test_db.commit()
+    
+    test_client.post("/api/spell/check", json={"word_id": words[0].id, "input": "counter1"})
+    test_client.post("/api/progress/mark-studied", json={"word_id": words[1].id})
+    words[1].difficulty = 2
+    test_db.commit()
+    
+    summary = next(d for d in test_client.get("/api/decks").json() if d["id"] == deck.id)
+    assert summary["total_words"] == 2
+    assert summary["learned_words"] == 1
+    assert (summary["level1_words"], summary["level2_words"], summary["level3_words"]) == (1, 1, 0)
+    
+    # 答错后回到陌生
+    test_client.post("/api/spell/check", json={"word_id": words[0].id, "input": "wrong"})
+    test_db.expire_all()
+    assert test_db.get(models.Deck, deck.id).learned_words == 0
+    mismatches = test_client.post("/api/decks/verify-counters").json()["mismatches"]
+    assert deck.id not in [item["deck_id"] for item in mismatches]
+    
+    # 人为破坏后修复
+    test_db.get(models.Deck, deck.id).total_words = 99
+    test_db.commit()
+    etag = test_client.get("/api/decks").headers["etag"]
+    result = test_client.post("/api/decks/verify-counters?repair=true").json()
+    assert deck.id in [item["deck_id"] for item in result["mismatches"]]
+    assert test_client.post("/api/decks/verify-counters").json()["mismatch_count"] == 0
+    test_db.expire_all()
+    assert test_db.get(models.Deck, deck.id).total_words == 2
+    # 修复改变数据版本号：旧 ETag 不再返回 304
+    response = test_client.get("/api/decks", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert next(d for d in response.json() if d["id"] == deck.id)["total_words"] == 2
+
 def test_get_review_count(test_client, test_db):
     """测试复习计数"""
     response = test_client.get("/api/progress/review-count")
@@ -137,3 +871,145 @@ def test_get_review_count(test_client, test_db):
     assert "count" in data
     assert "date" in data
     assert data["count"] >= 0
+
+def test_progress_cache_invalidated_by_writes(test_client, test_db):
+    """测试学习进度缓存在答题提交后按标签失效"""
+    first = test_client.get("/api/progress").json()
+    red = first["mastery"].get("红", 0)
+    word = models.Word(word="cachetag", zh_definition="缓存", difficulty=1)
+    other = models.Word(word="cacheversion", zh_definition="版本", difficulty=1)
+    test_db.add_all([word, other])
+    test_db.commit()
+    
+    test_client.post("/api/spell/check", json={"word_id": word.id, "input": "wrong"})
+    assert test_client.get("/api/progress").json()["mastery"]["红"] == red + 1
+    
+    # 直接写库不经过写入路径，数据版本号改变，缓存同样不会返回旧值
+    test_db.add(models.Progress(word_id=other.id, mastery_level=0))
+    test_db.commit()
+    assert test_client.get("/api/progress").json()["mastery"]["红"] == red + 2
+
+def test_etag_not_modified_until_write(test_client, test_db):
+    """测试读接口返回 ETag，数据未变时 If-None-Match 返回 304，写入后 ETag 改变"""
+    import io
+    
+    first = test_client.get("/api/words/stats")
+    etag = first.headers["etag"]
+    assert first.status_code == 200
+    
+    cached = test_client.get("/api/words/stats", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.headers["etag"] == etag
+    assert test_client.get("/api/words/stats", headers={"If-None-Match": f'"other", W/{etag}'}).status_code == 304
+    
+    progress_etag = test_client.get("/api/progress").headers["etag"]
+    assert test_client.get("/api/progress", headers={"If-None-Match": progress_etag}).status_code == 304
+    
+    file = io.BytesIO("etagupload|实体标签".encode("utf-8"))
+    test_client.post("/api/words/upload", files={"file": ("w.txt", file, "text/plain")})
+    changed = test_client.get("/api/words/stats", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+    assert test_client.get("/api/progress", headers={"If-None-Match": progress_etag}).status_code == 200
+
+def test_etag_changes_on_write_outside_web_process(test_client, test_db):
+    """测试不经过 Web 进程（不使缓存失效）的写入同样改变 ETag，并且不会返回旧的缓存统计"""
+    from sqlalchemy import text
+
+    word = test_db.query(models.Word).filter(models.Word.word == "python").first()
+    test_client.post("/api/spell/check", json={"word_id": word.id, "input": "wrong"})
+    before = test_client.get("/api/progress")
+    etag = before.headers["etag"]
+
+    # 模拟另一个进程直接修改数据库
+    other = TestingSessionLocal()
+    try:
+        other.execute(text("UPDATE progress SET mastery_level = 2 WHERE word_id = :id"), {"id": word.id})
+        other.commit()
+    finally:
+        other.close()
+
+    after = test_client.get("/api/progress", headers={"If-None-Match": etag})
+    assert after.status_code == 200
+    assert after.headers["etag"] != etag
+    assert after.json()["mastery"].get("绿", 0) == before.json()["mastery"].get("绿", 0) + 1
+
+def test_metrics_endpoint_records_route_templates(test_client, test_db):
+    """测试请求指标按路由模板记录，并以 Prometheus 文本格式输出"""
+    from app.metrics import request_metrics
+    
+    test_client.get("/api/decks/999999/activity")
+    test_client.get("/api/no-such-route")
+    response = test_client.get("/api/metrics")
+    
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    text = response.text
+    assert 'route="/api/decks/{deck_id}/activity",status="404"' in text
+    assert 'route="<unmatched>",status="404"' in text
+    assert "wordeasy_cache_hits_total" in text
+    assert request_metrics.quantile("GET", "/api/decks/{deck_id}/activity", 0.99) > 0
+
+def test_db_query_headers(test_client, test_db):
+    """测试响应头返回本次请求执行的 SQL 语句数和耗时"""
+    response = test_client.get("/api/words/stats")
+    # 1 条数据版本号查询 + 4 条计数查询
+    assert int(response.headers["x-db-queries"]) == 5
+    assert float(response.headers["x-db-time"]) > 0
+    
+    not_modified = test_client.get("/api/words/stats", headers={"If-None-Match": response.headers["etag"]})
+    assert not_modified.status_code == 304
+    assert not_modified.headers["x-db-queries"] == "1"
+
+def test_request_trace_includes_crud_and_sql_spans(test_client, test_db):
+    """测试请求追踪包含路由、crud 调用和 SQL 的 span（追踪默认关闭，这里显式注册钩子、中间件和调试接口）"""
+    from fastapi import FastAPI
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    from app import tracing
+    from app.main import install_trace_routes
+
+    # 默认关闭时调试接口和 SQL 钩子都不注册
+    assert test_client.get("/api/debug/traces").status_code == 404
+    assert not event.contains(Engine, "before_cursor_execute", tracing._before_cursor_execute)
+    
+    debug_app = FastAPI()
+    install_trace_routes(debug_app)
+    debug_client = TestClient(debug_app)
+    tracing.install_sql_hooks()
+    try:
+        response = TestClient(tracing.TracingMiddleware(app)).get("/api/words/errors?limit=5")
+    finally:
+        tracing.remove_sql_hooks()
+    trace_id = response.headers["x-trace-id"]
+    
+    trace = debug_client.get(f"/api/debug/traces/{trace_id}").json()
+    assert trace["name"] == "GET /api/words/errors"
+    spans = {span["span_id"]: span for span in trace["spans"]}
+    crud_span = next(span for span in trace["spans"] if span["name"] == "crud.get_error_words")
+    sql_spans = [span for span in trace["spans"] if span["name"] == "sql"]
+    assert spans[crud_span["parent_id"]]["parent_id"] is None
+    assert any(span["parent_id"] == crud_span["span_id"] for span in sql_spans)
+    assert sql_spans[0]["attributes"]["db.statement"].startswith("SELECT")
+    
+    listed = debug_client.get("/api/debug/traces?limit=100").json()
+    assert any(item["trace_id"] == trace_id for item in listed)
+    assert debug_client.get("/api/debug/traces?order=oldest").status_code == 400
+
+def test_word_index_follows_writes_from_other_sessions(test_client, test_db):
+    """测试 create_word 新增的单词立即可抽到，其它进程删除单词后抽样索引失效"""
+    from app import crud, schemas
+    from app.word_index import word_index
+
+    word_index.sample(test_db, 3, 1000)
+    created = crud.create_word(test_db, schemas.WordCreate(word="indexed", zh_definition="索引", difficulty=3))
+    assert created.id in word_index.sample(test_db, 3, 1000)
+
+    # 模拟另一个 worker 直接删除单词
+    other = TestingSessionLocal()
+    try:
+        other.query(models.Word).filter(models.Word.id == created.id).delete()
+        other.commit()
+    finally:
+        other.close()
+    assert created.id not in word_index.sample(test_db, 3, 1000)
@@ -0,0 +1,231 @@
+"""
+缓存测试
+"""
+import threading
+import time
+
+from app.cache import SimpleCache, cached
+
+def test_lru_evicts_least_recently_used():
+    """测试超过条目上限时淘汰最久未使用的条目"""
+    cache = SimpleCache(max_entries=3, shards=1)
+    for key in ("a", "b", "c"):
+        cache.set(key, key)
+    assert cache.get("a") == "a"  # a 变为最近使用
+    cache.set("d", "d")
+    
+    assert cache.get("b") is None
+    assert cache.get("a") == "a"
+    assert cache.size() == 3
+    assert cache.stats()["evictions"] == 1
+
+def test_byte_budget():
+    """测试字节预算"""
+    cache = SimpleCache(max_entries=0, max_bytes=10, shards=1)
+    cache.set("a", "x" * 6)
+    cache.set("b", "y" * 6)
+    
+    assert cache.get("a") is None
+    assert cache.get("b") == "y" * 6
+    assert cache.stats()["bytes"] == 6
+
+def test_ttl_expiry_without_reads():
+    """测试过期条目在后续写入时被清理"""
+    cache = SimpleCache(shards=1)
+    cache.set("short", 1, ttl=0.01)
+    cache.set("forever", 2)
+    time.sleep(0.02)
+    cache.set("other", 3)
+    
+    stats = cache.stats()
+    assert stats["expirations"] == 1
+    assert stats["entries"] == 2
+    assert cache.get("short") is None
+
+def test_overwrite_resets_ttl():
+    """测试覆盖写入后旧的过期记录不影响新值"""
+    cache = SimpleCache(shards=1)
+    cache.set("k", 1, ttl=0.01)
+    cache.set("k", 2, ttl=60)
+    time.sleep(0.02)
+    
+    assert cache.get("k") == 2
+
+def test_concurrent_access_respects_bounds():
+    """测试多线程读写后容量和计数一致"""
+    cache = SimpleCache(max_entries=64, shards=4)
+    
+    def worker(offset):
+        for i in range(500):
+            cache.set(f"{offset}:{i}", i)
+            cache.get(f"{offset}:{i // 2}")
+    
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    stats = cache.stats()
+    assert stats["entries"] <= 64
+    assert stats["hits"] + stats["misses"] == 8 * 500
+
+def test_cached_decorator_caches_none():
+    """测试装饰器缓存返回值（包括 None）"""
+    calls = []
+    
+    @cached(ttl=60, key_prefix="test")
+    def lookup(x):
+        calls.append(x)
+        return None
+    
+    lookup(1)
+    lookup(1)
+    lookup(2)
+    assert calls == [1, 2]
+
+def test_cached_coalesces_concurrent_misses():
+    """测试并发未命中只执行一次函数"""
+    calls = []
+    release = threading.Event()
+    
+    @cached(ttl=60, key_prefix="test")
+    def slow(x):
+        calls.append(x)
+        release.wait(1)
+        return x * 2
+    
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(slow(21))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+    
+    assert calls == [21]
+    assert results == [42] * 8
+
+def test_cached_shares_errors_and_does_not_cache_them():
+    """测试合并的调用方共享异常，异常不写入缓存"""
+    import pytest
+    calls = []
+    
+    @cached(ttl=60, key_prefix="test")
+    def failing():
+        calls.append(1)
+        raise ValueError("boom")
+    
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            failing()
+    assert len(calls) == 2
+
+def test_cached_async_coalesces_concurrent_misses():
+    """测试 async 函数在同一事件循环内合并并发未命中"""
+    import asyncio
+    calls = []
+    
+    @cached(ttl=60, key_prefix="test")
+    async def slow(x):
+        calls.append(x)
+        await asyncio.sleep(0.01)
+        return x + 1
+    
+    async def main():
+        return await asyncio.gather(*(slow(1) for _ in range(10)))
+    
+    assert asyncio.run(main()) == [2] * 10
+    assert calls == [1]
+
+def test_cached_stale_while_revalidate():
+    """测试过期后先返回旧值，由一次后台刷新更新"""
+    counter = [0]
+    refreshed = threading.Event()
+    
+    @cached(ttl=0.05, key_prefix="test", stale_ttl=60)
+    def value():
+        counter[0] += 1
+        if counter[0] > 1:
+            refreshed.set()
+        return counter[0]
+    
+    assert value() == 1
+    time.sleep(0.06)
+    assert value() == 1  # 旧值，触发后台刷新
+    assert refreshed.wait(1)
+    deadline = time.time() + 1
+    while value() != 2 and time.time() < deadline:
+        time.sleep(0.005)
+    assert value() == 2
+    assert counter[0] == 2
+
+def test_invalidate_tags():
+    """测试按标签失效"""
+    cache = SimpleCache(shards=2)
+    cache.set("deck3", 1, tags=["deck:3", "words"])
+    cache.set("deck4", 2, tags=["deck:4", "words"])
+    cache.set("untagged", 3)
+    
+    cache.invalidate_tags("deck:3")
+    assert cache.get("deck3") is None
+    assert cache.get("deck4") == 2
+    
+    cache.invalidate_tags("words")
+    assert cache.get("deck4") is None
+    assert cache.get("untagged") == 3
+    assert cache.stats()["invalidations"] == 2
+
+def test_cached_tag_invalidated_during_compute_is_not_served():
+    """测试计算期间发生的失效使写入的结果作废"""
+    from app.cache import cache as shared_cache
+    calls = []
+    
+    @cached(ttl=60, key_prefix="test", stale_ttl=60, tags=lambda deck_id: [f"deck:{deck_id}"])
+    def deck_summary(deck_id):
+        calls.append(deck_id)
+        if len(calls) == 1:
+            shared_cache.invalidate_tags("deck:7")  # 模拟并发写入
+        return len(calls)
+    
+    assert deck_summary(7) == 1
+    assert deck_summary(7) == 2
+    assert deck_summary(7) == 2
+    shared_cache.invalidate_tags("deck:8")
+    assert deck_summary(7) == 2
+
+def test_sqlite_cache_shared_between_instances(tmp_path):
+    """测试两个 SQLite 缓存实例（模拟两个 worker）共享条目和标签失效"""
+    from app.cache import SQLiteCache
+    path = str(tmp_path / "cache.db")
+    worker_a = SQLiteCache(path)
+    worker_b = SQLiteCache(path)
+    
+    worker_a.set("stats", {"total": 3}, ttl=60, tags=["progress", "deck:1"])
+    worker_a.set("other", [1, 2], tags=["deck:2"])
+    assert worker_b.get("stats") == {"total": 3}
+    
+    generation = worker_a.generation()
+    worker_b.invalidate_tags("deck:1")
+    assert worker_a.generation() == generation + 1
+    assert worker_a.get("stats") is None
+    assert worker_a.get("other") == [1, 2]
+    
+    worker_b.delete("other")
+    assert worker_a.get("other", "missing") == "missing"
+    assert worker_a.stats()["invalidations"] == 1
+
+def test_sqlite_cache_expiry_and_capacity(tmp_path):
+    """测试 SQLite 缓存的过期和容量淘汰"""
+    from app.cache import SQLiteCache
+    cache = SQLiteCache(str(tmp_path / "cache.db"), max_entries=2)
+    cache.set("short", 1, ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get("short") is None
+    
+    for key in ("a", "b", "c"):
+        cache.set(key, key)
+    cache.sweep()
+    assert cache.size() == 2
+    assert cache.stats()["evictions"] == 1
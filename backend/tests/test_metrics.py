@@ -0,0 +1,113 @@
+"""
+请求指标测试
+"""
+from app.metrics import BUCKET_BOUNDS, LatencyHistogram, RequestMetrics, bucket_index
+
+def test_bucket_index_bounds():
+    """测试延迟落入正确的对数分桶"""
+    assert bucket_index(0) == 0
+    assert bucket_index(BUCKET_BOUNDS[0]) == 0
+    for i in (1, 10, len(BUCKET_BOUNDS) - 1):
+        assert bucket_index(BUCKET_BOUNDS[i]) == i
+        assert bucket_index(BUCKET_BOUNDS[i] * 0.99) == i
+        assert bucket_index(BUCKET_BOUNDS[i - 1] * 1.01) == i
+    assert bucket_index(BUCKET_BOUNDS[-1] * 2) == len(BUCKET_BOUNDS)
+
+def test_histogram_quantile_within_bucket_error():
+    """测试分位数估算误差不超过一个分桶宽度（√2 倍）"""
+    histogram = LatencyHistogram()
+    for ms in range(1, 1001):
+        histogram.observe(ms / 1000)
+    
+    p50 = histogram.quantile(0.5)
+    p99 = histogram.quantile(0.99)
+    assert 0.5 / 1.42 < p50 < 0.5 * 1.42
+    assert 0.99 / 1.42 < p99 < 0.99 * 1.42
+    assert histogram.total == 1000
+
+def test_render_prometheus_text():
+    """测试 Prometheus 文本输出（累计分桶、状态码、进行中请求数）"""
+    metrics = RequestMetrics()
+    metrics.start()
+    metrics.finish("GET", "/api/words", 200, 0.003)
+    metrics.start()
+    metrics.finish("GET", "/api/words", 500, 10.0)
+    metrics.start()
+    
+    text = metrics.render()
+    assert 'wordeasy_http_request_duration_seconds_bucket{method="GET",route="/api/words",le="+Inf"} 2' in text
+    assert 'wordeasy_http_request_duration_seconds_count{method="GET",route="/api/words"} 2' in text
+    assert 'wordeasy_http_requests_total{method="GET",route="/api/words",status="500"} 1' in text
+    assert "wordeasy_http_requests_in_flight 1" in text
+
+def test_performance_stats_merges_thread_shards():
+    """测试多线程记录（每个线程独立分片）读取时合并"""
+    import threading
+    from app.performance import PerformanceStats
+    
+    stats = PerformanceStats()
+    
+    def worker():
+        for i in range(1000):
+            stats.record_call("op", 0.001 * (1 + i % 10), error=i % 100 == 0)
+    
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    result = stats.get_stats()["op"]
+    assert result["calls"] == 4000
+    assert result["errors"] == 40
+    assert result["error_rate"] == 1.0
+    for window in ("1m", "5m", "15m"):
+        assert result["windows"][window]["calls"] == 4000
+    assert 0.007 < result["windows"]["1m"]["p95"] < 0.015
+
+def test_performance_stats_retires_finished_thread_shards():
+    """测试线程结束后其分片并入汇总，不再保留，统计不丢失"""
+    import threading
+    from app.performance import PerformanceStats
+    
+    stats = PerformanceStats()
+    stats.record_call("op", 0.01)
+    for _ in range(20):
+        thread = threading.Thread(target=stats.record_call, args=("op", 0.02), kwargs={"error": True})
+        thread.start()
+        thread.join()
+    
+    result = stats.get_stats()["op"]
+    assert len(stats._shards) == 1
+    assert (result["calls"], result["errors"]) == (21, 20)
+    assert result["windows"]["1m"]["calls"] == 21
+    
+    stats.reset()
+    assert stats.get_stats() == {}
+
+def test_performance_stats_rolling_windows():
+    """测试超出窗口的调用不再计入，但仍计入累计值"""
+    from app import performance
+    
+    now = [1_000_000.0]
+    stats = performance.PerformanceStats(clock=lambda: now[0])
+    
+    stats.record_call("op", 0.01, error=True)
+    now[0] += 120
+    stats.record_call("op", 0.02)
+    
+    result = stats.get_stats()["op"]
+    assert result["calls"] == 2
+    assert result["windows"]["1m"]["calls"] == 1
+    assert result["windows"]["1m"]["error_rate"] == 0.0
+    assert result["windows"]["5m"]["calls"] == 2
+    assert result["windows"]["5m"]["errors"] == 1
+    
+    now[0] += 16 * 60
+    result = stats.get_stats()["op"]
+    assert result["windows"]["15m"]["calls"] == 0
+    assert result["windows"]["15m"]["p99"] is None
+    
+    # 时间片复用时旧数据被清零
+    stats.record_call("op", 0.03)
+    assert stats.get_stats()["op"]["windows"]["15m"]["calls"] == 1
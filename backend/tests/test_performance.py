@@ -7,6 +7,8 @@ from sqlalchemy.orm import sessionmaker
 
 from app.database import Base
 from app import models, crud
+from app.reschedule import RescheduleJob, run_reschedule
+from app.fsrs_optimizer import optimize_deck
 
 # 使用测试数据库
 SQLALCHEMY_TEST_DATABASE_URL = "sqlite:///./benchmark.db"
@@ -121,6 +123,166 @@ def benchmark_update_progress(db, iterations=100):
     
     return avg_time
 
+def benchmark_reschedule_deck(db, num_cards=100000):
+    """基准测试：整库重排（切换到 FSRS）"""
+    print(f"\n测试整库重排 ({num_cards} 张卡片)...")
+    from datetime import date, timedelta
+    
+    deck = models.Deck(name="重排基准", algorithm="FSRS")
+    db.add(deck)
+    db.commit()
+    
+    today = date.today()
+    conn = db.connection()
+    start_id = (db.query(models.Word.id).order_by(models.Word.id.desc()).limit(1).scalar() or 0) + 1
+    conn.execute(models.Word.__table__.insert(), [
+        {"id": start_id + i, "word": f"r{i}", "zh_definition": "重排", "difficulty": 1, "deck_id": deck.id}
+        for i in range(num_cards)
+    ])
+    conn.execute(models.Progress.__table__.insert(), [
+        {"word_id": start_id + i, "mastery_level": i % 3, "last_reviewed": today - timedelta(days=i % 10),
+         "next_review": today + timedelta(days=i % 15), "interval": i % 15 + (i % 10), "review_count": 1}
+        for i in range(num_cards)
+    ])
+    db.commit()
+    
+    start_time = time.time()
+    job = run_reschedule(engine, RescheduleJob(0, deck.id))
+    elapsed = time.time() - start_time
+    
+    print(f"状态: {job.status}，更新 {job.updated} 张卡片，耗时 {elapsed:.2f}s")
+    print(f"吞吐量: {num_cards / elapsed:.0f} 张/秒")
+    
+    return elapsed
+
+def benchmark_fsrs_optimizer(db, num_cards=20000, reviews_per_card=10):
+    """基准测试：根据答题日志优化 FSRS 权重"""
+    print(f"\n测试 FSRS 参数优化 ({num_cards * reviews_per_card} 条答题)...")
+    import random
+    
+    deck = models.Deck(name="优化基准", algorithm="FSRS")
+    db.add(deck)
+    db.commit()
+    
+    conn = db.connection()
+    start_id = (db.query(models.Word.id).order_by(models.Word.id.desc()).limit(1).scalar() or 0) + 1
+    conn.execute(models.Word.__table__.insert(), [
+        {"id": start_id + i, "word": f"o{i}", "zh_definition": "优化", "difficulty": 1, "deck_id": deck.id}
+        for i in range(num_cards)
+    ])
+    rng = random.Random(0)
+    entries = []
+    for i in range(num_cards):
+        ts, elapsed = 0, 0
+        for k in range(reviews_per_card):
+            ts += elapsed * 86400
+            entries.append({"reviewed_at": ts, "word_id": start_id + i,
+                            "grade": 1 if k and rng.random() < 0.15 else 3,
+                            "elapsed_days": elapsed, "prior_interval": elapsed})
+            elapsed = max(1, int(elapsed * 2.5))
+    conn.execute(models.ReviewLog.__table__.insert(), entries)
+    db.commit()
+    
+    result = optimize_deck(SQLALCHEMY_TEST_DATABASE_URL, deck.id)
+    
+    print(f"状态: {result['status']}，损失 {result.get('loss_before')} -> {result.get('loss_after')}，"
+          f"耗时 {result['elapsed']:.2f}s")
+    print(f"吞吐量: {result.get('reviews_per_second')} 条/秒")
+    
+    return result['elapsed']
+
+def benchmark_progress_stats(db, num_rows=1000000, iterations=5):
+    """基准测试：学习统计（查询次数与延迟）"""
+    print(f"\n测试 get_progress_stats ({num_rows} 条进度, {iterations} 次迭代)...")
+    from datetime import date, timedelta
+    from sqlalchemy import event
+    
+    today = date.today()
+    conn = db.connection()
+    start_id = (db.query(models.Word.id).order_by(models.Word.id.desc()).limit(1).scalar() or 0) + 1
+    for offset in range(0, num_rows, 100000):
+        count = min(100000, num_rows - offset)
+        conn.execute(models.Word.__table__.insert(), [
+            {"id": start_id + offset + i, "word": f"s{offset + i}", "zh_definition": "统计",
+             "difficulty": (offset + i) % 3 + 1}
+            for i in range(count)
+        ])
+        conn.execute(models.Progress.__table__.insert(), [
+            {"word_id": start_id + offset + i, "mastery_level": (offset + i) % 3,
+             "error_count": (offset + i) % 4, "review_count": (offset + i) % 5,
+             "last_reviewed": today - timedelta(days=(offset + i) % 30)}
+            for i in range(count)
+        ])
+    # 近7天数据来自每日统计：按上面的 last_reviewed 分布写入每天的答题单词数
+    conn.execute(models.DailyStats.__table__.insert(), [
+        {"deck_id": 0, "stat_date": today - timedelta(days=day), "reviewed": num_rows // 30}
+        for day in range(30)
+    ])
+    db.commit()
+    
+    statements = []
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    
+    event.listen(engine, "before_cursor_execute", count_statement)
+    try:
+        start_time = time.time()
+        for _ in range(iterations):
+            stats = crud.get_progress_stats(db)
+        elapsed = time.time() - start_time
+    finally:
+        event.remove(engine, "before_cursor_execute", count_statement)
+    
+    avg_time = elapsed / iterations * 1000
+    print(f"每次查询数: {len(statements) // iterations}")
+    print(f"平均响应时间: {avg_time:.2f}ms（近7天复习 {sum(d['reviewed'] for d in stats['recent_stats'])} 个）")
+    
+    return avg_time
+
+def benchmark_deck_activity(db, iterations=100):
+    """基准测试：365天学习热力图（首次查询与缓存命中）"""
+    print(f"\n测试词库学习热力图 ({iterations} 次迭代)...")
+    from datetime import date, timedelta
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.database import get_db
+    
+    deck = models.Deck(name="热力图基准")
+    db.add(deck)
+    db.commit()
+    today = date.today()
+    db.execute(models.DailyStats.__table__.insert(), [
+        {"deck_id": deck.id, "stat_date": today - timedelta(days=i), "new_learned": i % 7,
+         "reviewed": i % 50, "correct_count": i % 40, "error_count": i % 9, "study_time": 0}
+        for i in range(365)
+    ])
+    db.commit()
+    
+    def override_get_db():
+        session = SessionLocal()
+        try:
+            yield session
+        finally:
+            session.close()
+    
+    app.dependency_overrides[get_db] = override_get_db
+    try:
+        client = TestClient(app)
+        start_time = time.time()
+        client.get(f"/api/decks/{deck.id}/activity?days=365")
+        first = (time.time() - start_time) * 1000
+        
+        start_time = time.time()
+        for _ in range(iterations):
+            client.get(f"/api/decks/{deck.id}/activity?days=365")
+        avg_time = (time.time() - start_time) / iterations * 1000
+    finally:
+        app.dependency_overrides.pop(get_db, None)
+    
+    print(f"首次查询: {first:.2f}ms，缓存命中平均: {avg_time:.2f}ms")
+    
+    return avg_time
+
 def run_all_benchmarks():
     """运行所有基准测试"""
     print("="*60)
@@ -140,9 +302,15 @@ def run_all_benchmarks():
             "get_words": benchmark_get_words(db, iterations=100),
             "get_review_words": benchmark_get_review_words(db, iterations=100),
             "get_error_words": benchmark_get_error_words(db, iterations=100),
-            "update_progress": benchmark_update_progress(db, iterations=100)
+            "update_progress": benchmark_update_progress(db, iterations=100),
+            "deck_activity": benchmark_deck_activity(db, iterations=100)
         }
         
+        # 整库重排（单位为秒，不计入平均响应时间）
+        benchmark_reschedule_deck(db, num_cards=100000)
+        benchmark_fsrs_optimizer(db)
+        benchmark_progress_stats(db)
+        
         # 总结
         print("\n" + "="*60)
         print("性能测试总结")
@@ -0,0 +1,57 @@
+"""
+按请求性能分析测试
+"""
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.profiling import ProfileStore, ProfilingMiddleware, ProfilingRoute
+
+def _busy(n: int) -> int:
+    return sum(i * i for i in range(n))
+
+def _make_app(store: ProfileStore) -> FastAPI:
+    app = FastAPI()
+    app.router.route_class = ProfilingRoute
+    app.add_middleware(ProfilingMiddleware, store=store)
+    
+    @app.get("/sync")
+    def sync_endpoint(n: int = 1000):
+        return {"total": _busy(n)}
+    
+    @app.get("/async")
+    async def async_endpoint():
+        return {"total": _busy(10)}
+    
+    return app
+
+def test_profile_only_when_requested(tmp_path):
+    """测试只有带请求头或查询参数的请求被分析，结果写入目录并可读取摘要"""
+    store = ProfileStore(str(tmp_path), max_files=5)
+    client = TestClient(_make_app(store))
+    
+    plain = client.get("/sync?n=5")
+    assert plain.json() == {"total": _busy(5)}
+    assert "x-profile-id" not in plain.headers
+    assert store.list() == []
+    
+    profiled = client.get("/sync", headers={"X-Profile": "1"})
+    profile_id = profiled.headers["x-profile-id"]
+    client.get("/async?profile=1")
+    
+    profiles = store.list()
+    assert [p["path"] for p in profiles] == ["/async", "/sync"]
+    assert profiles[1]["id"] == profile_id
+    assert profiles[1]["status"] == 200
+    # 同步端点在线程池线程中执行，也被分析到
+    assert "_busy" in store.summary(profile_id)
+    assert store.summary("missing") is None
+
+def test_profile_ring_is_bounded(tmp_path):
+    """测试超过上限时删除最旧的分析结果"""
+    store = ProfileStore(str(tmp_path), max_files=2)
+    client = TestClient(_make_app(store))
+    
+    ids = [client.get("/sync?profile=1").headers["x-profile-id"] for _ in range(4)]
+    
+    assert [p["id"] for p in store.list()] == ids[:1:-1]
+    assert len(list(tmp_path.iterdir())) == 4
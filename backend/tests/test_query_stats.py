@@ -0,0 +1,43 @@
+"""
+请求级 SQL 统计测试
+"""
+import logging
+
+from sqlalchemy import create_engine, text
+
+from app import query_stats
+
+def test_normalize_collapses_literals_and_in_lists():
+    """测试规范化后同一形状的语句相同"""
+    a = query_stats.normalize("SELECT * FROM words WHERE id IN (?, ?, ?) AND difficulty = 2")
+    b = query_stats.normalize("SELECT *  FROM words\nWHERE id IN (?) AND difficulty = 3")
+    assert a == b
+    assert query_stats.normalize("SELECT 'x' FROM t") == "SELECT ? FROM t"
+
+def test_track_counts_statements_and_warns_on_repeats(caplog):
+    """测试语句计数和 N+1 警告"""
+    engine = create_engine("sqlite://")
+    with engine.connect() as conn:
+        conn.execute(text("CREATE TABLE t (id INTEGER PRIMARY KEY)"))
+        with caplog.at_level(logging.WARNING, logger="app.query_stats"):
+            with query_stats.track("GET /test") as queries:
+                for i in range(query_stats.REPEAT_WARN_THRESHOLD + 1):
+                    conn.execute(text("SELECT id FROM t WHERE id = :id"), {"id": i})
+    
+    assert queries.count == query_stats.REPEAT_WARN_THRESHOLD + 1
+    assert queries.seconds > 0
+    assert queries.warned
+    assert "Possible N+1 in GET /test" in caplog.text
+    assert query_stats.current() is None
+
+def test_slow_query_logs_plan(caplog, monkeypatch):
+    """测试慢查询记录查询计划"""
+    monkeypatch.setattr(query_stats, "SLOW_QUERY_MS", 0.000001)
+    engine = create_engine("sqlite://")
+    with engine.connect() as conn:
+        conn.execute(text("CREATE TABLE t (id INTEGER PRIMARY KEY, v INTEGER)"))
+        with caplog.at_level(logging.WARNING, logger="app.query_stats"):
+            conn.execute(text("SELECT v FROM t WHERE id = :id"), {"id": 1})
+    
+    assert "Slow query" in caplog.text
+    assert "plan: SEARCH t USING INTEGER PRIMARY KEY" in caplog.text
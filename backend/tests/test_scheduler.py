@@ -0,0 +1,116 @@
+"""
+记忆调度引擎测试
+"""
+from datetime import date, timedelta
+
+import numpy as np
+
+from app import scheduler
+from app.scheduler import ProgressSnapshot, SchedulerParams
+
+def test_step_master_intervals():
+    """测试 StepMaster 与旧版固定间隔一致"""
+    card = ProgressSnapshot(1)
+    today = date(2024, 1, 1)
+    params = SchedulerParams(scheduler.STEP_MASTER)
+    
+    scheduler.apply_answers([card], [True], [params], today)
+    assert card.mastery_level == 1
+    assert card.next_review == today + timedelta(days=3)
+    
+    scheduler.apply_answers([card], [False], [params], today)
+    assert card.mastery_level == 0
+    assert card.error_count == 1
+    assert card.next_review == today
+
+def test_fsrs_new_card_uses_initial_stability():
+    """测试 FSRS 新卡片使用初始稳定性"""
+    s, d, _, interval = scheduler.fsrs_kernel(
+        np.zeros(2), np.zeros(2), np.zeros(2), np.array([3, 1])
+    )
+    w = scheduler.DEFAULT_FSRS_WEIGHTS
+    assert np.allclose(s, [w[2], w[0]])
+    assert d[1] > d[0]
+    assert interval[0] == round(w[2])
+
+def test_fsrs_recall_grows_and_lapse_shrinks_stability():
+    """测试 FSRS 答对稳定性增长、答错稳定性下降"""
+    stability = np.array([10.0, 10.0])
+    s, _, r, _ = scheduler.fsrs_kernel(
+        stability, np.array([5.0, 5.0]), np.array([10, 10]), np.array([3, 1])
+    )
+    assert np.allclose(r, 0.9)
+    assert s[0] > 10.0
+    assert s[1] < 10.0
+
+def test_sm2_interval_sequence():
+    """测试 SM-2 间隔序列 1 → 6 → 6*EF"""
+    card = ProgressSnapshot(1)
+    params = SchedulerParams(scheduler.SM2)
+    intervals = []
+    for _ in range(3):
+        scheduler.apply_answers([card], [True], [params], date(2024, 1, 1))
+        intervals.append(card.interval)
+    assert intervals == [1, 6, 15]
+    
+    scheduler.apply_answers([card], [False], [params], date(2024, 1, 1))
+    assert card.interval == 0
+    assert card.ease_factor == 250 - 54
+
+def test_apply_answers_repeated_card_in_order():
+    """测试同一卡片在一批中多次出现时按顺序生效"""
+    card = ProgressSnapshot(1)
+    params = SchedulerParams(scheduler.FSRS)
+    states = scheduler.apply_answers([card, card, card], [True, True, False], [params] * 3)
+    assert [state.mastery_level for state in states] == [1, 2, 1]
+    assert card.review_count == 3
+    assert card.error_count == 1
+
+def test_params_from_deck_fallbacks():
+    """测试词库参数解析的回退行为"""
+    assert SchedulerParams.from_deck(None).algorithm == scheduler.STEP_MASTER
+    assert SchedulerParams.from_deck("FSRS", "not json").weights == scheduler.DEFAULT_FSRS_WEIGHTS
+    assert SchedulerParams.from_deck("FSRS", "[1, 2]").weights == scheduler.DEFAULT_FSRS_WEIGHTS
+
+def test_fsrs_kernel_batched_weights_match_single():
+    """测试多组权重一次计算的结果与逐组计算一致"""
+    s, d = np.array([0.0, 3.0, 10.0]), np.array([0.0, 5.0, 7.0])
+    t, g = np.array([0, 4, 12]), np.array([3, 1, 3])
+    w1 = np.array(scheduler.DEFAULT_FSRS_WEIGHTS)
+    w2 = w1 * 1.1
+    batched = scheduler.fsrs_kernel(
+        np.stack([s, s]), np.stack([d, d]), t, g, np.stack([w1, w2], axis=1)[:, :, None]
+    )
+    for i, w in enumerate([w1, w2]):
+        single = scheduler.fsrs_kernel(s, d, t, g, w)
+        for a, b in zip(batched, single):
+            assert np.allclose(a[i], b)
+
+def test_fsrs_optimizer_reduces_loss():
+    """测试参数优化在模拟历史上降低对数损失"""
+    from app import fsrs_optimizer
+    
+    rng = np.random.default_rng(0)
+    true_weights = np.array(scheduler.DEFAULT_FSRS_WEIGHTS)
+    true_weights[:4] *= 3
+    elapsed, grades, starts = [], [], []
+    for _ in range(500):
+        starts.append(len(grades))
+        s, d, t = np.zeros(1), np.zeros(1), 0
+        for k in range(6):
+            r = scheduler.fsrs_kernel(s, d, np.array([t]), np.array([3]), true_weights)[2][0]
+            g = 3 if k == 0 or rng.random() < r else 1
+            elapsed.append(t)
+            grades.append(g)
+            s, d, _, interval = scheduler.fsrs_kernel(s, d, np.array([t]), np.array([g]), true_weights)
+            t = int(max(1, interval[0] * rng.uniform(0.5, 2)))
+    
+    history = fsrs_optimizer.ReviewHistory(
+        np.array(elapsed, dtype=np.int32), np.array(grades, dtype=np.int8), np.array(starts)
+    )
+    assert history.train_count == 500 * 5
+    before = fsrs_optimizer.evaluate(history, scheduler.DEFAULT_FSRS_WEIGHTS)
+    weights = fsrs_optimizer.fit(history, epochs=3, block_size=128)
+    assert fsrs_optimizer.evaluate(history, weights) < before
+    assert np.all(weights >= fsrs_optimizer.WEIGHT_BOUNDS[:, 0])
+    assert np.all(weights <= fsrs_optimizer.WEIGHT_BOUNDS[:, 1])
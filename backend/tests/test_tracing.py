@@ -0,0 +1,78 @@
+"""
+请求追踪测试
+"""
+import json
+
+from app import tracing
+from app.tracing import Trace, TraceBuffer
+
+def _finished_trace(name: str, duration_ms: float) -> Trace:
+    trace = Trace()
+    root = trace.root = trace.start_span(name, None)
+    root.end_ns = root.start_ns + int(duration_ms * 1e6)
+    return trace
+
+def test_spans_nest_under_current_span():
+    """测试 span 按上下文嵌套，追踪外调用不记录"""
+    @tracing.traced()
+    def inner():
+        return tracing.current_span()
+    
+    assert inner() is None
+    
+    trace = Trace()
+    root = trace.root = trace.start_span("root", None)
+    token = tracing._current.set(root)
+    try:
+        with tracing.span("outer", step=1) as outer:
+            inner_span = inner()
+    finally:
+        tracing._current.reset(token)
+    
+    assert inner_span.name == "test_tracing.inner"
+    assert inner_span.parent_id == outer.span_id
+    assert outer.parent_id == root.span_id
+    assert outer.attributes == {"step": 1}
+    assert outer.end_ns is not None
+    assert tracing.current_span() is None
+
+def test_buffer_keeps_recent_and_slowest(tmp_path):
+    """测试缓冲保留最近和最慢的追踪，并导出 OTLP JSON"""
+    export = tmp_path / "traces.jsonl"
+    buffer = TraceBuffer(size=3, slowest=2, export_path=str(export))
+    traces = [_finished_trace(f"t{i}", ms) for i, ms in enumerate([50, 5, 80, 1, 2])]
+    for trace in traces:
+        buffer.add(trace)
+    
+    assert [t.root.name for t in buffer.recent()] == ["t4", "t3", "t2"]
+    assert [t.root.name for t in buffer.slowest()] == ["t2", "t0"]
+    assert buffer.get(traces[0].trace_id) is traces[0]
+    assert buffer.get(traces[1].trace_id) is None
+    
+    buffer.close()
+    lines = export.read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 5
+    span = json.loads(lines[0])["resourceSpans"][0]["scopeSpans"][0]["spans"][0]
+    assert span["traceId"] == traces[0].trace_id
+    assert int(span["endTimeUnixNano"]) - int(span["startTimeUnixNano"]) == 50_000_000
+
+def test_span_limit_counts_dropped(monkeypatch):
+    """测试单个追踪的 span 数量上限"""
+    monkeypatch.setattr(tracing, "TRACE_MAX_SPANS", 2)
+    trace = Trace()
+    trace.root = trace.start_span("root", None)
+    trace.start_span("a", trace.root.span_id)
+    assert trace.start_span("b", trace.root.span_id) is None
+    assert trace.dropped == 1
+
+def test_unsampled_requests_are_not_traced():
+    """测试未被抽中的请求不创建追踪"""
+    import asyncio
+
+    async def app(scope, receive, send):
+        assert tracing.current_span() is None
+
+    buffer = TraceBuffer(size=3, slowest=2, export_path="")
+    middleware = tracing.TracingMiddleware(app, buffer=buffer, sample_rate=0.0)
+    asyncio.run(middleware({"type": "http", "method": "GET", "path": "/"}, None, None))
+    assert buffer.recent() == []
@@ -112,6 +112,15 @@ export default {
     })
   },
 
+  /**
+   * 批量检查拼写（answers: [{ word_id, input }]）
+   */
+  checkSpellingBatch(answers) {
+    return apiClient.post('/spell/check-batch', {
+      items: answers
+    })
+  },
+
   /**
    * 获取学习进度
    */
@@ -172,6 +181,15 @@ export default {
     return apiClient.get('/progress/review-count')
   },
 
+  /**
+   * 获取词库学习热力图（最近 days 天每天的答题数和正确率）
+   */
+  getDeckActivity(deckId, days = 365) {
+    return apiClient.get(`/decks/${deckId}/activity`, {
+      params: { days }
+    })
+  },
+
   /**
    * 上传自定义词库（优化：单独配置更长超时）
    */